@@ -1 +0,0 @@
-import tensorflow as tf
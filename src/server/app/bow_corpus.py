@@ -0,0 +1,118 @@
+import os
+from typing import Iterable, List, Tuple
+
+import numpy as np
+
+# File suffixes of the three CSR arrays making up a saved corpus.
+# indptr[i]:indptr[i + 1] is the slice of indices/counts holding document i.
+_INDPTR_SUFFIX = ".indptr.npy"
+_INDICES_SUFFIX = ".indices.bin"
+_COUNTS_SUFFIX = ".counts.bin"
+# Token ids and token counts are stored as 32 bit ints. indptr is 64 bit so
+# the total number of nonzeros is unbounded.
+_VALUE_DTYPE = np.int32
+_INDPTR_DTYPE = np.int64
+# Number of documents buffered in memory before they are written to disk.
+_WRITE_BATCH_SIZE = 10000
+# Number of documents sliced out of the memory map at a time when iterating.
+_READ_BATCH_SIZE = 1000
+
+
+def bow_corpus_exists(path: str) -> bool:
+    '''Return True if a complete corpus has been saved under path.
+
+    The indptr file is written last, so its presence marks a finished save.
+    '''
+    return os.path.exists(path + _INDPTR_SUFFIX)
+
+
+def save_bow_corpus(path: str, corpus: Iterable[List[Tuple[int, int]]]):
+    '''Serialize a bag-of-words corpus to CSR arrays on disk.
+
+    corpus may be any iterable of BoW documents, e.g. a list or a
+    modelling.BowStream. Documents are consumed and written in batches, so
+    the corpus never has to be held in memory. Files are written to
+    temporary names and moved into place once complete.
+    '''
+    indptr = [0]
+    indices_tmp = path + _INDICES_SUFFIX + ".tmp"
+    counts_tmp = path + _COUNTS_SUFFIX + ".tmp"
+    indptr_tmp = path + ".indptr.tmp.npy"
+    with open(indices_tmp, 'wb') as indices_out, \
+            open(counts_tmp, 'wb') as counts_out:
+        ids, counts = [], []
+
+        def flush():
+            indices_out.write(np.asarray(ids, dtype=_VALUE_DTYPE).tobytes())
+            counts_out.write(np.asarray(counts, dtype=_VALUE_DTYPE).tobytes())
+            ids.clear()
+            counts.clear()
+
+        for n_docs, doc in enumerate(corpus, start=1):
+            for token_id, count in doc:
+                ids.append(token_id)
+                counts.append(count)
+            indptr.append(indptr[-1] + len(doc))
+            if n_docs % _WRITE_BATCH_SIZE == 0:
+                flush()
+        flush()
+    np.save(indptr_tmp, np.asarray(indptr, dtype=_INDPTR_DTYPE))
+    os.replace(indices_tmp, path + _INDICES_SUFFIX)
+    os.replace(counts_tmp, path + _COUNTS_SUFFIX)
+    os.replace(indptr_tmp, path + _INDPTR_SUFFIX)
+
+
+def _load_values(path: str, nnz: int) -> np.ndarray:
+    if nnz == 0:
+        return np.empty(0, dtype=_VALUE_DTYPE)
+    return np.memmap(path, dtype=_VALUE_DTYPE, mode='r', shape=(nnz, ))
+
+
+class MmapBowCorpus:
+    '''Read-only bag-of-words corpus backed by memory-mapped CSR arrays.
+
+    Loading only maps the files written by save_bow_corpus(), so it takes
+    milliseconds regardless of corpus size. Supports len(), iteration, and
+    random access to document i via corpus[i]. The mapped pages are shared
+    through the OS page cache, so worker processes reading the same files
+    do not each hold a copy. Pickling the corpus only pickles its path.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        self.indptr = np.load(path + _INDPTR_SUFFIX, mmap_mode='r')
+        nnz = int(self.indptr[-1])
+        self.indices = _load_values(path + _INDICES_SUFFIX, nnz)
+        self.counts = _load_values(path + _COUNTS_SUFFIX, nnz)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i: int) -> List[Tuple[int, int]]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"document {i} out of range")
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return list(
+            zip(self.indices[start:end].tolist(),
+                self.counts[start:end].tolist()))
+
+    def __iter__(self):
+        n_docs = len(self)
+        for first in range(0, n_docs, _READ_BATCH_SIZE):
+            last = min(first + _READ_BATCH_SIZE, n_docs)
+            bounds = self.indptr[first:last + 1].tolist()
+            offset = bounds[0]
+            ids = self.indices[offset:bounds[-1]].tolist()
+            counts = self.counts[offset:bounds[-1]].tolist()
+            for start, end in zip(bounds, bounds[1:]):
+                yield list(
+                    zip(ids[start - offset:end - offset],
+                        counts[start - offset:end - offset]))
@@ -0,0 +1,218 @@
+import os
+import sqlite3
+import logging
+import threading
+import contextlib
+from typing import Iterator, List, Optional
+
+from flask import current_app
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Every connection waits up to this long for a lock held by another
+# connection, e.g. the write lock or a WAL checkpoint, before failing with
+# "database is locked".
+_BUSY_TIMEOUT_MS = 30000
+# Compiled statements cached per connection by the sqlite3 module. Pooled
+# connections outlive requests, so each query is prepared once per
+# connection rather than once per request.
+_STATEMENT_CACHE_SIZE = 256
+# Pragmas of the read-only connections. query_only rejects writes.
+# cache_size is per connection, in KiB when negative. Reads of the first
+# mmap_size bytes of the DB file go through a memory map, whose pages are
+# shared with every other connection and process through the OS page cache.
+_READ_PRAGMAS = {
+    "query_only": "ON",
+    "cache_size": "-65536",  # 64 MiB.
+    "mmap_size": str(1 << 30),
+    "temp_store": "MEMORY",
+    "busy_timeout": str(_BUSY_TIMEOUT_MS),
+}
+# Pragmas of the writer connection. In WAL mode synchronous=NORMAL only
+# syncs at checkpoints, commits stay durable across application crashes.
+# Foreign keys are enforced as by schema.sql. Temp tables and the sorts of
+# index builds stay in memory, temp_store can not be changed per load.
+_WRITE_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "foreign_keys": "ON",
+    "temp_store": "MEMORY",
+    "busy_timeout": str(_BUSY_TIMEOUT_MS),
+}
+# Max number of idle read connections kept per process. Readers beyond
+# this are closed when released.
+_MAX_IDLE_READERS = 8
+# Key used to store the pool in app.extensions.
+_EXTENSION_KEY = "db_pool"
+
+
+def enable_wal(database: str):
+    '''Switch the database to write-ahead logging.
+
+    In WAL mode readers see the last committed state and are never blocked
+    by a writer, e.g. a running ingest. The mode is stored in the DB file,
+    so this only has to succeed once per database.
+    '''
+    conn = sqlite3.connect(database, timeout=_BUSY_TIMEOUT_MS / 1000.0)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+    finally:
+        conn.close()
+
+
+def connect(database: str,
+            readonly: bool = False,
+            check_same_thread: bool = True) -> sqlite3.Connection:
+    '''Open a connection with the read or the write pragmas.
+
+    Rows are returned as sqlite3.Row, declared types are parsed.
+    '''
+    conn = sqlite3.connect(database,
+                           detect_types=sqlite3.PARSE_DECLTYPES,
+                           timeout=_BUSY_TIMEOUT_MS / 1000.0,
+                           cached_statements=_STATEMENT_CACHE_SIZE,
+                           check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    for name, value in (_READ_PRAGMAS if readonly else _WRITE_PRAGMAS).items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    '''Per process sqlite connections to one database.
+
+    Read-only connections are borrowed with acquire() and handed back with
+    release(), up to _MAX_IDLE_READERS are kept open for reuse, so their
+    page cache and compiled statements survive across requests. Any number
+    of threads can read at the same time.
+
+    Writes go through writer(), which hands out the single writer
+    connection of the process to one thread at a time. Writers in other
+    processes, e.g. a `flask init-db`, are serialized by sqlite's write
+    lock and waited for up to _BUSY_TIMEOUT_MS.
+    '''
+
+    def __init__(self, database: str,
+                 max_idle: int = _MAX_IDLE_READERS):
+        self.database = database
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Connections must not be used across a fork, e.g. of a preloaded
+        # gunicorn app. The child starts with an empty pool.
+        self._pid = os.getpid()
+        self._idle = []
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._write_depth = 0
+        self._wal_enabled = False
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _ensure_wal(self):
+        if self._wal_enabled:
+            return
+        try:
+            enable_wal(self.database)
+            self._wal_enabled = True
+        except sqlite3.OperationalError as e:
+            # E.g. a read-only DB file. Keep working in the current journal
+            # mode, and try again with the next connection.
+            logger.warning("Could not enable WAL for %s: %s", self.database,
+                           e)
+
+    def acquire(self) -> sqlite3.Connection:
+        '''Return an idle read-only connection, opening one if none is idle.
+        '''
+        with self._lock:
+            self._check_pid()
+            self._ensure_wal()
+            conn = self._idle.pop() if self._idle else None
+        metrics.cache_lookup("db_read_connections", conn is not None)
+        if conn is None:
+            conn = connect(self.database,
+                           readonly=True,
+                           check_same_thread=False)
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        '''Return a connection borrowed with acquire() to the pool.
+        '''
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextlib.contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        '''Borrow the writer connection of the process.
+
+        Blocks while another thread holds it. The block's changes are
+        committed when it exits, or rolled back on error. Nested blocks in
+        the same thread share the connection and only the outermost one
+        commits.
+        '''
+        with self._lock:
+            self._check_pid()
+            write_lock = self._write_lock
+        with write_lock:
+            with self._lock:
+                self._ensure_wal()
+                if self._writer is None:
+                    self._writer = connect(self.database,
+                                           check_same_thread=False)
+                conn = self._writer
+            self._write_depth += 1
+            try:
+                yield conn
+                if self._write_depth == 1:
+                    conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self._write_depth -= 1
+
+    def close(self):
+        '''Close every idle connection and the writer.
+        '''
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+                return
+            conns: List[sqlite3.Connection] = self._idle
+            if self._writer is not None:
+                conns.append(self._writer)
+            self._idle, self._writer = [], None
+            self._wal_enabled = False
+        for conn in conns:
+            conn.close()
+
+
+def get_pool() -> ConnectionPool:
+    '''Return the connection pool of the current Flask app.
+
+    A new pool is created if the DATABASE config changed since the last
+    call.
+    '''
+    pool: Optional[ConnectionPool] = current_app.extensions.get(_EXTENSION_KEY)
+    if pool is None or pool.database != current_app.config['DATABASE']:
+        pool = ConnectionPool(current_app.config['DATABASE'])
+        current_app.extensions[_EXTENSION_KEY] = pool
+    return pool
+
+
+def init_app(app):
+    '''Called from db.init_app().
+
+    Creates the connection pool shared by every request of the process.
+    '''
+    app.extensions[_EXTENSION_KEY] = ConnectionPool(app.config['DATABASE'])
@@ -0,0 +1,175 @@
+import bisect
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+from . import metrics
+from . import sql_strings
+
+# Kinds of corpus_stats rows. _CORPUS covers every document and _CUISINES
+# every document of any cuisine keyword, _CUISINE and _TAG have one row per
+# cuisine keyword and per tag.
+_CORPUS = "corpus"
+_CUISINES = "cuisines"
+_CUISINE = "cuisine"
+_TAG = "tag"
+# Kinds recomputed when the doc_cuisines table changes, see
+# cuisines.refresh_doc_cuisines().
+_CUISINE_KINDS = (_CUISINES, _CUISINE)
+# Upper bounds, in characters, of the document length histogram buckets.
+# Bucket i holds the documents no longer than _LENGTH_BUCKETS[i], the last
+# bucket every longer document.
+_LENGTH_BUCKETS = (250, 500, 1000, 2000, 4000, 8000)
+
+# (stats, histogram) aggregate queries of each kind.
+_KIND_STATEMENTS = {
+    _CORPUS: (sql_strings._CORPUS_STATS_ALL,
+              sql_strings._CORPUS_LENGTH_HIST_ALL),
+    _CUISINES: (sql_strings._CORPUS_STATS_CUISINES,
+                sql_strings._CORPUS_LENGTH_HIST_CUISINES),
+    _CUISINE: (sql_strings._CORPUS_STATS_BY_CUISINE,
+               sql_strings._CORPUS_LENGTH_HIST_BY_CUISINE),
+    _TAG: (sql_strings._CORPUS_STATS_BY_TAG, None),
+}
+
+
+def length_bucket(length: int) -> int:
+    '''Return the histogram bucket of a document length.
+    '''
+    return bisect.bisect_left(_LENGTH_BUCKETS, length)
+
+
+def bucket_label(bucket: int) -> str:
+    '''Return a readable character range for a histogram bucket.
+    '''
+    if bucket >= len(_LENGTH_BUCKETS):
+        return "> {}".format(_LENGTH_BUCKETS[-1])
+    if bucket == 0:
+        return "<= {}".format(_LENGTH_BUCKETS[0])
+    return "{}-{}".format(_LENGTH_BUCKETS[bucket - 1] + 1,
+                          _LENGTH_BUCKETS[bucket])
+
+
+def _fill_doc_lengths(db, doc_ids: Optional[Iterable[int]] = None):
+    '''Fill the doc_lengths temp table with every document, or doc_ids.
+    '''
+    db.create_function("length_bucket", 1, length_bucket, deterministic=True)
+    db.execute(sql_strings._CREATE_TEMP_DOC_LENGTHS)
+    db.execute(sql_strings._DELETE_TEMP_DOC_LENGTHS)
+    where = ""
+    if doc_ids is not None:
+        db.execute(sql_strings._CREATE_TEMP_STATS_DOC_IDS)
+        db.execute(sql_strings._DELETE_TEMP_STATS_DOC_IDS)
+        db.executemany(sql_strings._INSERT_TEMP_STATS_DOC_IDS,
+                       [(x, ) for x in doc_ids])
+        where = sql_strings._WHERE_STATS_DOC_IDS
+    db.execute(sql_strings._INSERT_TEMP_DOC_LENGTHS.format(where=where))
+
+
+@metrics.timed("db.refresh_corpus_stats")
+def refresh_corpus_stats(db, kinds: Optional[Iterable[str]] = None):
+    '''Recompute the corpus_stats and corpus_length_hist rows of kinds.
+
+    Defaults to every kind. Each kind is one aggregate query over the
+    corpus, doc_tags and doc_cuisines tables, so the cost is paid once per
+    ingest instead of on every request. Document lengths are measured on
+    the text of modelling.concat_doc_text(). Does not commit.
+    '''
+    db.execute(sql_strings._CREATE_CORPUS_STATS)
+    db.execute(sql_strings._CREATE_CORPUS_LENGTH_HIST)
+    _fill_doc_lengths(db)
+    for kind in _KIND_STATEMENTS if kinds is None else kinds:
+        stats_sql, hist_sql = _KIND_STATEMENTS[kind]
+        db.execute(sql_strings._DELETE_CORPUS_STATS_BY_KIND, (kind, ))
+        db.execute(sql_strings._DELETE_CORPUS_LENGTH_HIST_BY_KIND, (kind, ))
+        db.execute(sql_strings._INSERT_CORPUS_STATS.format(select=stats_sql),
+                   (kind, ))
+        if hist_sql is not None:
+            db.execute(
+                sql_strings._INSERT_CORPUS_LENGTH_HIST.format(
+                    select=hist_sql), (kind, ))
+    db.execute(sql_strings._DELETE_TEMP_DOC_LENGTHS)
+
+
+def has_corpus_stats(db) -> bool:
+    '''Return whether the statistics were computed, see
+    refresh_corpus_stats().
+    '''
+    try:
+        return db.execute(sql_strings._SELECT_CORPUS_STATS,
+                          (_CORPUS, "")).fetchone() is not None
+    except sqlite3.OperationalError:
+        return False
+
+
+@metrics.timed("db.update_corpus_stats")
+def update_corpus_stats(db,
+                        doc_ids: Iterable[int],
+                        kinds: Optional[Iterable[str]] = None,
+                        sign: int = 1):
+    '''Add (sign=1) or remove (sign=-1) documents from the statistics of
+    kinds.
+
+    Defaults to every kind. Run it after the documents and their tags and
+    cuisines were inserted, or before they are deleted. Only the rows of
+    doc_ids are aggregated, so the cost is proportional to them rather
+    than to the corpus. Does nothing if the statistics were never
+    computed. Does not commit.
+    '''
+    doc_ids = list(doc_ids)
+    if not doc_ids or not has_corpus_stats(db):
+        return
+    _fill_doc_lengths(db, doc_ids)
+    for kind in _KIND_STATEMENTS if kinds is None else kinds:
+        stats_sql, hist_sql = _KIND_STATEMENTS[kind]
+        db.execute(sql_strings._ADD_CORPUS_STATS.format(select=stats_sql),
+                   (sign, sign, kind))
+        if hist_sql is not None:
+            db.execute(
+                sql_strings._ADD_CORPUS_LENGTH_HIST.format(select=hist_sql),
+                (sign, kind))
+    db.execute(sql_strings._DELETE_EMPTY_CORPUS_STATS)
+    db.execute(sql_strings._DELETE_EMPTY_CORPUS_LENGTH_HIST)
+    db.execute(sql_strings._DELETE_TEMP_DOC_LENGTHS)
+    db.execute(sql_strings._DELETE_TEMP_STATS_DOC_IDS)
+
+
+@metrics.timed("db.read_corpus_stats")
+def read_corpus_stats(db, cuisine: Optional[str] = None) -> Optional[dict]:
+    '''Return the statistics of the cuisine corpus, or of one cuisine.
+
+    The returned dict holds `n_docs`, `avg_doc_length`, the `length_hist`
+    as (bucket label, n_docs) pairs, and `n_corpus_docs`, the size of the
+    whole corpus. Every value is read by primary key. Returns None if the
+    statistics have not been computed, e.g. in a DB loaded before they
+    existed.
+    '''
+    kind, name = (_CUISINES, "") if cuisine is None else (_CUISINE, cuisine)
+    try:
+        total = db.execute(sql_strings._SELECT_CORPUS_STATS,
+                           (_CORPUS, "")).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    if total is None:
+        return None
+    row = db.execute(sql_strings._SELECT_CORPUS_STATS, (kind, name)).fetchone()
+    n_docs, total_length = (0, 0) if row is None else row
+    hist = dict(
+        db.execute(sql_strings._SELECT_CORPUS_LENGTH_HIST,
+                   (kind, name)).fetchall())
+    return {
+        "n_docs": n_docs,
+        "avg_doc_length": total_length / n_docs if n_docs else 0.0,
+        "length_hist": [(bucket_label(x), hist.get(x, 0))
+                        for x in range(len(_LENGTH_BUCKETS) + 1)],
+        "n_corpus_docs": total[0],
+    }
+
+
+def read_top_counts(db, kind: str, n: int) -> List[Tuple[str, int]]:
+    '''Return the (name, n_docs) of the n cuisines or tags of kind with the
+    most documents.
+    '''
+    return [
+        tuple(row)
+        for row in db.execute(sql_strings._SELECT_CORPUS_STATS_TOP, (kind, n))
+    ]
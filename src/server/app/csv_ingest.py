@@ -1,10 +1,9 @@
+import logging
 import pandas
 import numpy
-from typing import List
-from transformers import GPT2Tokenizer
-from transformers import BertTokenizer
-from transformers import BertModel
-from transformers import OpenAIGPTTokenizer
+from typing import Iterator, List
+
+logger = logging.getLogger(__name__)
 
 
 def convert_bp_encoded_fields(value: str) -> List[int]:
@@ -19,6 +18,10 @@ def IngestPpData(path: str) -> pandas.DataFrame:
     efficient than just using the raw text .csv.
     '''
 
+    # transformers pulls in torch, only import it when the deprecated data
+    # is actually read.
+    from transformers import OpenAIGPTTokenizer
+    # from transformers import BertTokenizer
     # tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
     tokenizer = OpenAIGPTTokenizer.from_pretrained('openai-gpt')
     pp_recipes_df = pandas.read_csv(path,
@@ -30,43 +33,28 @@ def IngestPpData(path: str) -> pandas.DataFrame:
                                         "steps_tokens":
                                         convert_bp_encoded_fields,
                                     })
-    print("PP Recipes DF\n{}\n{}".format(pp_recipes_df.columns, pp_recipes_df))
-    print("PP Recipes DF name_tokens {}".format(
-        pp_recipes_df['name_tokens'].iloc[:10].values.flatten().tolist()))
-    test = [
-        tokenizer.decode(x)
-        for x in pp_recipes_df['name_tokens'].iloc[:20].values
-    ]
-    print("Tokenizer output{}".format(test))
+    logger.debug("PP Recipes DF\n%s\n%s", pp_recipes_df.columns,
+                 pp_recipes_df)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Tokenizer output %s", [
+            tokenizer.decode(x)
+            for x in pp_recipes_df['name_tokens'].iloc[:20].values
+        ])
     pp_recipes_df['name_tokens'] = pp_recipes_df['name_tokens'].apply(
         tokenizer.decode)
     pp_recipes_df.sort_values(['name_tokens'], inplace=True)
-    print("PP Recipes DF name_tokens2 {} {}".format(
-        type(pp_recipes_df['name_tokens'].iloc[0]),
-        pp_recipes_df['name_tokens'].iloc[:20]))
+    logger.debug("PP Recipes DF name_tokens %s",
+                 pp_recipes_df['name_tokens'].iloc[:20])
 
     return pp_recipes_df
 
 
-def IngestRawData(path: str) -> pandas.DataFrame:
-    '''Read the .csv file containing recipe data from food.com.
+def IterRawData(path: str, chunksize: int) -> Iterator[pandas.DataFrame]:
+    '''Read the .csv file containing recipe data from food.com in chunks.
 
-    Data is returned as a pandas dataframe. Key columns are
-    name, description, steps, tags, ingredients.
+    Yields dataframes of at most chunksize rows, in file order. Key columns
+    are name, description, steps, tags, ingredients. Only one chunk is held
+    in memory.
     '''
-
-    raw_recipes_df = pandas.read_csv(path)
-    raw_recipes_df.sort_values(['name'], inplace=True)
-    print("RAW Recipes DF name {} {}".format(
-        type(raw_recipes_df['name'].iloc[0]),
-        raw_recipes_df['name'].iloc[:20]))
-    print("RAW Recipes DF description {} {}".format(
-        type(raw_recipes_df['description'].iloc[0]),
-        raw_recipes_df[['name',
-                        'description']].iloc[:5].values.flatten().tolist()))
-    print("RAW Recipes DF steps {} {}".format(
-        type(raw_recipes_df['steps'].iloc[0]),
-        raw_recipes_df['steps'].iloc[:5].values.tolist()))
-    print("RAW Recipes DF\n{}\n{}".format(raw_recipes_df.columns,
-                                          raw_recipes_df))
-    return raw_recipes_df
+    with pandas.read_csv(path, chunksize=chunksize) as reader:
+        yield from reader
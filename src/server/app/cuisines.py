@@ -0,0 +1,127 @@
+from typing import Dict, Iterable, List, Optional
+
+from flask import current_app, has_app_context
+
+from . import corpus_stats
+from . import sql_strings
+
+# Keywords identifying the cuisines of interest, used to select the cuisine
+# corpus from the DB. A document belongs to a cuisine keyword if one of its
+# tags contains the keyword, so some are only tag fragments ("mexic",
+# "middle-e"). Each keyword maps to the whole words, as they appear in the
+# documents, whose stems steer the topic model towards it, see
+# modelling.create_eta() and modelling.keyword_prior_tokens(). A fragment
+# stems to a token no document contains, or to a common one ("middle-e" to
+# "middl"), so it can not be used itself.
+# Override with the CUISINE_KEYWORDS app config value, a mapping like this
+# one or a list of keywords that are their own prior word.
+_CUISINE_KEYWORDS = {
+    "asia": ["asian"],
+    "thai": ["thai"],
+    "chinese": ["chinese"],
+    "korea": ["korea", "korean"],
+    "viet": ["viet", "vietnam", "vietnamese"],
+    "singapore": ["singapore", "singaporean"],
+    "italy": ["italy"],
+    "italian": ["italian"],
+    "european": ["european"],
+    "french": ["french"],
+    "mexican": ["mexican"],
+    "mexic": ["mexico"],
+    "france": ["france"],
+    "british": ["british"],
+    "britain": ["britain"],
+    "mediterranean": ["mediterranean"],
+    "africa": ["africa", "african"],
+    "kenya": ["kenya", "kenyan"],
+    "israel": ["israel", "israeli"],
+    "middle-e": [],
+    "india": ["india", "indian"],
+    "halal": ["halal"],
+    "arab": ["arab", "arabian"],
+    "egyptian": ["egypt", "egyptian"],
+    "japan": ["japan", "japanese"],
+    "german": ["german"],
+    # "american": ["american"],
+}
+
+
+def _get_keyword_map() -> Dict[str, List[str]]:
+    keywords = _CUISINE_KEYWORDS
+    if has_app_context():
+        keywords = current_app.config.get('CUISINE_KEYWORDS', keywords)
+    if isinstance(keywords, dict):
+        return {k: list(v) for k, v in keywords.items()}
+    return {x: [x] for x in keywords}
+
+
+def get_keywords() -> List[str]:
+    '''Return the configured cuisine keywords.
+
+    Uses the CUISINE_KEYWORDS app config value when called inside an app
+    context, _CUISINE_KEYWORDS otherwise.
+    '''
+    return list(_get_keyword_map())
+
+
+def get_prior_keywords() -> List[str]:
+    '''Return the words of the configured cuisine keywords that steer the
+    topic model, see _CUISINE_KEYWORDS.
+    '''
+    words = []
+    for x in _get_keyword_map().values():
+        words.extend(x)
+    return list(dict.fromkeys(words))
+
+
+def refresh_doc_cuisines(db,
+                         keywords: Iterable[str],
+                         doc_ids: Optional[Iterable[int]] = None,
+                         update_stats: bool = True):
+    '''Bring the doc_cuisines membership table up to date.
+
+    Without doc_ids only the difference between `keywords` and the keywords
+    already materialized is applied: rows of removed keywords are deleted
+    and rows for new keywords are inserted. With doc_ids the membership of
+    just those documents is recomputed, e.g. after they were re-ingested.
+    Tag matching runs over the small tags table, the doc_tags rows are then
+    found through the tag_id index. The cuisine statistics are recomputed
+    in the same transaction, see corpus_stats.refresh_corpus_stats(), or
+    for doc_ids only updated with those documents, see
+    corpus_stats.update_corpus_stats(). Pass update_stats=False if the
+    caller recomputes every statistic afterwards anyway.
+    Does not commit, run it in a db.write_db() block.
+    '''
+    keywords = list(dict.fromkeys(keywords))
+    db.execute(sql_strings._CREATE_DOC_CUISINES)
+    db.execute(sql_strings._CREATE_DOC_CUISINES_INDEX)
+    if doc_ids is None:
+        existing = {
+            row[0]
+            for row in db.execute(sql_strings._SELECT_CUISINE_KEYWORDS)
+        }
+        db.executemany(sql_strings._DELETE_DOC_CUISINES_BY_CUISINE,
+                       [(x, ) for x in existing.difference(keywords)])
+        db.executemany(sql_strings._INSERT_DOC_CUISINES,
+                       [(x, x) for x in keywords if x not in existing])
+        if update_stats:
+            corpus_stats.refresh_corpus_stats(db,
+                                              corpus_stats._CUISINE_KINDS)
+    else:
+        doc_ids = list(doc_ids)
+        if update_stats:
+            corpus_stats.update_corpus_stats(db,
+                                             doc_ids,
+                                             corpus_stats._CUISINE_KINDS,
+                                             sign=-1)
+        db.execute(sql_strings._CREATE_TEMP_REFRESH_DOC_IDS)
+        db.execute(sql_strings._DELETE_TEMP_REFRESH_DOC_IDS)
+        db.executemany(sql_strings._INSERT_TEMP_REFRESH_DOC_IDS,
+                       [(x, ) for x in doc_ids])
+        db.execute(sql_strings._DELETE_DOC_CUISINES_BY_REFRESH_DOC_IDS)
+        db.executemany(sql_strings._INSERT_DOC_CUISINES_FOR_REFRESH_DOC_IDS,
+                       [(x, x) for x in keywords])
+        db.execute(sql_strings._DELETE_TEMP_REFRESH_DOC_IDS)
+        if update_stats:
+            corpus_stats.update_corpus_stats(db, doc_ids,
+                                             corpus_stats._CUISINE_KINDS)
@@ -1,203 +1,574 @@
+from __future__ import annotations
+
 import sqlite3
 import os
-import itertools
+import hashlib
+import logging
+import random
+import time
 import click
 import numpy as np
-import pandas as pd
+from typing import Iterable, Iterator, List, Optional, TYPE_CHECKING
 
 from flask import current_app, g
 from flask.cli import with_appcontext
-from . import csv_ingest
+from . import connections
+from . import corpus_stats
+from . import cuisines
+from . import metrics
+from . import sampling
 from . import sql_strings
 
+# pandas is imported by the functions that use it, keeping app startup and
+# the CLI fast. See bench/startup.py.
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Number of rows fetched from the sqlite cursor at a time when streaming
+# the corpus. Bounds the amount of raw document text held in memory.
+_STREAM_BATCH_SIZE = 10000
+# Number of rows fetched from the sqlite cursor at a time by iter_doc_page().
+_PAGE_FETCH_SIZE = 500
+# Text columns concatenated into a single document, in order.
+_DOC_TEXT_COLUMNS = ("document_name", "description", "steps", "tags")
+# Number of RAW_recipes.csv rows read and inserted at a time by init-db.
+_INGEST_CHUNK_ROWS = 20000
+# RAW_recipes columns hashed into corpus.content_hash, see content_hashes().
+# The stored copy of each is selected by
+# sql_strings._SELECT_DOCS_WITHOUT_CONTENT_HASH in the same order.
+_CONTENT_COLUMNS = ("name", "description", "tags", "contributor_id", "steps",
+                    "ingredients", "n_ingredients")
+# Number of content hashes computed and written at a time when backfilling
+# a DB built before they were stored.
+_HASH_BATCH_ROWS = 10000
+# Columns of the rows returned by the sampling module.
+_SAMPLE_COLUMNS = [
+    "doc_id", "document_name", "description", "tags", "steps", "ingredients",
+    "third_party_id"
+]
+
 
 def get_db():
-    '''Get sqlite3 databse connection object.
+    '''Get a read-only sqlite3 databse connection object.
+
+    The connection is borrowed from the connection pool of the process for
+    the rest of the app context, see connections.ConnectionPool. Writes
+    must go through write_db().
     '''
     if 'db' not in g:
-        g.db = sqlite3.connect(current_app.config['DATABASE'],
-                               detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        g.db = connections.get_pool().acquire()
 
     return g.db
 
 
 def close_db(e=None):
-    '''Close a sqlite3 databse connection object.
+    '''Return the connection of get_db() to the connection pool.
     '''
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        connections.get_pool().release(db)
+
+
+def write_db():
+    '''Context manager borrowing the single writer connection.
+
+    Writers are serialized. Changes are committed when the block exits and
+    rolled back on error, see connections.ConnectionPool.writer().
+    '''
+    return connections.get_pool().writer()
 
 
 def init_db():
     '''Create SQL tables from stored schema
     '''
-    db = get_db()
-    with current_app.open_resource('schema.sql') as f:
+    with write_db() as db, current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
 
-def do_readback():
-    '''Readback rows from SQL tables to check schema.
-  '''
-    db = get_db()
-    cur = db.cursor()
-    cur.execute("""
-    SELECT *
-    FROM
-      corpus AS c
-    ORDER BY
-      c.id
-    LIMIT 20;
-  """)
-    for row in cur.fetchall():
-        print(row)
-
-    cur.execute("""
-    SELECT *
-    FROM
-      tags AS t
-    ORDER BY
-      t.id
-    LIMIT 20;
-  """)
-
-    for row in cur.fetchall():
-        keys = row.keys()
-        r = tuple(row)
-        print("keys: {}".format(keys))
-        print("row: {}".format(r))
-
-
+@metrics.timed("db.read_all_docs")
 def read_all_doc_text_to_dataframe() -> pd.DataFrame:
     '''Retreive corpus doc text from SQL tables.
 
   Return a Pandas dataframe containing 1 row per document.
   '''
+    import pandas as pd
+
     db = get_db()
     df = pd.read_sql(sql_strings._SELECT_ALL_TEXT_DATA, db, index_col=None)
-    print("read_all_doc_text_to_dataframe columns {}\n{}".format(
-        df.columns, df))
+    logger.debug("read_all_doc_text_to_dataframe columns %s\n%s", df.columns,
+                 df)
     return df
 
 
 # Limit -1 fetches all rows.
-def read_all_cuisine_doc_text_to_dataframe(limit=-1) -> pd.DataFrame:
+@metrics.timed("db.read_cuisine_docs")
+def read_all_cuisine_doc_text_to_dataframe(limit=-1,
+                                           cuisine=None) -> pd.DataFrame:
     '''Retreive corpus doc text from SQL tables. Only return rows
   containing keywords related to cuisines of interest.
 
+  If cuisine is given only return rows belonging to that cuisine keyword,
+  see cuisines._CUISINE_KEYWORDS. If limit != -1 a uniform random sample of
+  `limit` documents is returned, see sampling.sample_cuisine_docs().
   Return a Pandas dataframe containing 1 row per document.
   '''
+    import pandas as pd
+
     db = get_db()
-    if limit == -1:
+    if limit != -1:
+        rows = sampling.sample_cuisine_docs(db, current_app.config['DATABASE'],
+                                            limit, cuisine)
+        df = pd.DataFrame.from_records(rows, columns=_SAMPLE_COLUMNS)
+    elif cuisine is None:
         df = pd.read_sql(sql_strings._SELECT_ALL_CUISINE_TEXT_DATA,
                          db,
                          index_col=None)
     else:
-        df = pd.read_sql(sql_strings._SELECT_ALL_CUISINE_TEXT_DATA_WITH_LIMIT,
+        df = pd.read_sql(sql_strings._SELECT_CUISINE_TEXT_DATA,
                          db,
-                         params=[limit],
+                         params=[cuisine],
                          index_col=None)
 
-    print("read_all_cuisine_doc_text_to_dataframe columns {}\n{}".format(
-        df.columns, df))
+    logger.debug("read_all_cuisine_doc_text_to_dataframe columns %s\n%s",
+                 df.columns, df)
     return df
 
 
+@metrics.timed("db.read_random_docs")
 def read_random_doc_text_to_dataframe(nrows=10) -> pd.DataFrame:
     '''Retreive corpus doc text from SQL tables.
 
-  Select random documents from corpus using SQL.
-  Limit the number of rows returned to nrows.
+  Select random documents from corpus by primary key, see
+  sampling.sample_docs(). Limit the number of rows returned to nrows.
 
   Return a Pandas dataframe containing 1 row per document.
   '''
+    import pandas as pd
+
     db = get_db()
-    df = pd.read_sql(sql_strings._SELECT_RANDOM_TEXT_DATA,
-                     db,
-                     params=[nrows],
-                     index_col=None)
-    print("read_random_doc_text_to_dataframe columns {}\n{}".format(
-        df.columns, df))
+    df = pd.DataFrame.from_records(sampling.sample_docs(db, nrows),
+                                   columns=_SAMPLE_COLUMNS)
+    logger.debug("read_random_doc_text_to_dataframe columns %s\n%s",
+                 df.columns, df)
     return df
 
 
-def insert_data_into_db(pp_recipes_df: pd.DataFrame,
-                        raw_recipes_df: pd.DataFrame):
-    '''Clean and store text documents in SQL DB.
+class DocTextStream:
+    '''Re-iterable stream of document text read from the SQL database.
+
+    Rows returned by `sql` are fetched from the sqlite cursor in batches of
+    `batch_size`. Each row is reduced to a single string by concatenating
+    the _DOC_TEXT_COLUMNS, so only one batch of raw text is ever in memory.
 
-    Clean text fields in input dataframes. Each DataFrame row represents 1 doc.
-    One row is created in DB for each row in the input DataFrames.
+    Every iteration opens its own connection to `database`, so the stream
+    can be consumed outside of a request (e.g. by gensim training passes).
+    If `fraction` < 1.0 a seeded random subset of the rows is kept. The same
+    subset is returned on every iteration.
+    '''
+
+    def __init__(self,
+                 database: str,
+                 sql: str = sql_strings._SELECT_ALL_CUISINE_TEXT_DATA,
+                 params=(),
+                 batch_size: int = _STREAM_BATCH_SIZE,
+                 fraction: float = 1.0,
+                 seed: int = 0):
+        self.database = database
+        self.sql = sql
+        self.params = tuple(params)
+        self.batch_size = batch_size
+        self.fraction = fraction
+        self.seed = seed
+        self._len = None
+
+    def _connect(self):
+        return connections.connect(self.database, readonly=True)
+
+    def iter_batches(self, with_ids: bool = False):
+        '''Yield lists of at most batch_size document strings.
+
+        If with_ids is True yield (doc_ids, documents) pairs instead, the
+        sql must then select a `doc_id` column.
+        '''
+        rng = random.Random(self.seed)
+        db = self._connect()
+        try:
+            cur = db.execute(self.sql, self.params)
+            while True:
+                rows = cur.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                if self.fraction < 1.0:
+                    rows = [x for x in rows if rng.random() < self.fraction]
+                docs = [
+                    "".join(row[c] or "" for c in _DOC_TEXT_COLUMNS)
+                    for row in rows
+                ]
+                if with_ids:
+                    yield [row["doc_id"] for row in rows], docs
+                else:
+                    yield docs
+        finally:
+            db.close()
+
+    def __iter__(self):
+        for batch in self.iter_batches():
+            yield from batch
+
+    def doc_ids(self) -> np.ndarray:
+        '''Return the doc_id of every document of the stream, in order.
+
+        Only the ids are read unless fraction < 1.0.
+        '''
+        if self.fraction < 1.0:
+            batches = self.iter_batches(with_ids=True)
+            return np.fromiter((x for ids, _ in batches for x in ids),
+                               dtype=np.int64)
+        db = self._connect()
+        try:
+            return np.fromiter(
+                (row[0] for row in db.execute(
+                    "SELECT doc_id FROM ({})".format(self.sql), self.params)),
+                dtype=np.int64)
+        finally:
+            db.close()
+
+    def __len__(self):
+        if self._len is None:
+            if self.fraction < 1.0:
+                self._len = sum(len(x) for x in self.iter_batches())
+            else:
+                db = self._connect()
+                try:
+                    self._len = db.execute(
+                        "SELECT COUNT(*) FROM ({})".format(self.sql),
+                        self.params).fetchone()[0]
+                finally:
+                    db.close()
+        return self._len
+
+
+def iter_doc_page(after: int = 0,
+                  limit: int = 100,
+                  cuisine: Optional[str] = None) -> Iterator[sqlite3.Row]:
+    '''Yield up to limit documents with a corpus id greater than after.
+
+    Documents are returned in corpus id order, pass the doc_id of the last
+    document as `after` to read the next page. If cuisine is given only
+    documents of that cuisine keyword are returned. Rows are fetched from
+    the cursor in batches, so memory use does not grow with limit.
     '''
     db = get_db()
-    cur = db.cursor()
-    no_description = raw_recipes_df[(raw_recipes_df["description"] == "")
-                                    | raw_recipes_df["description"].isnull()]
-    no_name = raw_recipes_df[(raw_recipes_df["name"] == "")
-                             | raw_recipes_df["name"].isnull() |
-                             (raw_recipes_df["name"] == "NaN")]
-    no_ingredients = raw_recipes_df[(raw_recipes_df["ingredients"] == "")
-                                    | raw_recipes_df["ingredients"].isnull()]
-    no_steps = raw_recipes_df[(raw_recipes_df["steps"] == "")
-                              | raw_recipes_df["steps"].isnull()]
-    no_ids = raw_recipes_df[(raw_recipes_df["id"].isnull()) |
-                            (raw_recipes_df["id"].isna())]
-    print("rows with no description {}\n{}".format(no_description.shape,
-                                                   no_description.index))
-    print("rows with no ids {}\n{}".format(no_ids.shape, no_ids.index))
+    if cuisine is None:
+        cur = db.execute(sql_strings._SELECT_TEXT_DATA_PAGE, (after, limit))
+    else:
+        cur = db.execute(sql_strings._SELECT_CUISINE_TEXT_DATA_PAGE,
+                         (cuisine, after, limit))
+    while True:
+        rows = cur.fetchmany(_PAGE_FETCH_SIZE)
+        if not rows:
+            return
+        yield from rows
+
+
+def explode_tags(tags: pd.Series) -> pd.Series:
+    '''Split the stringified tag lists into one row per (doc, tag).
+
+    The index of each tag is the index of the doc it came from.
+    '''
+    tags = tags.str.split(',')
+    return tags.explode().str.strip('[]" \'\'.,')
+
+
+def clean_raw_recipes(raw_recipes_df: pd.DataFrame,
+                      seen_names: set) -> pd.DataFrame:
+    '''Clean one chunk of RAW_recipes rows.
+
+    Rows without a name or description are dropped, missing ingredients and
+    steps are replaced with placeholders. Only the first document with a
+    given name is kept, seen_names holds the names of the previous chunks
+    and is updated with the names of this one.
+    '''
+    no_ids = raw_recipes_df[raw_recipes_df["id"].isnull()]
     assert (no_ids.empty)
-    raw_recipes_df.drop(labels=no_description.index, inplace=True)
-    raw_recipes_df.drop(labels=no_name.index, inplace=True)
-    raw_recipes_df.loc[no_ingredients.index, "ingredients"] = "no ingredients"
-    raw_recipes_df.loc[no_steps.index, "steps"] = "no steps"
-    raw_recipes_df.drop_duplicates("name", keep="first", inplace=True)
-    raw_recipes_df.reset_index(inplace=True)
-    rows = raw_recipes_df.loc[:, ["id", "name", "description"]]
-    duplicated_names = raw_recipes_df.loc[raw_recipes_df["name"].duplicated(),
-                                          ["id", "name", "description"]]
-    duplicated_ids = raw_recipes_df.loc[raw_recipes_df["id"].duplicated(),
-                                        ["id"]]
-    assert (duplicated_ids.empty)
-    print("duplicated_names {}".format(duplicated_names))
-    print("duplicated ids {}".format(duplicated_ids))
-    print("tags datatype as df {}\n{}".format(raw_recipes_df["tags"].dtypes,
-                                              raw_recipes_df["tags"]))
-    tags = raw_recipes_df["tags"].str.split(',')
-    tags = tags.explode().str.strip('[]" \'\'.,')
-    tags.drop_duplicates(keep="first", inplace=True)
-    cur.executemany(sql_strings._INSERT_RAW_RECIPES_TAGS,
-                    [(x, ) for x in tags.to_numpy(dtype=str).tolist()])
-    db.commit()
-    cur.executemany(sql_strings._INSERT_RAW_RECIPES_CORPUS,
-                    rows.itertuples(index=False))
-    db.commit()
-    rows = raw_recipes_df.loc[:, [
-        "id", "tags", "contributor_id", "steps", "description", "ingredients",
-        "n_ingredients"
-    ]]
-    rows["id2"] = raw_recipes_df.loc[:, ["id"]]
-    rows = rows.loc[:, [
-        "id", "id2", "tags", "contributor_id", "steps", "description",
-        "ingredients", "n_ingredients"
-    ]]
-    print("column names {}".format(rows.columns))
-    duplicated_ids = rows.loc[rows["id"].duplicated(), ["id"]]
-    assert (duplicated_ids.empty)
-    duplicated_ids = rows.loc[rows["id2"].duplicated(), ["id2"]]
-    assert (duplicated_ids.empty)
-    # rows.insert(loc=1, column='id_repeat', value=rows["id"])
-    print("rows before model insert t:{}\n{}".format(rows.dtypes, rows))
-    print("rows as tuple {}".format(
-        [x for x in itertools.islice(rows.itertuples(index=False), 10)]))
-    cur.executemany(sql_strings._INSERT_RAW_RECIPES_MODELS,
-                    rows.itertuples(index=False))
-    db.commit()
-    cur.execute(sql_strings._INSERT_DOC_TAGS)
-    db.commit()
-
-    # Readback the insertion results.
-    do_readback()
+    df = raw_recipes_df[raw_recipes_df["description"].notnull()
+                        & (raw_recipes_df["description"] != "")]
+    df = df[df["name"].notnull() & ~df["name"].isin(["", "NaN"])]
+    df = df.assign(
+        ingredients=df["ingredients"].fillna("").replace("", "no ingredients"),
+        steps=df["steps"].fillna("").replace("", "no steps"))
+    df = df.drop_duplicates("name", keep="first")
+    df = df[~df["name"].isin(seen_names)]
+    seen_names.update(df["name"])
+    return df
+
+
+def _content_hash(values) -> str:
+    # Missing values are NaN in a DataFrame and NULL in the DB, integer
+    # columns with a missing value are read as floats.
+    values = tuple(
+        None if x != x else
+        int(x) if isinstance(x, float) and x.is_integer() else x
+        for x in values)
+    return hashlib.sha1(repr(values).encode("utf-8")).hexdigest()
+
+
+def content_hashes(df: pd.DataFrame) -> List[str]:
+    '''Return the hash of the _CONTENT_COLUMNS of each cleaned row of df.
+
+    Rows with the same hash are stored as the same document.
+    '''
+    return [_content_hash(x) for x in _row_tuples(df, _CONTENT_COLUMNS)]
+
+
+def _row_tuples(df: pd.DataFrame, columns):
+    '''Return the given columns of df as tuples of Python values.
+
+    Much cheaper than DataFrame.itertuples() for executemany.
+    '''
+    return zip(*(df[x].tolist() for x in columns))
+
+
+class RawRecipeLoader:
+    '''Insert RAW_recipes rows into the corpus, models, tags and doc_tags
+    tables chunk by chunk.
+
+    Corpus and tag ids are assigned here, continuing from the largest ids
+    ever used, deleted ones included, rather than by sqlite. The models and
+    doc_tags rows of a chunk are then written directly instead of resolving
+    each document's id with a subquery. Does not commit.
+    '''
+
+    def __init__(self, db):
+        self.db = db
+        self.seen_names = set()
+        self.tag_ids = {
+            row["tag"]: row["tag_id"]
+            for row in db.execute(sql_strings._SELECT_TAG_IDS)
+        }
+        last_doc_id, last_tag_id = db.execute(
+            sql_strings._SELECT_MAX_IDS).fetchone()
+        self.next_doc_id = last_doc_id + 1
+        self.next_tag_id = last_tag_id + 1
+        self.num_docs = 0
+
+    def insert(self, raw_recipes_df: pd.DataFrame) -> int:
+        '''Clean and insert one chunk. Returns the number of docs inserted.
+        '''
+        df = clean_raw_recipes(raw_recipes_df, self.seen_names)
+        if df.empty:
+            return 0
+        df = df.reset_index(drop=True).assign(
+            doc_id=np.arange(self.next_doc_id, self.next_doc_id + len(df)),
+            content_hash=content_hashes(df))
+        self.next_doc_id += len(df)
+        self.db.executemany(
+            sql_strings._INSERT_RAW_RECIPES_CORPUS,
+            _row_tuples(df,
+                        ["doc_id", "id", "name", "description", "content_hash"]))
+        self.db.executemany(
+            sql_strings._INSERT_RAW_RECIPES_MODELS,
+            _row_tuples(df, [
+                "doc_id", "id", "tags", "contributor_id", "steps",
+                "description", "ingredients", "n_ingredients"
+            ]))
+
+        doc_tags = explode_tags(df["tags"]).rename("tag").to_frame().join(
+            df.loc[:, ["doc_id", "id"]].rename(columns={"id": "third_party_id"}))
+        doc_tags = doc_tags.dropna(subset=["tag"]).drop_duplicates()
+        new_tags = [
+            x for x in doc_tags["tag"].unique() if x not in self.tag_ids
+        ]
+        for tag in new_tags:
+            self.tag_ids[tag] = self.next_tag_id
+            self.next_tag_id += 1
+        self.db.executemany(sql_strings._INSERT_RAW_RECIPES_TAGS,
+                            [(self.tag_ids[x], x) for x in new_tags])
+        doc_tags["tag_id"] = doc_tags["tag"].map(self.tag_ids)
+        self.db.executemany(
+            sql_strings._INSERT_DOC_TAGS,
+            _row_tuples(doc_tags,
+                        ["tag", "tag_id", "doc_id", "third_party_id"]))
+        self.num_docs += len(df)
+        return len(df)
+
+
+@metrics.timed("db.ingest")
+def ingest_raw_recipes(db, chunks: Iterable[pd.DataFrame]) -> int:
+    '''Bulk load RAW_recipes dataframe chunks into freshly created tables.
+
+    All chunks are inserted in a single transaction with the
+    sql_strings._INGEST_PRAGMAS connection settings. The secondary indexes,
+    the corpus statistics and the doc_cuisines table are built once all
+    documents are loaded, in the same transaction.
+    Memory use is bounded by the chunk size. On error the whole load is
+    rolled back. Does not commit, run it in a write_db() block. Returns
+    the number of documents inserted.
+    '''
+    db.execute("PRAGMA journal_mode = WAL")
+    previous = {
+        name: db.execute(f"PRAGMA {name}").fetchone()[0]
+        for name in sql_strings._INGEST_PRAGMAS
+    }
+    for name, value in sql_strings._INGEST_PRAGMAS.items():
+        db.execute(f"PRAGMA {name} = {value}")
+    try:
+        if not db.in_transaction:
+            db.execute("BEGIN")
+        loader = RawRecipeLoader(db)
+        for chunk in chunks:
+            loader.insert(chunk)
+            logger.debug("inserted %d docs", loader.num_docs)
+        for sql in sql_strings._CREATE_INGEST_INDEXES:
+            db.execute(sql)
+        cuisines.refresh_doc_cuisines(db,
+                                      cuisines.get_keywords(),
+                                      update_stats=False)
+        corpus_stats.refresh_corpus_stats(db)
+    except BaseException:
+        db.rollback()
+        raise
+    finally:
+        for name, value in previous.items():
+            db.execute(f"PRAGMA {name} = {value}")
+    return loader.num_docs
+
+
+def _ensure_content_hashes(db):
+    '''Add and fill corpus.content_hash in a DB built before it existed.
+    '''
+    columns = {
+        row[0]
+        for row in db.execute(sql_strings._SELECT_CORPUS_COLUMN_NAMES)
+    }
+    if "content_hash" not in columns:
+        db.execute(sql_strings._ADD_CORPUS_CONTENT_HASH)
+    cur = db.execute(sql_strings._SELECT_DOCS_WITHOUT_CONTENT_HASH)
+    updates = []
+    while True:
+        rows = cur.fetchmany(_HASH_BATCH_ROWS)
+        if not rows:
+            break
+        updates.extend(
+            (_content_hash(tuple(row)[1:]), row["doc_id"]) for row in rows)
+    db.executemany(sql_strings._UPDATE_CONTENT_HASH, updates)
+
+
+def delete_docs(db, doc_ids: Iterable[int]):
+    '''Delete documents and the rows referencing them. Does not commit.
+    '''
+    db.execute(sql_strings._CREATE_TEMP_DELETE_DOC_IDS)
+    db.execute(sql_strings._DELETE_TEMP_DELETE_DOC_IDS)
+    db.executemany(sql_strings._INSERT_TEMP_DELETE_DOC_IDS,
+                   [(x, ) for x in doc_ids])
+    for sql in sql_strings._DELETE_DOCS:
+        db.execute(sql)
+    db.execute(sql_strings._DELETE_TEMP_DELETE_DOC_IDS)
+
+
+@metrics.timed("db.upsert")
+def upsert_raw_recipes(db,
+                       chunks: Iterable[pd.DataFrame],
+                       delete_missing: bool = False) -> dict:
+    '''Apply the difference between RAW_recipes rows and the stored docs.
+
+    Rows are keyed by their third_party_id and compared by content hash,
+    see content_hashes(). Unknown ids are inserted. Changed rows replace
+    the stored document under a new corpus id, its tags, doc_tags and
+    cuisines included. Unchanged rows are skipped without touching the DB.
+    Corpus ids only grow, so the documents added since a model was trained
+    are those above its last_doc_id, see updates.update_published_model().
+    Rows whose name is taken by another document are skipped, as by
+    clean_raw_recipes(). If delete_missing is True the chunks are the whole
+    dataset, and stored documents whose id is not among the cleaned rows
+    are deleted.
+    The cuisine membership of the inserted documents is computed, and the
+    corpus statistics updated with the inserted and deleted documents only,
+    see corpus_stats.update_corpus_stats(). Does not commit, run it in a
+    write_db() block.
+    Returns the number of docs "inserted", "updated", "deleted",
+    "unchanged" and "skipped".
+    '''
+    _ensure_content_hashes(db)
+    had_stats = corpus_stats.has_corpus_stats(db)
+    loader = RawRecipeLoader(db)
+    # third_party_id -> (doc_id, content_hash, document_name)
+    stored = {
+        row[0]: (row[1], row[2], row[3])
+        for row in db.execute(sql_strings._SELECT_DOC_HASHES)
+    }
+    loader.seen_names.update(x[2] for x in stored.values())
+    first_doc_id = loader.next_doc_id
+    counts = dict(inserted=0, updated=0, deleted=0, unchanged=0, skipped=0)
+    seen_ids = set()
+    for chunk in chunks:
+        df = clean_raw_recipes(chunk, set())
+        keep, replaced = [], []
+        for third_party_id, name, content_hash in zip(
+                df["id"].tolist(), df["name"].tolist(), content_hashes(df)):
+            seen_ids.add(third_party_id)
+            old = stored.get(third_party_id)
+            if old is not None and old[1] == content_hash:
+                counts["unchanged"] += 1
+                keep.append(False)
+            elif name in loader.seen_names and (old is None
+                                                or name != old[2]):
+                counts["skipped"] += 1
+                keep.append(False)
+            else:
+                counts["inserted" if old is None else "updated"] += 1
+                keep.append(True)
+                if old is not None:
+                    replaced.append(old)
+        removed = [x[0] for x in replaced]
+        corpus_stats.update_corpus_stats(db, removed, sign=-1)
+        delete_docs(db, removed)
+        loader.seen_names.difference_update(x[2] for x in replaced)
+        loader.insert(df[np.array(keep, dtype=bool)])
+        logger.debug("upserted %d docs", loader.num_docs)
+    if delete_missing:
+        missing = [v[0] for k, v in stored.items() if k not in seen_ids]
+        corpus_stats.update_corpus_stats(db, missing, sign=-1)
+        delete_docs(db, missing)
+        counts["deleted"] = len(missing)
+    if counts["inserted"] or counts["updated"] or counts["deleted"]:
+        inserted = range(first_doc_id, loader.next_doc_id)
+        cuisines.refresh_doc_cuisines(db,
+                                      cuisines.get_keywords(),
+                                      inserted,
+                                      update_stats=False)
+        if had_stats:
+            corpus_stats.update_corpus_stats(db, inserted)
+        else:
+            corpus_stats.refresh_corpus_stats(db)
+    return counts
+
+
+def read_last_doc_id(database: str) -> int:
+    '''Return the largest corpus id ever assigned, 0 if there is none.
+
+    Ids of deleted documents are not reused, so this never decreases.
+    '''
+    conn = connections.connect(database, readonly=True)
+    try:
+        return conn.execute(sql_strings._SELECT_MAX_IDS).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def read_cuisine_doc_ids(database: str) -> np.ndarray:
+    '''Return the sorted corpus ids of the cuisine documents.
+    '''
+    conn = connections.connect(database, readonly=True)
+    try:
+        return np.fromiter(
+            (row[0]
+             for row in conn.execute(sql_strings._SELECT_ALL_CUISINE_DOC_IDS)),
+            dtype=np.int64)
+    finally:
+        conn.close()
 
 
 def remove_n_path_components(n, path):
@@ -211,33 +582,126 @@ def remove_n_path_components(n, path):
 
 
 @click.command('init-db')
+@click.option('--chunk-rows',
+              default=_INGEST_CHUNK_ROWS,
+              show_default=True,
+              help='Number of .csv rows read and inserted at a time.')
 @with_appcontext
-def init_db_command():
+def init_db_command(chunk_rows):
     """Clear the existing data and create new tables.
 
-    The freshly created tables are filled with data from the .csv files.
-    The .csv files contain a list of ~230k recipes from food.com.
+    The freshly created tables are filled with data from RAW_recipes.csv,
+    a list of ~230k recipes from food.com. The .csv is streamed in chunks of
+    chunk_rows rows, see ingest_raw_recipes().
 
     This function can be run from the command line via `flask init-db`. See
     `click.command` for details.
     """
-    path = [x for x in remove_n_path_components(3, current_app.root_path)][-1]
+    from . import csv_ingest
+
     *_, path = remove_n_path_components(3, current_app.root_path)
     path = os.path.join(path, "data/archive")
-    pp_recipes_df = csv_ingest.IngestPpData(
-        os.path.join(path, "PP_recipes.csv"))
-    raw_recipes_df = csv_ingest.IngestRawData(
-        os.path.join(path, "RAW_recipes.csv"))
     init_db()
-    insert_data_into_db(pp_recipes_df, raw_recipes_df)
+    start = time.perf_counter()
+    with write_db() as db:
+        num_docs = ingest_raw_recipes(
+            db,
+            csv_ingest.IterRawData(os.path.join(path, "RAW_recipes.csv"),
+                                   chunksize=chunk_rows))
+    click.echo('Inserted {} docs in {:.1f}s.'.format(
+        num_docs,
+        time.perf_counter() - start))
     click.echo('Initialized the database.')
 
 
+@click.command('ingest-delta')
+@click.option('--csv',
+              'csv_path',
+              type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help='RAW_recipes.csv formatted file, data/archive/'
+              'RAW_recipes.csv by default.')
+@click.option('--chunk-rows',
+              default=_INGEST_CHUNK_ROWS,
+              show_default=True,
+              help='Number of .csv rows read and compared at a time.')
+@click.option('--keep-missing',
+              is_flag=True,
+              help='Keep the docs missing from the .csv, for a file of new '
+              'and changed recipes only.')
+@with_appcontext
+def ingest_delta_command(csv_path, chunk_rows, keep_missing):
+    """Apply a new RAW_recipes.csv to the existing tables.
+
+    Each recipe is keyed by its id and compared by content hash with the
+    stored one, see upsert_raw_recipes(). New recipes are inserted, changed
+    ones replaced, and recipes no longer in the .csv deleted unless
+    --keep-missing is given. Unchanged recipes are not written, so a daily
+    refresh only costs reading the .csv. The top docs of the published
+    model are re-ranked without the replaced and deleted recipes.
+
+    This function can be run from the command line via
+    `flask ingest-delta`.
+    """
+    from . import csv_ingest
+    from . import doc_topics
+
+    if csv_path is None:
+        *_, path = remove_n_path_components(3, current_app.root_path)
+        csv_path = os.path.join(path, "data/archive/RAW_recipes.csv")
+    start = time.perf_counter()
+    with write_db() as db:
+        counts = upsert_raw_recipes(db,
+                                    csv_ingest.IterRawData(
+                                        csv_path, chunksize=chunk_rows),
+                                    delete_missing=not keep_missing)
+        if counts["updated"] or counts["deleted"]:
+            doc_topics.rerank_top_docs(db, current_app.instance_path)
+    click.echo('Inserted {inserted}, updated {updated} and deleted '
+               '{deleted} docs, {unchanged} unchanged and {skipped} skipped '
+               'as duplicate names, '.format(**counts) +
+               'in {:.1f}s.'.format(time.perf_counter() - start))
+
+
+@click.command('refresh-cuisines')
+@with_appcontext
+def refresh_cuisines_command():
+    """Update the doc_cuisines table after CUISINE_KEYWORDS changed.
+
+    Only keywords added or removed since the last refresh are processed.
+    This function can be run from the command line via
+    `flask refresh-cuisines`.
+    """
+    with write_db() as db:
+        cuisines.refresh_doc_cuisines(db, cuisines.get_keywords())
+    click.echo('Refreshed the cuisine membership table.')
+
+
+@click.command('refresh-stats')
+@with_appcontext
+def refresh_stats_command():
+    """Recompute the corpus statistics shown on the corpus page.
+
+    They are kept up to date by init-db and refresh-cuisines, this is only
+    needed for a DB loaded before they existed. This function can be run
+    from the command line via `flask refresh-stats`.
+    """
+    with write_db() as db:
+        corpus_stats.refresh_corpus_stats(db)
+    click.echo('Refreshed the corpus statistics.')
+
+
 def init_app(app):
     '''Called from flask_app.py.
 
-  Adds the command line flag `flask init-db` to the Flask app.
-  Adds a teardown callback that closes the DB connection.
+  Adds the command line flags `flask init-db`, `flask ingest-delta`,
+  `flask refresh-cuisines` and `flask refresh-stats` to the Flask app.
+  Creates the DB connection pool of the process, and adds a teardown
+  callback that returns the DB connection to it.
   '''
+    connections.init_app(app)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(ingest_delta_command)
+    app.cli.add_command(refresh_cuisines_command)
+    app.cli.add_command(refresh_stats_command)
@@ -0,0 +1,286 @@
+import os
+import logging
+import multiprocessing
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import connections
+from . import db
+from . import inference
+from . import metrics
+from . import model_store
+from . import modelling
+from . import sql_strings
+
+logger = logging.getLogger(__name__)
+
+# Topic distribution of every document, a float32 (n_docs, num_topics)
+# matrix. Row i belongs to the corpus id at index i of _DOC_IDS_NAME. Both
+# are stored next to the model in its version directory.
+_DOC_TOPICS_NAME = "doc_topics.npy"
+_DOC_IDS_NAME = "doc_topics.ids.npy"
+_DOC_TOPICS_DTYPE = np.float32
+# Number of highest weighted documents kept per topic in topic_top_docs.
+_TOP_DOCS_PER_TOPIC = 100
+# Number of documents sent to an inference worker at a time.
+_INFER_CHUNKSIZE = 1000
+_NUM_INFER_WORKERS = modelling._NUM_WORKDERS
+
+# Model and BoW encoder of an inference worker process, see _init_worker().
+_worker_model = None
+_worker_encoder = None
+
+
+def _init_worker(path: str):
+    global _worker_model, _worker_encoder
+    dictionary = modelling.try_get_saved_dictionary(path)
+    _worker_model = modelling.try_get_saved_model(path, dictionary)
+    _worker_encoder = inference.BowEncoder(dictionary)
+
+
+def infer_topics(model, encoder: inference.BowEncoder,
+                 docs: Sequence[str]) -> np.ndarray:
+    '''Return the (len(docs), num_topics) topic distribution of docs.
+
+    Documents are preprocessed like the training corpus, then inferred in a
+    single variational E step over the whole chunk.
+    '''
+    bows = [encoder.doc2bow(x) for x in docs]
+    gamma, _ = model.inference(bows)
+    gamma /= gamma.sum(axis=1, keepdims=True)
+    return gamma.astype(_DOC_TOPICS_DTYPE, copy=False)
+
+
+def _infer_chunk(chunk: Tuple[List[int], List[str]]):
+    ids, docs = chunk
+    return ids, infer_topics(_worker_model, _worker_encoder, docs)
+
+
+def _iter_chunks(docs: db.DocTextStream,
+                 chunksize: int) -> Iterator[Tuple[List[int], List[str]]]:
+    for ids, texts in docs.iter_batches(with_ids=True):
+        for i in range(0, len(texts), chunksize):
+            yield ids[i:i + chunksize], texts[i:i + chunksize]
+
+
+class TopDocs:
+    '''Running top-n documents of every topic.
+
+    Each update merges a block of rows into the current top-n with
+    argpartition, so the cost per document is O(num_topics) and memory is
+    O(n * num_topics) however many documents are seen.
+    '''
+
+    def __init__(self, num_topics: int, n: int):
+        self.n = n
+        self.weights = np.empty((0, num_topics), dtype=_DOC_TOPICS_DTYPE)
+        self.ids = np.empty((0, num_topics), dtype=np.int64)
+
+    def update(self, ids: Sequence[int], theta: np.ndarray):
+        weights = np.concatenate([self.weights, theta])
+        ids = np.concatenate([
+            self.ids,
+            np.broadcast_to(
+                np.asarray(ids, dtype=np.int64)[:, None], theta.shape)
+        ])
+        if len(weights) > self.n:
+            keep = np.argpartition(-weights, self.n - 1, axis=0)[:self.n]
+            weights = np.take_along_axis(weights, keep, axis=0)
+            ids = np.take_along_axis(ids, keep, axis=0)
+        self.weights, self.ids = weights, ids
+
+    def ranked(self) -> Iterator[Tuple[int, int, int, float]]:
+        '''Yield (topic, rank, doc_id, weight), highest weight first.
+
+        Ties are ranked by doc_id.
+        '''
+        for topic in range(self.weights.shape[1]):
+            weights, ids = self.weights[:, topic], self.ids[:, topic]
+            for rank, row in enumerate(np.lexsort((ids, -weights))):
+                yield topic, rank, int(ids[row]), float(weights[row])
+
+
+@metrics.timed("model.doc_topics")
+def compute_doc_topics(database: str,
+                       instance_path: str,
+                       path: str,
+                       docs: Optional[db.DocTextStream] = None,
+                       workers: Optional[int] = None,
+                       top_n: int = _TOP_DOCS_PER_TOPIC,
+                       reuse_path: Optional[str] = None) -> int:
+    '''Infer the topic distribution of every document for the model in path.
+
+    Documents default to the cuisine corpus the models are trained on.
+    Inference runs in `workers` processes, each loading the model once. The
+    distributions are written to path as a float32 matrix, and the top_n
+    documents of each topic to the topic_top_docs table. Rows of versions
+    other than this one and the published one are removed.
+    If reuse_path is given, e.g. the version a model was updated from, only
+    docs are inferred. The distributions saved in reuse_path are copied
+    for the other documents still in the cuisine corpus, so the cost is
+    proportional to docs. Corpus ids are never reused and a changed recipe
+    gets a new one, see db.upsert_raw_recipes(), so a saved row still
+    belongs to the same text. `flask doc-topics` recomputes them all.
+    Returns the number of documents.
+    '''
+    version = model_store.version_name(instance_path, path)
+    model = modelling.try_get_saved_model(path)
+    if model is None:
+        raise IOError(f"Could not load the model in {path}")
+    if docs is None:
+        docs = db.DocTextStream(database)
+    if workers is None:
+        workers = _NUM_INFER_WORKERS
+    n_docs = len(docs)
+    reused_ids, reused = np.empty(0, dtype=np.int64), None
+    if reuse_path is not None:
+        reused_ids, reused = load_doc_topics(reuse_path)
+        current = db.read_cuisine_doc_ids(database)
+        keep = np.flatnonzero(
+            np.isin(reused_ids, current)
+            & ~np.isin(reused_ids, docs.doc_ids()))
+        reused_ids = reused_ids[keep]
+    n_reused = len(reused_ids)
+    n_docs += n_reused
+
+    matrix_tmp = os.path.join(path, _DOC_TOPICS_NAME + ".tmp.npy")
+    ids_tmp = os.path.join(path, _DOC_IDS_NAME + ".tmp.npy")
+    matrix = np.lib.format.open_memmap(matrix_tmp,
+                                       mode='w+',
+                                       dtype=_DOC_TOPICS_DTYPE,
+                                       shape=(n_docs, model.num_topics))
+    doc_ids = np.lib.format.open_memmap(ids_tmp,
+                                        mode='w+',
+                                        dtype=np.int64,
+                                        shape=(n_docs, ))
+    top_docs = TopDocs(model.num_topics, top_n)
+    for first in range(0, n_reused, _INFER_CHUNKSIZE):
+        rows = keep[first:first + _INFER_CHUNKSIZE]
+        ids, theta = reused_ids[first:first + len(rows)], reused[rows]
+        matrix[first:first + len(rows)] = theta
+        doc_ids[first:first + len(rows)] = ids
+        top_docs.update(ids, theta)
+    row = n_reused
+    with multiprocessing.Pool(workers,
+                              initializer=_init_worker,
+                              initargs=(path, )) as pool:
+        for ids, theta in pool.imap(_infer_chunk,
+                                    _iter_chunks(docs, _INFER_CHUNKSIZE)):
+            matrix[row:row + len(ids)] = theta
+            doc_ids[row:row + len(ids)] = ids
+            top_docs.update(ids, theta)
+            row += len(ids)
+            logger.debug("doc topics: %d/%d docs", row, n_docs)
+    if row != n_docs:
+        raise IOError(f"Expected {n_docs} docs, inferred {row}")
+    matrix.flush()
+    doc_ids.flush()
+    del matrix, doc_ids
+    os.replace(ids_tmp, os.path.join(path, _DOC_IDS_NAME))
+    os.replace(matrix_tmp, os.path.join(path, _DOC_TOPICS_NAME))
+
+    conn = connections.connect(database)
+    try:
+        conn.execute(sql_strings._CREATE_TOPIC_TOP_DOCS)
+        conn.execute(sql_strings._DELETE_TOPIC_TOP_DOCS_EXCEPT,
+                     (version, model_store.current_version(instance_path)
+                      or version))
+        _write_top_docs(conn, version, top_docs)
+        conn.commit()
+    finally:
+        conn.close()
+    return n_docs
+
+
+def _write_top_docs(conn, version: str, top_docs: TopDocs):
+    conn.execute(sql_strings._DELETE_TOPIC_TOP_DOCS_BY_VERSION, (version, ))
+    conn.executemany(sql_strings._INSERT_TOPIC_TOP_DOCS,
+                     ((version, ) + x for x in top_docs.ranked()))
+
+
+def rerank_top_docs(conn,
+                    instance_path: str,
+                    top_n: int = _TOP_DOCS_PER_TOPIC) -> Optional[str]:
+    '''Recompute the top docs of the published version after documents
+    were deleted, e.g. by db.upsert_raw_recipes().
+
+    Deleting a document removes its topic_top_docs rows, leaving fewer
+    than top_n documents in the topics it ranked high in. The ranking is
+    rebuilt from the saved document topics of the version, leaving out the
+    documents no longer in the cuisine corpus, without any inference.
+    Does not commit. Returns the version, or None if it has no document
+    topics.
+    '''
+    path = model_store.current_model_path(instance_path)
+    try:
+        ids, matrix = load_doc_topics(path)
+    except IOError:
+        return None
+    current = np.fromiter(
+        (row[0]
+         for row in conn.execute(sql_strings._SELECT_ALL_CUISINE_DOC_IDS)),
+        dtype=np.int64)
+    keep = np.flatnonzero(np.isin(ids, current))
+    top_docs = TopDocs(matrix.shape[1], top_n)
+    for first in range(0, len(keep), _INFER_CHUNKSIZE):
+        rows = keep[first:first + _INFER_CHUNKSIZE]
+        top_docs.update(ids[rows], matrix[rows])
+    version = model_store.version_name(instance_path, path)
+    conn.execute(sql_strings._CREATE_TOPIC_TOP_DOCS)
+    _write_top_docs(conn, version, top_docs)
+    return version
+
+
+def load_doc_topics(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    '''Memory map the (doc_ids, doc topic matrix) saved in path.
+
+    Raises IOError if they have not been computed.
+    '''
+    try:
+        return (np.load(os.path.join(path, _DOC_IDS_NAME), mmap_mode='r'),
+                np.load(os.path.join(path, _DOC_TOPICS_NAME), mmap_mode='r'))
+    except OSError as e:
+        raise IOError(f"No document topics in {path}") from e
+
+
+@metrics.timed("db.read_top_docs")
+def read_top_docs(conn, version: str, topic: int, n: int) -> List[dict]:
+    '''Return the n highest weighted documents of topic, best first.
+
+    Ranks are renumbered from 0, rows of deleted documents leave gaps in
+    the stored ones until rerank_top_docs() runs.
+    '''
+    return [
+        dict(row, rank=rank) for rank, row in enumerate(
+            conn.execute(sql_strings._SELECT_TOPIC_TOP_DOCS, (version, topic,
+                                                              n)))
+    ]
+
+
+@click.command('doc-topics')
+@click.option('--workers', default=_NUM_INFER_WORKERS, show_default=True)
+@with_appcontext
+def doc_topics_command(workers):
+    """Infer the topics of every document for the published model.
+
+    Models trained by a training job already include them. This function
+    can be run from the command line via `flask doc-topics`.
+    """
+    path = model_store.current_model_path(current_app.instance_path)
+    n_docs = compute_doc_topics(current_app.config['DATABASE'],
+                                current_app.instance_path,
+                                path,
+                                workers=workers)
+    click.echo(f'Inferred the topics of {n_docs} docs.')
+
+
+def init_app(app):
+    '''Called from flask_app.py.
+
+    Adds the command line flag `flask doc-topics` to the Flask app.
+    '''
+    app.cli.add_command(doc_topics_command)
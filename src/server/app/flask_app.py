@@ -1,17 +1,31 @@
 import os
+import logging
 
 from flask import (Flask, render_template)
 from . import db
+from . import doc_topics
+from . import inference
+from . import jobs
+from . import metrics
+from . import registry
+from . import sweep
 from . import topics
+from . import updates
 
 
 def DoDbSetup(app):
     db.init_app(app)
+    doc_topics.init_app(app)
+    sweep.init_app(app)
+    updates.init_app(app)
 
 
-def create_app(test_config=None):
+def create_app(test_config=None, instance_path=None):
     # create and configure the app
-    app = Flask(__name__, instance_relative_config=True)
+    # instance_path defaults to the instance folder next to the package.
+    app = Flask(__name__,
+                instance_path=instance_path,
+                instance_relative_config=True)
     print(f"Instance path is `{app.instance_path}`")
     print(f"__name__ path is `{__name__}`")
     print(f"app.root path is `{app.root_path}`")
@@ -27,6 +41,10 @@ def create_app(test_config=None):
         # load the test config if passed in
         app.config.from_mapping(test_config)
 
+    # Debug dumps of the app modules are logged at the DEBUG level.
+    if 'LOG_LEVEL' in app.config:
+        logging.getLogger(__package__).setLevel(app.config['LOG_LEVEL'])
+
     # Take care of DB related setup items.
     DoDbSetup(app)
 
@@ -36,6 +54,11 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    # Load the saved topic model once for the whole process.
+    registry.init_app(app)
+    inference.init_app(app)
+    metrics.init_app(app)
+
     # A simple page that says hello.
     @app.route('/')
     @app.route('/index')
@@ -44,5 +67,7 @@ def create_app(test_config=None):
 
     # Register any additional pages.
     app.register_blueprint(topics.bp)
+    app.register_blueprint(jobs.bp)
+    app.register_blueprint(inference.bp)
 
     return app
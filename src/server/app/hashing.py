@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import zlib
+import hashlib
+import collections
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+from gensim import utils
+
+# Label of the buckets no token was hashed to yet.
+_EMPTY_LABEL = ""
+
+
+def token_bucket(token: str, num_buckets: int) -> int:
+    '''Return the id of the bucket token is hashed to.
+
+    crc32 is stable across processes and Python versions, unlike hash().
+    '''
+    return zlib.crc32(token.encode("utf-8")) % num_buckets
+
+
+class _BucketIds:
+    '''Read-only token to id mapping of a HashingDictionary.
+
+    Every token has an id, only the tokens of filtered out buckets are
+    missing. Supports the lookups done on Dictionary.token2id: `in`, [] and
+    get().
+    '''
+
+    def __init__(self, dictionary: HashingDictionary):
+        self.dictionary = dictionary
+
+    def __contains__(self, token) -> bool:
+        return self.get(token) is not None
+
+    def __getitem__(self, token: str) -> int:
+        tokenid = self.get(token)
+        if tokenid is None:
+            raise KeyError(token)
+        return tokenid
+
+    def get(self, token: str, default=None) -> int:
+        tokenid = token_bucket(token, self.dictionary.num_buckets)
+        if tokenid in self.dictionary.dropped:
+            return default
+        return tokenid
+
+    def __len__(self) -> int:
+        return self.dictionary.num_buckets
+
+
+class HashingDictionary(utils.SaveLoad):
+    '''Bag-of-words dictionary with a fixed number of token ids.
+
+    Tokens are hashed into num_buckets ids, so the vocabulary, the eta
+    prior, and the topic-word matrix never grow with the corpus and no token
+    is out of vocabulary. Tokens sharing a bucket share an id. Buckets can
+    be filtered by document frequency like a Dictionary, see
+    filter_extremes(), the ids of the others stay the same.
+
+    gensim.corpora.HashDictionary only remembers the tokens of each id in
+    debug mode, in maps as large as the vocabulary. Instead each bucket
+    keeps one label for printing topics, the winner of a running majority
+    vote (Boyer-Moore) among the tokens hashed to it. That is the majority
+    token of the bucket whenever it has one. Memory is O(num_buckets)
+    whatever the corpus size.
+
+    Used in place of gensim's Dictionary, see modelling.build_dictionary().
+    Saved and loaded the same way.
+    '''
+
+    def __init__(self, num_buckets: int):
+        if num_buckets < 1:
+            raise ValueError(f"num_buckets must be >= 1, got {num_buckets}")
+        self.num_buckets = num_buckets
+        self.num_docs = 0
+        self.num_pos = 0
+        # Number of documents containing a token of each bucket.
+        self.dfs: List[int] = [0] * num_buckets
+        # Ids of the buckets dropped by filter_extremes().
+        self.dropped: FrozenSet[int] = frozenset()
+        self._labels: List[str] = [_EMPTY_LABEL] * num_buckets
+        self._votes: List[int] = [0] * num_buckets
+
+    @property
+    def token2id(self) -> _BucketIds:
+        return _BucketIds(self)
+
+    @property
+    def id2token(self) -> Dict[int, str]:
+        '''Map every id to its label. Passed as id2word to LdaModel.
+        '''
+        return dict(enumerate(self._labels))
+
+    def __getitem__(self, tokenid: int) -> str:
+        return self._labels[tokenid]
+
+    def __len__(self) -> int:
+        return self.num_buckets
+
+    def keys(self) -> List[int]:
+        return list(range(self.num_buckets))
+
+    def add_documents(self, documents: Iterable[List[str]]):
+        '''Count the document frequencies and vote for the bucket labels.
+        '''
+        labels, votes, dfs = self._labels, self._votes, self.dfs
+        for document in documents:
+            self.num_docs += 1
+            self.num_pos += len(document)
+            ids = [token_bucket(x, self.num_buckets) for x in document]
+            for i in set(ids):
+                dfs[i] += 1
+            for token, i in zip(document, ids):
+                if labels[i] == token:
+                    votes[i] += 1
+                elif votes[i] == 0:
+                    labels[i] = token
+                    votes[i] = 1
+                else:
+                    votes[i] -= 1
+
+    def filter_extremes(self, no_below: int, no_above: float):
+        '''Drop the buckets in fewer than no_below documents or in more than
+        no_above (fraction) of the documents.
+
+        Dropped buckets are left out of doc2bow(), they keep their id.
+        '''
+        no_above_abs = int(no_above * self.num_docs)
+        self.dropped = frozenset(
+            i for i, df in enumerate(self.dfs)
+            if df < no_below or df > no_above_abs)
+
+    def doc2bow(self, document: Iterable[str]) -> List[Tuple[int, int]]:
+        '''Return the (id, count) pairs of document, sorted by id.
+        '''
+        counts = collections.Counter(
+            token_bucket(x, self.num_buckets) for x in document)
+        dropped = self.dropped
+        return sorted(x for x in counts.items() if x[0] not in dropped)
+
+    def fingerprint(self) -> str:
+        '''Token ids only depend on the number of buckets and the buckets
+        dropped.
+        '''
+        digest = hashlib.sha1(str(sorted(self.dropped)).encode("utf-8"))
+        return f"crc32/{self.num_buckets}/{digest.hexdigest()}"
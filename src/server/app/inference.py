@@ -0,0 +1,219 @@
+import os
+import queue
+import threading
+import collections
+import functools
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from flask import Blueprint, request
+from flask import current_app as app
+from flask.json import jsonify
+
+from . import metrics
+from . import modelling
+from . import registry
+
+bp = Blueprint('inference', __name__, url_prefix='/topic')
+
+# Max number of texts accepted by a single /topic/infer request.
+_MAX_TEXTS_PER_REQUEST = 256
+# Max length of a single text, in characters.
+_MAX_TEXT_LENGTH = 100000
+# Max number of documents passed to one model.inference() call. Requests
+# queued while the model is busy are merged up to this size.
+_MAX_BATCH_SIZE = 512
+# Topics with a lower probability are left out of the response, same as
+# the gensim get_document_topics() default.
+_MIN_PROBABILITY = 0.01
+# Max number of distinct words whose token ids are memoized per model.
+_WORD_ID_CACHE_SIZE = 1 << 18
+# Key used to store the batcher in app.extensions.
+_EXTENSION_KEY = "inference_batcher"
+
+
+class BowEncoder:
+    '''Convert text to the bag-of-words of a dictionary.
+
+    Uses the cleaning pipeline of modelling.preprocess_document(). The token
+    ids of each word are memoized, so repeated words are neither stemmed
+    nor looked up in the dictionary again.
+    '''
+
+    def __init__(self, dictionary):
+        self.dictionary = dictionary
+        self.word_ids = functools.lru_cache(maxsize=_WORD_ID_CACHE_SIZE)(
+            self._word_ids)
+
+    def _word_ids(self, word: str) -> Tuple[int, ...]:
+        token2id = self.dictionary.token2id
+        return tuple(token2id[x] for x in modelling.word_tokens(word)
+                     if x in token2id)
+
+    def doc2bow(self, text: str) -> List[Tuple[int, int]]:
+        counts = collections.Counter()
+        for word in modelling.clean_words(text):
+            counts.update(self.word_ids(word))
+        return sorted(counts.items())
+
+
+class _Request:
+
+    def __init__(self, loaded: registry.LoadedModel,
+                 bows: List[List[Tuple[int, int]]]):
+        self.loaded = loaded
+        self.bows = bows
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class InferenceBatcher:
+    '''Run concurrent inference requests as shared model.inference() calls.
+
+    Callers queue their documents and block. A single background thread
+    takes every request queued at that moment, up to _MAX_BATCH_SIZE docs
+    for the same model, and infers them in one call. A lone request is run
+    at once, requests arriving while the model is busy are merged into the
+    next call, so batches grow with load without adding latency at low
+    load.
+    '''
+
+    def __init__(self, max_batch_size: int = _MAX_BATCH_SIZE):
+        self.max_batch_size = max_batch_size
+        self._encoders = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def encoder(self, loaded: registry.LoadedModel) -> BowEncoder:
+        '''Return the BowEncoder of a loaded model version.
+        '''
+        with self._lock:
+            encoder = self._encoders.get(loaded.artifact_version)
+            if encoder is None or encoder.dictionary is not loaded.dictionary:
+                # Only keep the encoder of the newest model.
+                encoder = BowEncoder(loaded.dictionary)
+                self._encoders = {loaded.artifact_version: encoder}
+            return encoder
+
+    def _ensure_thread(self):
+        # The thread does not survive a fork, e.g. of a preloaded gunicorn
+        # app, start one per process.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run,
+                                 args=(self._queue, ),
+                                 name="inference-batcher",
+                                 daemon=True).start()
+            return self._queue
+
+    def infer(self, loaded: registry.LoadedModel,
+              texts: Sequence[str]) -> np.ndarray:
+        '''Return the (len(texts), num_topics) topic distribution of texts.
+        '''
+        encoder = self.encoder(loaded)
+        req = _Request(loaded, [encoder.doc2bow(x) for x in texts])
+        self._ensure_thread().put(req)
+        req.done.wait()
+        if req.error is not None:
+            raise req.error
+        return req.result
+
+    def _run(self, requests: queue.Queue):
+        pending = collections.deque()
+        while True:
+            if not pending:
+                pending.append(requests.get())
+            while True:
+                try:
+                    pending.append(requests.get_nowait())
+                except queue.Empty:
+                    break
+            loaded = pending[0].loaded
+            batch, size = [], 0
+            for req in list(pending):
+                if req.loaded is not loaded:
+                    continue
+                if batch and size + len(req.bows) > self.max_batch_size:
+                    break
+                batch.append(req)
+                size += len(req.bows)
+                pending.remove(req)
+            self._infer_batch(loaded, batch)
+
+    def _infer_batch(self, loaded: registry.LoadedModel,
+                     batch: List[_Request]):
+        try:
+            bows = [bow for req in batch for bow in req.bows]
+            with metrics.span("model.inference"):
+                gamma, _ = loaded.model.inference(bows)
+            gamma /= gamma.sum(axis=1, keepdims=True)
+            start = 0
+            for req in batch:
+                req.result = gamma[start:start + len(req.bows)]
+                start += len(req.bows)
+        except Exception as e:
+            for req in batch:
+                req.error = e
+        for req in batch:
+            req.done.set()
+
+
+def get_batcher() -> InferenceBatcher:
+    return app.extensions[_EXTENSION_KEY]
+
+
+def _parse_texts(body) -> Tuple[Optional[List[str]], Optional[str]]:
+    '''Return (texts, error) from a request body.
+    '''
+    if not isinstance(body, dict):
+        return None, "expected a JSON object"
+    texts = body.get("texts")
+    if texts is None and "text" in body:
+        texts = [body["text"]]
+    if not isinstance(texts, list) or not texts:
+        return None, "expected `text` or a non empty `texts` list"
+    if len(texts) > _MAX_TEXTS_PER_REQUEST:
+        return None, f"at most {_MAX_TEXTS_PER_REQUEST} texts per request"
+    if not all(isinstance(x, str) for x in texts):
+        return None, "texts must be strings"
+    if any(len(x) > _MAX_TEXT_LENGTH for x in texts):
+        return None, f"texts must be at most {_MAX_TEXT_LENGTH} characters"
+    return texts, None
+
+
+@bp.route('/infer', methods=('POST', ))
+def infer():
+    '''Return the topic distribution of new recipe texts.
+
+    Accepts a JSON object with either a `text` string or a `texts` list.
+    Returns, for each text, the [topic, probability] pairs of the topics
+    with a probability of at least _MIN_PROBABILITY, most probable first.
+    '''
+    texts, error = _parse_texts(request.get_json(silent=True))
+    if error is not None:
+        return jsonify({"error": error}), 400
+    loaded = registry.get_registry().get()
+    if loaded is None:
+        return jsonify({"error": "no topic model has been trained"}), 503
+    theta = get_batcher().infer(loaded, texts)
+    docs = []
+    for row in theta:
+        order = np.argsort(-row, kind="stable")
+        docs.append([[int(x), float(row[x])] for x in order
+                     if row[x] >= _MIN_PROBABILITY])
+    return jsonify({
+        "version": loaded.version,
+        "topics": docs,
+    })
+
+
+def init_app(app):
+    '''Called from flask_app.py.
+
+    Creates the inference batcher shared by all requests of the process.
+    '''
+    app.extensions[_EXTENSION_KEY] = InferenceBatcher()
@@ -0,0 +1,356 @@
+import os
+import json
+import time
+import fcntl
+import logging
+import contextlib
+import traceback
+import multiprocessing
+from typing import Optional, List
+
+from flask import Blueprint, request
+from flask import current_app as app
+from flask.json import jsonify
+
+from . import cuisines
+from . import db
+from . import doc_topics
+from . import model_store
+from . import modelling
+from . import sql_strings
+
+bp = Blueprint('jobs', __name__, url_prefix='/topic')
+
+# Training jobs record their progress in instance_path/_JOBS_DIR/<job>.json.
+# Using files rather than process memory lets every server worker process
+# report on jobs started by any other worker.
+_JOBS_DIR = "jobs"
+# Max number of training jobs allowed to run at the same time.
+_MAX_RUNNING_JOBS = 1
+# Min seconds between two progress writes from inside a training job.
+_PROGRESS_WRITE_SECONDS = 1.0
+# Jobs still queued this many seconds after submission failed to start.
+_START_TIMEOUT_SECONDS = 60.0
+# ensure_training_job() does not retry a job that failed less than this many
+# seconds ago, e.g. on a DB without a corpus, so page loads do not keep
+# spawning jobs that fail the same way. POST /topic/jobs always submits.
+_RETRY_FAILED_SECONDS = 600.0
+# Lock file serializing job submissions across server worker processes.
+_SUBMIT_LOCK = "submit.lock"
+_ACTIVE_STATES = ("queued", "running")
+
+
+def jobs_path(instance_path: str) -> str:
+    return os.path.join(instance_path, _JOBS_DIR)
+
+
+def _status_path(instance_path: str, job_id: str) -> str:
+    return os.path.join(jobs_path(instance_path), job_id + ".json")
+
+
+def write_job_status(instance_path: str, status: dict):
+    '''Atomically replace the status file of a job.
+    '''
+    path = _status_path(instance_path, status["job_id"])
+    with open(path + ".tmp", 'w') as out:
+        json.dump(status, out)
+    os.replace(path + ".tmp", path)
+
+
+def read_job_status(instance_path: str, job_id: str) -> Optional[dict]:
+    '''Return the status of a job, or None if the job does not exist.
+
+    Jobs whose process died without reporting are marked as failed.
+    '''
+    try:
+        with open(_status_path(instance_path, job_id), 'r') as input:
+            status = json.load(input)
+    except (OSError, ValueError):
+        return None
+    if status["state"] not in _ACTIVE_STATES:
+        return status
+    if status["pid"] is None:
+        started = time.time() - status["submitted"] < _START_TIMEOUT_SECONDS
+    else:
+        started = _pid_alive(status["pid"])
+    if not started:
+        status["state"] = "failed"
+        status["error"] = "training process exited unexpectedly"
+    return status
+
+
+def list_jobs(instance_path: str) -> List[dict]:
+    '''Return the status of every job, newest first.
+    '''
+    root = jobs_path(instance_path)
+    if not os.path.isdir(root):
+        return []
+    names = sorted((x for x in os.listdir(root) if x.endswith(".json")),
+                   reverse=True)
+    jobs = [read_job_status(instance_path, x[:-len(".json")]) for x in names]
+    return [x for x in jobs if x is not None]
+
+
+@contextlib.contextmanager
+def _submit_lock(instance_path: str):
+    '''Hold an exclusive lock on the jobs directory of instance_path.
+
+    flock() locks are released by the OS if the holder dies, so a crashed
+    worker can not leave a stale lock behind.
+    '''
+    os.makedirs(jobs_path(instance_path), exist_ok=True)
+    fd = os.open(os.path.join(jobs_path(instance_path), _SUBMIT_LOCK),
+                 os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class _ProgressHandler(logging.Handler):
+    '''Copy gensim's training progress log records into the job status.
+
+    LdaMulticore and LdaModel have no callback hook, but they log the
+    current pass and the perplexity estimate of every evaluated chunk.
+    '''
+
+    def __init__(self, instance_path: str, status: dict):
+        super().__init__(level=logging.INFO)
+        self.instance_path = instance_path
+        self.status = status
+        self._last_write = 0.0
+
+    def emit(self, record):
+        msg = record.msg if isinstance(record.msg, str) else ""
+        if msg.startswith("PROGRESS: pass"):
+            if len(record.args) == 3:
+                # LdaModel, used when training with a single worker.
+                pass_, docs_done, docs_total = record.args
+            else:
+                pass_, _, docs_done, docs_total = record.args[:4]
+            self.status["pass"] = pass_ + 1
+            self.status["docs_done"] = docs_done
+            self.status["docs_total"] = docs_total
+        elif "perplexity estimate" in msg:
+            self.status["perplexity"] = float(record.args[1])
+        else:
+            return
+        now = time.monotonic()
+        if now - self._last_write >= _PROGRESS_WRITE_SECONDS:
+            self._last_write = now
+            write_job_status(self.instance_path, self.status)
+
+
+def _run_training_job(database: str, instance_path: str, status: dict):
+    '''Entry point of the training process.
+
+    Trains a model from the DB into a new version directory and publishes
+    it. The server keeps serving the previously published model until then.
+    '''
+    status.update(state="running", pid=os.getpid(), started=time.time())
+    write_job_status(instance_path, status)
+    handler = _ProgressHandler(instance_path, status)
+    logging.getLogger("gensim.models").addHandler(handler)
+    try:
+        version, path = model_store.create_version_path(instance_path)
+        # Documents added from now on are left to the next update, see
+        # updates.update_published_model().
+        last_doc_id = db.read_last_doc_id(database)
+        docs = db.DocTextStream(
+            database,
+            sql=sql_strings._SELECT_CUISINE_TEXT_DATA_BY_ID_RANGE,
+            params=(0, last_doc_id),
+            fraction=status["fraction"])
+
+        def on_stage(stage):
+            status["stage"] = stage
+            write_job_status(instance_path, status)
+
+        start = time.perf_counter()
+        model = modelling.compute_lda_model_streaming(
+            docs,
+            path,
+            on_stage=on_stage,
+            keywords=status["keywords"],
+            prior_probability=status["prior_probability"],
+            vocabulary=status["vocabulary"])
+        on_stage("saving")
+        modelling.save_model_artifacts(path, model)
+        on_stage("doc_topics")
+        doc_topics.compute_doc_topics(database, instance_path, path)
+        model_store.write_version_meta(
+            path, {
+                "job_id": status["job_id"],
+                "created": time.time(),
+                "train_seconds": time.perf_counter() - start,
+                "num_topics": model.num_topics,
+                "num_docs": status.get("docs_total"),
+                "last_doc_id": last_doc_id,
+                "num_terms": len(model.id2word),
+                "perplexity": status.get("perplexity"),
+                "keywords": status["keywords"],
+                "prior_probability": status["prior_probability"],
+                "vocabulary": status["vocabulary"],
+            })
+        model_store.publish_version(instance_path, version)
+        status.update(state="done", version=version)
+    except Exception as e:
+        traceback.print_exc()
+        status.update(state="failed", error=repr(e))
+    finally:
+        logging.getLogger("gensim.models").removeHandler(handler)
+        status["finished"] = time.time()
+        write_job_status(instance_path, status)
+
+
+def _start_training_job(database: str, instance_path: str, fraction: float,
+                        keywords: Optional[List[str]],
+                        prior_probability: float) -> dict:
+    job_id = "{}-{}".format(time.strftime("%Y%m%d-%H%M%S"),
+                            os.urandom(3).hex())
+    status = {
+        "job_id": job_id,
+        "state": "queued",
+        "stage": None,
+        "pid": None,
+        "submitted": time.time(),
+        "fraction": fraction,
+        "keywords": (cuisines.get_prior_keywords()
+                     if keywords is None else list(keywords)),
+        "prior_probability": prior_probability,
+        "vocabulary": modelling.get_vocabulary(),
+        "pass": 0,
+        "passes": modelling._NUM_PASSES,
+        "perplexity": None,
+        "version": None,
+        "error": None,
+    }
+    write_job_status(instance_path, status)
+    # Spawn rather than fork, the training process must not inherit the
+    # server's threads, locks, or open DB connections. The process records
+    # its own pid once it starts.
+    ctx = multiprocessing.get_context("spawn")
+    process = ctx.Process(target=_run_training_job,
+                          args=(database, instance_path, dict(status)),
+                          name=f"train-{job_id}")
+    process.start()
+    return status
+
+
+def submit_training_job(database: str,
+                        instance_path: str,
+                        fraction: float = 1.0,
+                        keywords: Optional[List[str]] = None,
+                        prior_probability: float = modelling._PRIOR_PROBABILITY
+                        ) -> Optional[dict]:
+    '''Start training a new model in a separate process.
+
+    keywords are the words used as LDA priors, defaults to
+    cuisines.get_prior_keywords(). prior_probability is the prior mass
+    shared by the keyword tokens, see modelling.create_eta(). The
+    vocabulary bounds are read from the app config, see
+    modelling.get_vocabulary().
+    Returns the initial job status, or None if _MAX_RUNNING_JOBS jobs are
+    already running. Submissions from every server worker are serialized,
+    the queued job is recorded before the next one checks.
+    '''
+    # Reap finished training processes.
+    multiprocessing.active_children()
+    with _submit_lock(instance_path):
+        running = [
+            x for x in list_jobs(instance_path)
+            if x["state"] in _ACTIVE_STATES
+        ]
+        if len(running) >= _MAX_RUNNING_JOBS:
+            return None
+        return _start_training_job(database, instance_path, fraction,
+                                   keywords, prior_probability)
+
+
+def ensure_training_job(database: str,
+                        instance_path: str,
+                        fraction: float = 1.0) -> Optional[dict]:
+    '''Return the status of the running training job, starting one if none
+    is running.
+
+    If the last job failed less than _RETRY_FAILED_SECONDS ago its status
+    is returned instead of starting another one.
+    '''
+    multiprocessing.active_children()
+    with _submit_lock(instance_path):
+        jobs = list_jobs(instance_path)
+        running = [x for x in jobs if x["state"] in _ACTIVE_STATES]
+        if running:
+            return running[0]
+        if jobs and jobs[0]["state"] == "failed" and (
+                time.time() - jobs[0].get("finished", jobs[0]["submitted"])
+                < _RETRY_FAILED_SECONDS):
+            return jobs[0]
+        return _start_training_job(database, instance_path, fraction, None,
+                                   modelling._PRIOR_PROBABILITY)
+
+
+@bp.route('/jobs', methods=('GET', 'POST'))
+def jobs():
+    '''POST starts a background training job, GET lists all jobs.
+
+    POST accepts optional form/query arguments:
+        `fraction` the fraction of documents to train on.
+        `keywords` the keywords steering the topics, repeated or comma
+            separated. Defaults to the configured prior keywords.
+        `prior_probability` the prior mass given to the keyword tokens.
+    Returns 409 if a job is already running.
+    '''
+    multiprocessing.active_children()
+    if request.method == 'GET':
+        return jsonify(list_jobs(app.instance_path))
+
+    fraction = request.values.get("fraction",
+                                  default=modelling._DF_ROW_FRACTION,
+                                  type=float)
+    if fraction is None or not 0.0 < fraction <= 1.0:
+        return jsonify({"error": "fraction must be in (0, 1]"}), 400
+    keywords = [
+        x.strip() for value in request.values.getlist("keywords")
+        for x in value.split(",") if x.strip()
+    ] or None
+    prior_probability = request.values.get(
+        "prior_probability",
+        default=modelling._PRIOR_PROBABILITY,
+        type=float)
+    if prior_probability is None or not 0.0 <= prior_probability < 1.0:
+        return jsonify({"error": "prior_probability must be in [0, 1)"}), 400
+    status = submit_training_job(app.config['DATABASE'], app.instance_path,
+                                 fraction, keywords, prior_probability)
+    if status is None:
+        return jsonify({"error": "a training job is already running"}), 409
+    return jsonify(status), 202
+
+
+@bp.route('/jobs/<job_id>', methods=('GET', ))
+def job_status(job_id):
+    '''Poll the progress of a training job.
+    '''
+    multiprocessing.active_children()
+    status = read_job_status(app.instance_path, job_id)
+    if status is None:
+        return jsonify({"error": f"unknown job {job_id}"}), 404
+    return jsonify(status)
+
+
+@bp.route('/models', methods=('GET', ))
+def models():
+    '''List every completed model version, newest first.
+    '''
+    return jsonify(model_store.list_versions(app.instance_path))
@@ -0,0 +1,257 @@
+import time
+import bisect
+import logging
+import threading
+import functools
+import contextlib
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from flask import (Blueprint, Response, before_render_template, g, request,
+                   template_rendered)
+
+bp = Blueprint('metrics', __name__)
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets. They span
+# cached page hits (~1ms) to training runs (~30min).
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+# Prefix of every exported metric name.
+_PREFIX = "recipes_"
+_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        name,
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+            "\n", "\\n")) for name, value in zip(names, values)) + "}"
+
+
+class Histogram:
+    '''Thread safe histogram with one series per label value tuple.
+    '''
+
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 label_names: Sequence[str],
+                 buckets: Sequence[float] = _LATENCY_BUCKETS):
+        self.name = _PREFIX + name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # labels -> [per bucket counts, +Inf last], sum, count
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0
+                ]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2])
+                      for k, v in sorted(self._series.items())]
+        names = self.label_names + ("le", )
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"), ), counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append("{}_bucket{} {}".format(
+                    self.name, _format_labels(names, labels + (le, )),
+                    cumulative))
+            label_text = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class Counter:
+    '''Thread safe counter with one series per label value tuple.
+    '''
+
+    def __init__(self, label_names: Sequence[str]):
+        self.label_names = tuple(label_names)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: Tuple[str, ...], amount: int = 1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + amount
+
+    def values(self) -> Dict[Tuple[str, ...], int]:
+        with self._lock:
+            return dict(self._series)
+
+
+# Metrics of this process. Each server worker process exports its own, the
+# scraper sums them. Stages run in training job processes are not exported.
+_REQUEST_SECONDS = Histogram("http_request_duration_seconds",
+                             "Time to build the response of a request.",
+                             ("endpoint", "method", "status"))
+_SPAN_SECONDS = Histogram("span_duration_seconds",
+                          "Duration of instrumented stages, see span().",
+                          ("span", ))
+# Exported as hit and miss totals per cache, see render().
+_CACHE_LOOKUPS = Counter(("cache", "result"))
+# Start times of the templates being rendered by each thread.
+_render_starts = threading.local()
+# Caches that count their own hits, e.g. functools.lru_cache. Maps the
+# cache name to a function returning (hits, misses).
+_cache_sources = {}
+
+
+@contextlib.contextmanager
+def span(name: str):
+    '''Time the enclosed block as the stage `name`.
+
+    Adds the duration to the span histogram and logs it at DEBUG level.
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _SPAN_SECONDS.observe((name, ), elapsed)
+        logger.debug("%s took %.4fs", name, elapsed)
+
+
+def timed(name: str) -> Callable:
+    '''Decorator running every call of a function in span(name).
+    '''
+
+    def decorator(fn):
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def cache_lookup(cache: str, hit: bool):
+    '''Count a hit or a miss of the named cache.
+    '''
+    _CACHE_LOOKUPS.inc((cache, "hit" if hit else "miss"))
+
+
+def register_cache(cache: str, stats: Callable[[], Tuple[int, int]]):
+    '''Export the hit rate of a cache that keeps its own statistics.
+
+    stats returns (hits, misses), e.g. from lru_cache.cache_info().
+    '''
+    _cache_sources[cache] = stats
+
+
+def _cache_counts() -> Dict[str, Tuple[int, int]]:
+    counts = {}
+    for (cache, result), n in _CACHE_LOOKUPS.values().items():
+        hits, misses = counts.get(cache, (0, 0))
+        counts[cache] = ((hits + n, misses) if result == "hit" else
+                         (hits, misses + n))
+    for cache, stats in list(_cache_sources.items()):
+        counts[cache] = tuple(stats())
+    return counts
+
+
+def render() -> str:
+    '''Return every metric in the Prometheus text exposition format.
+    '''
+    lines = _REQUEST_SECONDS.render() + _SPAN_SECONDS.render()
+    counts = _cache_counts()
+    hits_name = _PREFIX + "cache_hits_total"
+    misses_name = _PREFIX + "cache_misses_total"
+    ratio_name = _PREFIX + "cache_hit_ratio"
+    lines += [
+        f"# HELP {hits_name} Cache hits.",
+        f"# TYPE {hits_name} counter",
+    ] + [
+        '{}{{cache="{}"}} {}'.format(hits_name, x, counts[x][0])
+        for x in sorted(counts)
+    ]
+    lines += [
+        f"# HELP {misses_name} Cache misses.",
+        f"# TYPE {misses_name} counter",
+    ] + [
+        '{}{{cache="{}"}} {}'.format(misses_name, x, counts[x][1])
+        for x in sorted(counts)
+    ]
+    lines += [
+        f"# HELP {ratio_name} Hits over lookups since the process started.",
+        f"# TYPE {ratio_name} gauge",
+    ] + [
+        '{}{{cache="{}"}} {}'.format(ratio_name, x,
+                                     counts[x][0] / max(1, sum(counts[x])))
+        for x in sorted(counts)
+    ]
+    return "\n".join(lines) + "\n"
+
+
+@bp.route('/metrics', methods=('GET', ))
+def metrics():
+    '''Export the request and stage latencies, and the cache hit rates.
+    '''
+    return Response(render(), content_type=_CONTENT_TYPE)
+
+
+def _start_request_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def _observe_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        # Streamed bodies are still being generated, this is the time to
+        # the first byte.
+        _REQUEST_SECONDS.observe(
+            (request.endpoint or "unmatched", request.method,
+             str(response.status_code)),
+            time.perf_counter() - start)
+    return response
+
+
+def _start_render_timer(sender, template, context, **extra):
+    if not hasattr(_render_starts, "stack"):
+        _render_starts.stack = []
+    _render_starts.stack.append(time.perf_counter())
+
+
+def _observe_render(sender, template, context, **extra):
+    stack = getattr(_render_starts, "stack", None)
+    if stack:
+        elapsed = time.perf_counter() - stack.pop()
+        _SPAN_SECONDS.observe(("render." + (template.name or "string"), ),
+                              elapsed)
+
+
+def init_app(app):
+    '''Called from flask_app.py.
+
+    Times every request and template rendering, and adds the `/metrics`
+    endpoint.
+    '''
+    app.before_request(_start_request_timer)
+    app.after_request(_observe_request)
+    before_render_template.connect(_start_render_timer, app)
+    template_rendered.connect(_observe_render, app)
+    app.register_blueprint(bp)
@@ -0,0 +1,117 @@
+import os
+import json
+import uuid
+from datetime import datetime
+from typing import Optional, List, Tuple
+
+# Trained model versions are stored in instance_path/_MODELS_DIR/<version>.
+# Each version directory holds the model, dictionary, corpus, and topic
+# summary written by modelling.save_model_artifacts(), plus _META_NAME.
+_MODELS_DIR = "models"
+# Text file holding the name of the version served by the app. Replaced
+# atomically when a new version is published.
+_CURRENT_NAME = "CURRENT"
+# JSON file describing how a version was trained.
+_META_NAME = "meta.json"
+# Version name of a model stored directly in instance_path.
+_LEGACY_VERSION = "legacy"
+
+
+def models_path(instance_path: str) -> str:
+    return os.path.join(instance_path, _MODELS_DIR)
+
+
+def current_pointer_path(instance_path: str) -> str:
+    return os.path.join(models_path(instance_path), _CURRENT_NAME)
+
+
+def current_version(instance_path: str) -> Optional[str]:
+    '''Return the name of the published version, or None if none exists.
+    '''
+    try:
+        with open(current_pointer_path(instance_path), 'r') as input:
+            return input.read().strip() or None
+    except OSError:
+        return None
+
+
+def current_model_path(instance_path: str) -> str:
+    '''Return the directory holding the artifacts of the published version.
+
+    Falls back to instance_path itself, where models trained before
+    versioning was introduced are stored.
+    '''
+    version = current_version(instance_path)
+    if version is None:
+        return instance_path
+    return os.path.join(models_path(instance_path), version)
+
+
+def version_name(instance_path: str, path: str) -> str:
+    '''Return the version name of the model stored in path.
+    '''
+    if os.path.normpath(path) == os.path.normpath(instance_path):
+        return _LEGACY_VERSION
+    return os.path.basename(os.path.normpath(path))
+
+
+def create_version_path(instance_path: str) -> Tuple[str, str]:
+    '''Create an empty directory for a new model version.
+
+    Returns the (version, path) pair. Versions sort by creation time.
+    '''
+    version = "{}-{}".format(datetime.now().strftime("%Y%m%d-%H%M%S"),
+                             uuid.uuid4().hex[:6])
+    path = os.path.join(models_path(instance_path), version)
+    os.makedirs(path)
+    return version, path
+
+
+def write_version_meta(path: str, meta: dict):
+    with open(os.path.join(path, _META_NAME), 'w') as out:
+        json.dump(meta, out)
+
+
+def read_version_meta(path: str) -> dict:
+    try:
+        with open(os.path.join(path, _META_NAME), 'r') as input:
+            return json.load(input)
+    except (OSError, ValueError):
+        return {}
+
+
+def publish_version(instance_path: str, version: str):
+    '''Make version the model served by the app.
+
+    The pointer file is replaced atomically, the registry picks up the new
+    version on its next mtime check.
+    '''
+    path = os.path.join(models_path(instance_path), version)
+    if not os.path.isdir(path):
+        raise IOError(f"Could not locate path {path}")
+    pointer = current_pointer_path(instance_path)
+    with open(pointer + ".tmp", 'w') as out:
+        out.write(version)
+    os.replace(pointer + ".tmp", pointer)
+
+
+def list_versions(instance_path: str) -> List[dict]:
+    '''Return the metadata of every completed version, newest first.
+    '''
+    root = models_path(instance_path)
+    if not os.path.isdir(root):
+        return []
+    current = current_version(instance_path)
+    versions = []
+    for name in sorted(os.listdir(root), reverse=True):
+        path = os.path.join(root, name)
+        if not os.path.isdir(path):
+            continue
+        meta = read_version_meta(path)
+        if not meta:
+            # Still training, or the job failed.
+            continue
+        meta["version"] = name
+        meta["current"] = name == current
+        versions.append(meta)
+    return versions
@@ -1,28 +1,58 @@
+from __future__ import annotations
+
 import os
-import pickle
-from typing import Optional, List, Tuple
-from datetime import datetime
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import collections
+import functools
+import itertools
+import multiprocessing
+from typing import (Optional, List, Tuple, Sequence, Iterable, Callable,
+                    TYPE_CHECKING)
 
-import pandas as pd
 import numpy as np
-from gensim.models.ldamulticore import LdaMulticore
-from gensim.parsing import preprocessing
-from gensim.corpora import Dictionary
-from flask import g
-from gensim.parsing.porter import PorterStemmer
-from nltk.tokenize import RegexpTokenizer
+from flask import current_app, has_app_context
 import logging
 
+from . import bow_corpus
+from . import cuisines
+from . import metrics
+from .bow_corpus import MmapBowCorpus
+
+# gensim, nltk and pandas take seconds to import. They are imported by the
+# functions that load, train or preprocess, so the app and CLI start without
+# them. See bench/startup.py.
+if TYPE_CHECKING:
+    import pandas as pd
+    from gensim.corpora import Dictionary
+    from gensim.models.ldamulticore import LdaMulticore
+
 logging.basicConfig(filename='gensim.log',
                     format="%(asctime)s:%(levelname)s:%(message)s",
                     level=logging.INFO)
 
+logger = logging.getLogger(__name__)
+
 # Output filenames. Used to cache corpus and model on disk.
 _MODEL_NAME = "lda_model.model"
 _DICTIONARY_NAME = "dictionary.corpus"
-_CORPUS_NAME = "corpus.corpus"
+_CORPUS_NAME = "corpus.bow"
+_TOPICS_NAME = "topics.json"
+# The model is saved without its id2word mapping, it is restored from the
+# dictionary saved next to it. Arrays of at least _MODEL_SEP_LIMIT elements,
+# e.g. the topic-word matrices, are saved as separate .npy files and
+# memory-mapped read-only on load, so every process serving the same model
+# shares their physical pages.
+_MODEL_SAVE_IGNORE = ('state', 'dispatcher', 'id2word')
+_MODEL_SEP_LIMIT = 1 << 16
+_MODEL_MMAP_MODE = 'r'
 # Number of topics to generate via the topic model.
 _NUM_TOPICS = 30
+# Number of most significant words shown per topic.
+_NUM_TOPIC_WORDS = 20
 # Max iterations and epochs to run the topic model.
 _NUM_PASSES = 10
 _NUM_ITERATIONS = 100
@@ -31,72 +61,89 @@ _EVAL_EVERY = 1
 _NUM_WORKDERS = 3
 # Max number of docs to hold in memory per worker.
 _DOC_CHUNKSIZE = 2000
+# Number of processes used to clean, stem, and tokenize the documents
+# before the bag-of-words dictionary is built. 1 runs in this process.
+_NUM_PREPROCESS_WORKERS = _NUM_WORKDERS
+# Number of docs handed to a preprocessing worker per task.
+_PREPROCESS_CHUNKSIZE = 1000
+# Max number of distinct words whose tokens are memoized by word_tokens().
+_WORD_CACHE_SIZE = 1 << 18
+# Drop tokens that appear in fewer than _FILTER_NO_BELOW documents or in
+# more than _FILTER_NO_ABOVE (fraction) of the documents, then keep the
+# _FILTER_KEEP_N most frequent. Rare tokens are mostly typos and stems of
+# misspelled words, each one adds a column to the num_topics x vocabulary
+# topic-word matrix.
+_FILTER_NO_BELOW = 5
+_FILTER_NO_ABOVE = 0.4
+_FILTER_KEEP_N = 100000
+# Max number of distinct tokens held while the dictionary is built. Beyond
+# it the least frequent tokens are pruned, which caps the memory of the
+# first pass over the corpus before filtering.
+_MAX_VOCABULARY_SIZE = 1 << 20
+# If set, tokens are hashed into this many ids by a HashingDictionary
+# instead, see build_dictionary(). Memory is capped regardless of corpus
+# growth, but unrelated tokens sharing a bucket share a topic weight.
+_HASH_BUCKETS = None
+# Vocabulary bounds accepted by build_dictionary(), the app config value
+# overriding each, and its default.
+_VOCABULARY_BOUNDS = {
+    "no_below": ('VOCAB_NO_BELOW', _FILTER_NO_BELOW),
+    "no_above": ('VOCAB_NO_ABOVE', _FILTER_NO_ABOVE),
+    "keep_n": ('VOCAB_KEEP_N', _FILTER_KEEP_N),
+    "max_size": ('VOCAB_MAX_SIZE', _MAX_VOCABULARY_SIZE),
+    "hash_buckets": ('VOCAB_HASH_BUCKETS', _HASH_BUCKETS),
+}
+# Online passes over the new documents when a model is updated with
+# update_lda_model(). Every pass blends the new documents into the topics
+# again, more passes weigh them more against the documents seen before.
+_NUM_UPDATE_PASSES = 1
 # % of docs from corpus used to generate topic model.
 # Lowing this number decreses runtime significantly.
 _DF_ROW_FRACTION = 1.0
 # All Latent Dirichlet Allocation prior probabilities must sum
 # to 1. Reserve 20% probability for key words corresponding to
-# the user's desired topics. A list of keywords is stored in
-# _LDA_KEYWORD_PRIORS.
+# the user's desired topics. The key words are the stemmed prior
+# words of the cuisine keywords, see cuisines._CUISINE_KEYWORDS and
+# keyword_prior_tokens().
 _PRIOR_PROBABILITY = 0.2
-_LDA_KEYWORD_PRIORS = [
-    "chines",
-    "korea",
-    "korean",
-    "koreathi",
-    "viet",
-    "vietnames",
-    "vietnam",
-    "singapore",
-    "singaporean",
-    "italy",
-    "italian",
-    "italyi",
-    "european",
-    "french",
-    "mexican",
-    "mexico",
-    "france",
-    "british",
-    "britain",
-    "mediterranean",
-    "africa",
-    "african",
-    "kenya",
-    "kenyan"
-    "israel",
-    "israeli",
-    "middle-east",
-    "middleeast",
-    "india",
-    "halal",
-    "arab",
-    "arabian",
-    "egyptian",
-    "egypt",
-    "japan",
-    "japanes",
-    "japanese",
-    "german",
-    # "american",
-    # "america",
-]
-
-
-def try_get_saved_model(instance_path: str) -> Optional[LdaMulticore]:
+# eta is built in the float dtype LdaMulticore trains with, so gensim uses
+# the array as is instead of copying it.
+_ETA_DTYPE = np.float32
+# Max number of eta arrays kept by create_eta(), least recently used first
+# out.
+_ETA_CACHE_SIZE = 8
+_eta_cache = collections.OrderedDict()
+_eta_cache_lock = threading.Lock()
+
+
+@metrics.timed("model.load")
+def try_get_saved_model(
+        instance_path: str,
+        dictionary: Optional[Dictionary] = None,
+        mmap: Optional[str] = _MODEL_MMAP_MODE) -> Optional[LdaMulticore]:
     '''If path exists deserialize the model from disk to memory.
 
     Model generation can take minutes. Saving the model to disk and
     reading it back when required is much faster than regenerating.
+    The topic-word arrays are memory-mapped with mode mmap, read-only by
+    default. Pass mmap=None to load a copy that can be trained further.
+    Models saved by try_save_model() have no id2word, it is set to
+    dictionary, or to the dictionary saved in instance_path if None.
     '''
+    from gensim.models.ldamulticore import LdaMulticore
+
     model = None
     path = os.path.join(instance_path, _MODEL_NAME)
     if not os.path.exists(path):
         raise IOError(f"Could not locate path {path}")
     try:
-        model = LdaMulticore.load(path)
+        model = LdaMulticore.load(path, mmap=mmap)
     except Exception as e:
         pass
+    if model is not None and model.id2word is None:
+        if dictionary is None:
+            dictionary = try_get_saved_dictionary(instance_path)
+        model.id2word = dictionary
     return model
 
 
@@ -105,6 +152,9 @@ def try_save_model(instance_path: str, model: LdaMulticore):
 
     Model generation can take minutes. Saving the model to disk and
     reading it back when required is much faster than regenerating.
+    The files are written to a temporary directory and moved into place,
+    the model file last. Processes still mapping the arrays of a previous
+    model keep reading the replaced files instead of a truncated one.
     '''
     path = os.path.join(instance_path, _MODEL_NAME)
     print("saving to {}".format(path))
@@ -112,9 +162,24 @@ def try_save_model(instance_path: str, model: LdaMulticore):
         raise ValueError("Cannot save null model")
     if not os.path.exists(instance_path):
         raise IOError(f"Could not locate path {instance_path}")
-    model.save(path)
-
-
+    tmp_path = tempfile.mkdtemp(prefix=".model-", dir=instance_path)
+    try:
+        model.save(os.path.join(tmp_path, _MODEL_NAME),
+                   ignore=_MODEL_SAVE_IGNORE,
+                   sep_limit=_MODEL_SEP_LIMIT)
+        # gensim loads an id2word file if there is one, drop that of an
+        # older model.
+        if os.path.exists(path + ".id2word"):
+            os.remove(path + ".id2word")
+        names = sorted(os.listdir(tmp_path), key=lambda x: x == _MODEL_NAME)
+        for name in names:
+            os.replace(os.path.join(tmp_path, name),
+                       os.path.join(instance_path, name))
+    finally:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+@metrics.timed("model.load_dictionary")
 def try_get_saved_dictionary(instance_path: str) -> Optional[Dictionary]:
     '''If path exists deserialize the tokenized bag-of-words dictionary from disk.
 
@@ -122,7 +187,9 @@ def try_get_saved_dictionary(instance_path: str) -> Optional[Dictionary]:
     loading it from disk.
     Uses the pickle module for serialization.
     '''
-    model = None
+    from gensim.corpora import Dictionary
+
+    dictionary = None
     path = os.path.join(instance_path, _DICTIONARY_NAME)
     if not os.path.exists(path):
         raise IOError(f"Could not locate path {path}")
@@ -149,75 +216,390 @@ def try_save_dictionary(instance_path: str, dictionary: Dictionary):
     dictionary.save(path)
 
 
-def try_get_saved_corpus(
-        instance_path: str) -> Optional[List[Tuple[int, int]]]:
-    '''If path exists deserialize the corpus of text documents from disk.
+def summarize_topics(model: LdaMulticore) -> List[Tuple[int, str]]:
+    '''Return the (topic id, top words) pairs rendered by `/topic/topic_main`.
+    '''
+    return model.print_topics(num_topics=_NUM_TOPICS,
+                              num_words=_NUM_TOPIC_WORDS)
 
-    Querying the SQL databse and re-cleaning the document text takes about
-    as long as just deserializing the existing corpus from disk.
-    Uses the pickle module for serialization.
+
+def try_get_saved_topics(instance_path: str) -> Optional[List[Tuple[int,
+                                                                    str]]]:
+    '''If path exists read the precomputed topic summary from disk.
+
+    The summary is written next to the model when it is trained, so the
+    topic page can be rendered without calling print_topics() per request.
+    '''
+    topics = None
+    path = os.path.join(instance_path, _TOPICS_NAME)
+    if not os.path.exists(path):
+        raise IOError(f"Could not locate path {path}")
+    try:
+        with open(path, 'r') as input:
+            topics = [tuple(x) for x in json.load(input)]
+    except Exception as e:
+        pass
+    return topics
+
+
+def try_save_topics(instance_path: str, topics: List[Tuple[int, str]]):
+    '''If path exists write the topic summary to disk as JSON.
+    '''
+    path = os.path.join(instance_path, _TOPICS_NAME)
+    print("saving topics to {}".format(path))
+    if not topics:
+        raise ValueError("Cannot save empty topics")
+    if not os.path.exists(instance_path):
+        raise IOError(f"Could not locate path {instance_path}")
+    with open(path, 'w') as out:
+        json.dump(topics, out)
+
+
+def try_get_saved_corpus(instance_path: str) -> Optional[MmapBowCorpus]:
+    '''If path exists memory map the corpus of text documents from disk.
+
+    Querying the SQL databse and re-cleaning the document text is much
+    slower than mapping the saved bag-of-words corpus. The corpus is stored
+    as CSR arrays, see bow_corpus.MmapBowCorpus, so loading is near instant
+    and document i can be read without touching the rest of the corpus.
     '''
     corpus = None
     path = os.path.join(instance_path, _CORPUS_NAME)
-    if not os.path.exists(path):
+    if not bow_corpus.bow_corpus_exists(path):
         raise IOError(f"Could not locate path {path}")
     try:
-        with open(path, 'rb') as input:
-            corpus = pickle.load(input)
+        corpus = MmapBowCorpus(path)
     except Exception as e:
         pass
     return corpus
 
 
-def try_save_corpus(instance_path: str, corpus: List[Tuple[int, int]]):
-    '''If path exists deserialize the corpus of text documents from disk.
+@metrics.timed("corpus.save")
+def try_save_corpus(instance_path: str, corpus: Iterable[List[Tuple[int,
+                                                                    int]]]):
+    '''If path exists serialize the corpus of text documents to disk.
 
-    Querying the SQL databse and re-cleaning the document text takes about
-    as long as just deserializing the existing corpus from disk.
-    Uses the pickle module for serialization.
+    corpus can be a list or a stream of bag-of-words documents, it is
+    written out one batch at a time. See bow_corpus.save_bow_corpus().
     '''
     path = os.path.join(instance_path, _CORPUS_NAME)
     print("saving corpus to {}".format(path))
-    if not corpus:
+    if corpus is None:
         raise ValueError("Cannot save null corpus")
     if not os.path.exists(instance_path):
         raise IOError(f"Could not locate path {instance_path}")
-    with open(path, 'wb') as out:
-        pickle.dump(corpus, out)
+    bow_corpus.save_bow_corpus(path, corpus)
+
+
+@functools.lru_cache(maxsize=None)
+def _preprocess_tools():
+    '''Return the (filters, tokenizer, stemmer) used by preprocess_document().
+
+    Created on first use, filters are applied to the raw document text
+    before stemming.
+    '''
+    from gensim.parsing import preprocessing
+    from gensim.parsing.porter import PorterStemmer
+    from nltk.tokenize import RegexpTokenizer
+    filters = [
+        preprocessing.strip_tags, preprocessing.strip_punctuation,
+        preprocessing.strip_multiple_whitespaces, preprocessing.strip_numeric,
+        preprocessing.strip_short
+    ]
+    return filters, RegexpTokenizer(r'\w+'), PorterStemmer()
+
+
+def concat_doc_text(df: pd.DataFrame) -> pd.Series:
+    '''Concatenate the text columns of each row into a single document.
+    '''
+    return (df["document_name"] + df["description"] + df["steps"] +
+            df["tags"])
+    #df["ingredients"])
+
+
+def clean_words(text: str) -> List[str]:
+    '''Apply the text filters to a document and split it into lowercase
+    words.
+    '''
+    from gensim.parsing import preprocessing
+
+    filters, _, _ = _preprocess_tools()
+    text = ' '.join(preprocessing.preprocess_string(text, filters=filters))
+    return text.lower().split()  # Convert to lowercase.
+
+
+@functools.lru_cache(maxsize=_WORD_CACHE_SIZE)
+def word_tokens(word: str) -> Tuple[str, ...]:
+    '''Return the tokens of a single word returned by clean_words().
+
+    Stopword removal, stemming, and tokenization all work word by word, so
+    the tokens only depend on the word and are memoized. Repeated words are
+    only stemmed once.
+    '''
+    from gensim.parsing.preprocessing import STOPWORDS
+
+    if word in STOPWORDS:
+        return ()
+    _, tokenizer, stemmer = _preprocess_tools()
+    # Split into words. Remove numbers, but not words that contain numbers.
+    # Remove words that are only one character.
+    return tuple(token for token in tokenizer.tokenize(stemmer.stem(word))
+                 if not token.isnumeric() and len(token) > 1)
+
+
+metrics.register_cache("word_tokens", lambda: word_tokens.cache_info()[:2])
+
+
+def preprocess_document(text: str) -> List[str]:
+    '''Clean, stem, and tokenize a single document.
+
+    Remove numerics, and invalid characters, tokenize, and stem the words
+    in the document. Remove any stopwords from the text.
+    Returns the list of tokens.
+    '''
+    return [
+        token for word in clean_words(text) for token in word_tokens(word)
+    ]
+
+
+def _preprocess_chunk(docs: Sequence[str]) -> List[List[str]]:
+    '''Process pool task. Preprocess one chunk of documents.
+    '''
+    return [preprocess_document(doc) for doc in docs]
+
+
+@metrics.timed("preprocess.documents")
+def preprocess_documents(docs: Sequence[str],
+                         workers: Optional[int] = None,
+                         chunksize: Optional[int] = None,
+                         pool=None) -> List[List[str]]:
+    '''Run preprocess_document() over every document in docs.
+
+    The documents are split into chunks of `chunksize` docs and handed to
+    a pool of `workers` processes. Results are returned in the same order
+    as docs, so the output matches the serial path exactly.
+    If workers <= 1 or there is only a single chunk, run in this process.
+    An already running multiprocessing `pool` can be passed in to avoid
+    starting new processes on every call.
+    '''
+    if workers is None:
+        workers = _NUM_PREPROCESS_WORKERS
+    if chunksize is None:
+        chunksize = _PREPROCESS_CHUNKSIZE
+    if workers <= 1 or len(docs) <= chunksize:
+        return _preprocess_chunk(docs)
+
+    chunks = [docs[i:i + chunksize] for i in range(0, len(docs), chunksize)]
+    if pool is not None:
+        results = pool.map(_preprocess_chunk, chunks)
+    else:
+        with multiprocessing.Pool(processes=workers) as pool:
+            results = pool.map(_preprocess_chunk, chunks)
+    return list(itertools.chain.from_iterable(results))
+
+
+class TokenStream:
+    '''Re-iterable stream of preprocessed (tokenized) documents.
+
+    Wraps a stream of document text exposing iter_batches(), see
+    db.DocTextStream. One batch of documents is preprocessed at a time with
+    preprocess_documents(), reusing a single process pool per iteration.
+    '''
+
+    def __init__(self, docs, workers: Optional[int] = None):
+        self.docs = docs
+        self.workers = (_NUM_PREPROCESS_WORKERS
+                        if workers is None else workers)
+
+    def iter_batches(self):
+        '''Yield lists of token lists, one list per batch of documents.
+        '''
+        if self.workers <= 1:
+            for batch in self.docs.iter_batches():
+                yield _preprocess_chunk(batch)
+            return
+        with multiprocessing.Pool(processes=self.workers) as pool:
+            for batch in self.docs.iter_batches():
+                yield preprocess_documents(batch,
+                                           workers=self.workers,
+                                           pool=pool)
+
+    def __iter__(self):
+        for batch in self.iter_batches():
+            yield from batch
+
+    def __len__(self):
+        return len(self.docs)
+
+
+class BowStream:
+    '''Re-iterable bag-of-words corpus built lazily from a TokenStream.
+
+    Each document is converted with dictionary.doc2bow() as it is yielded,
+    so the full BoW corpus is never held in memory. Suitable as the corpus
+    argument of LdaMulticore, which iterates it once per pass.
+    '''
+
+    def __init__(self, tokens: TokenStream, dictionary: Dictionary):
+        self.tokens = tokens
+        self.dictionary = dictionary
+
+    def __iter__(self):
+        for batch in self.tokens.iter_batches():
+            for doc in batch:
+                yield self.dictionary.doc2bow(doc)
+
+    def __len__(self):
+        return len(self.tokens)
+
 
+def get_vocabulary() -> dict:
+    '''Return the configured vocabulary bounds, see build_dictionary().
 
+    Uses the VOCAB_NO_BELOW, VOCAB_NO_ABOVE, VOCAB_KEEP_N, VOCAB_MAX_SIZE
+    and VOCAB_HASH_BUCKETS app config values when called inside an app
+    context, the module defaults otherwise.
+    '''
+    if has_app_context():
+        return {
+            key: current_app.config.get(name, default)
+            for key, (name, default) in _VOCABULARY_BOUNDS.items()
+        }
+    return {key: default for key, (_, default) in _VOCABULARY_BOUNDS.items()}
+
+
+def _vocabulary_bounds(vocabulary: Optional[dict]) -> dict:
+    bounds = {key: default for key, (_, default) in _VOCABULARY_BOUNDS.items()}
+    unknown = set(vocabulary or ()) - set(bounds)
+    if unknown:
+        raise ValueError(f"Unknown vocabulary bounds {sorted(unknown)}")
+    bounds.update(vocabulary or {})
+    return bounds
+
+
+def filter_dictionary(dictionary: Dictionary,
+                      no_below: Optional[int] = None,
+                      no_above: Optional[float] = None,
+                      keep_n: Optional[int] = None) -> Dictionary:
+    '''Drop the rare and the common tokens of dictionary, in place.
+
+    no_below, no_above and keep_n default to _FILTER_NO_BELOW,
+    _FILTER_NO_ABOVE and _FILTER_KEEP_N.
+    Token ids are reassigned. Returns dictionary.
+    '''
+    dictionary.filter_extremes(
+        no_below=_FILTER_NO_BELOW if no_below is None else no_below,
+        no_above=_FILTER_NO_ABOVE if no_above is None else no_above,
+        keep_n=_FILTER_KEEP_N if keep_n is None else keep_n)
+    return dictionary
+
+
+def build_dictionary(batches: Iterable[List[List[str]]],
+                     vocabulary: Optional[dict] = None,
+                     filtered: bool = True):
+    '''Build the bag-of-words dictionary of batches of token lists.
+
+    vocabulary overrides the module defaults of any of the bounds:
+        no_below, no_above, keep_n  filter_dictionary() thresholds.
+        max_size      max number of tokens held while building.
+        hash_buckets  if set, return a hashing.HashingDictionary with this
+                      many ids instead. no_below and no_above apply to the
+                      buckets, max_size and keep_n do not.
+    If filtered is False every token is kept, up to max_size.
+    See get_vocabulary() for the configured bounds.
+    '''
+    bounds = _vocabulary_bounds(vocabulary)
+    if bounds["hash_buckets"]:
+        from .hashing import HashingDictionary
+
+        dictionary = HashingDictionary(bounds["hash_buckets"])
+        for batch in batches:
+            dictionary.add_documents(batch)
+        if filtered:
+            dictionary.filter_extremes(bounds["no_below"], bounds["no_above"])
+        return dictionary
+
+    from gensim.corpora import Dictionary
+
+    dictionary = Dictionary()
+    for batch in batches:
+        dictionary.add_documents(batch, prune_at=bounds["max_size"])
+    if filtered:
+        filter_dictionary(dictionary, bounds["no_below"], bounds["no_above"],
+                          bounds["keep_n"])
+    return dictionary
+
+
+@metrics.timed("preprocess.dictionary")
+def build_streaming_dictionary(tokens: TokenStream,
+                               filtered: bool = True,
+                               vocabulary: Optional[dict] = None
+                               ) -> Dictionary:
+    '''Build the bag-of-words dictionary one batch of documents at a time.
+
+    Applies the same vocabulary bounds as build_gensim_corpus(), see
+    build_dictionary().
+    '''
+    return build_dictionary(tokens.iter_batches(), vocabulary, filtered)
+
+
+@metrics.timed("preprocess.extend_dictionary")
+def extend_dictionary(dictionary: Dictionary,
+                      batches: Iterable[List[List[str]]],
+                      vocabulary: Optional[dict] = None) -> int:
+    '''Add the tokens of new documents to a built dictionary, in place.
+
+    The ids of the tokens already in dictionary are kept, so a model
+    trained with it can be updated, see update_lda_model(). Tokens of the
+    new documents within the no_below and no_above bounds of vocabulary
+    (see build_dictionary()) are appended, most frequent first, until the
+    dictionary holds keep_n tokens. Their document frequencies are those
+    of the new documents. A HashingDictionary has an id for every token
+    and only updates its statistics.
+    Returns the number of tokens added.
+    '''
+    from .hashing import HashingDictionary
+
+    bounds = _vocabulary_bounds(vocabulary)
+    if isinstance(dictionary, HashingDictionary):
+        for batch in batches:
+            dictionary.add_documents(batch)
+        return 0
+    num_terms, num_docs = len(dictionary), dictionary.num_docs
+    for batch in batches:
+        # No pruning, it could drop tokens the model knows.
+        dictionary.add_documents(batch, prune_at=None)
+    max_df = int(bounds["no_above"] * (dictionary.num_docs - num_docs))
+    new_ids = range(num_terms, len(dictionary))
+    candidates = sorted(
+        (x for x in new_ids
+         if bounds["no_below"] <= dictionary.dfs.get(x, 0) <= max_df),
+        key=lambda x: -dictionary.dfs[x])
+    keep = set(candidates[:max(0, bounds["keep_n"] - num_terms)])
+    # compactify() keeps the id order, the existing ids are all smaller.
+    dictionary.filter_tokens(bad_ids=[x for x in new_ids if x not in keep])
+    return len(dictionary) - num_terms
+
+
+@metrics.timed("preprocess.corpus")
 def build_gensim_corpus(
-        df: pd.DataFrame) -> Tuple[List[Tuple[int, int]], Dictionary]:
-    docs = df["all_text"].sample(frac=_DF_ROW_FRACTION).to_numpy()
+        df: pd.DataFrame,
+        workers: Optional[int] = None,
+        vocabulary: Optional[dict] = None
+) -> Tuple[List[Tuple[int, int]], Dictionary]:
     '''Build a bag-of-words representation of the corpus. 
 
     Remove numerics, and invalid characters, tokenize, and stem the words
     in the corpus.
     Remove any stopwords from the text.
-    Remove any tokens that occur in > 40% of documents.
+    Remove any tokens that occur in > 40% of documents, or in fewer than
+    _FILTER_NO_BELOW, and bound the vocabulary, see build_dictionary().
+    Preprocessing is split across `workers` processes, see
+    preprocess_documents().
     '''
-
+    docs = df["all_text"].sample(frac=_DF_ROW_FRACTION).tolist()
     # Split the documents into tokens.
-    tokenizer = RegexpTokenizer(r'\w+')
-    p = PorterStemmer()
-    for idx in range(len(docs)):
-        docs[idx] = preprocessing.preprocess_string(
-            docs[idx],
-            filters=[
-                preprocessing.strip_tags, preprocessing.strip_punctuation,
-                preprocessing.strip_multiple_whitespaces,
-                preprocessing.strip_numeric, preprocessing.strip_short
-            ])
-        docs[idx] = ' '.join(docs[idx])
-        docs[idx] = docs[idx].lower()  # Convert to lowercase.
-        docs[idx] = preprocessing.remove_stopwords(docs[idx])
-        docs[idx] = p.stem_sentence(docs[idx])
-        docs[idx] = tokenizer.tokenize(docs[idx])  # Split into words.
-
-    # Remove numbers, but not words that contain numbers.
-    docs = [[token for token in doc if not token.isnumeric()] for doc in docs]
-    # Remove words that are only one character.
-    docs = [[token for token in doc if len(token) > 1] for doc in docs]
+    docs = preprocess_documents(docs, workers=workers)
 
     # Lemmatize the documents. This is better than Porter stemmer but
     # requires auto install of nltk data.
@@ -226,10 +608,8 @@ def build_gensim_corpus(
     # docs = [[p.stem_sentence(token) for token in doc] for doc in docs]
 
     # Create a dictionary representation of the documents.
-    dictionary = Dictionary(docs)
-    print("docs\n{}".format(docs[1:20]))
-    # Filter out words that occur less than 0 documents, or more than 40% of the documents.
-    dictionary.filter_extremes(no_below=0, no_above=0.4)
+    dictionary = build_dictionary([docs], vocabulary)
+    logger.debug("docs\n%s", docs[1:20])
 
     # Bag-of-words representation of the documents.
     # Convert document into the bag-of-words (BoW) format
@@ -238,109 +618,244 @@ def build_gensim_corpus(
     return (corpus, dictionary)
 
 
-def print_time():
-    now = datetime.now()
-    current_time = now.strftime("%H:%M:%S")
-    print("Current Time =", current_time)
+def keyword_prior_tokens(keywords: Iterable[str]) -> List[str]:
+    '''Clean, stem, and tokenize keywords the same way as the documents.
 
+    The returned tokens can be looked up in the bag-of-words dictionary.
+    '''
+    tokens = []
+    for keyword in keywords:
+        tokens.extend(preprocess_document(keyword))
+    return list(dict.fromkeys(tokens))
 
-def create_eta():
+
+def dictionary_fingerprint(dictionary: Dictionary) -> str:
+    '''Return a hash of the token to id mapping of dictionary.
+
+    Dictionaries with the same fingerprint produce the same eta.
+    '''
+    if hasattr(dictionary, "fingerprint"):
+        # A hashing.HashingDictionary, ids do not depend on the tokens seen.
+        return dictionary.fingerprint()
+    tokens = sorted(dictionary.token2id.items(), key=lambda x: x[1])
+    digest = hashlib.sha1()
+    for token, _ in tokens:
+        digest.update(token.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def create_eta(dictionary: Dictionary,
+               keywords: Optional[Iterable[str]] = None,
+               prior_probability: float = _PRIOR_PROBABILITY) -> np.ndarray:
     '''Create numpy array of dirichlet priors.
 
     Where N is the number of unique tokens in the corpus. Create a
     numpy array with length N. Each entry corresponds to the Dirichlet
-    prior for a single word. Set the probability of each word to 1/N
-    initially.
-
-    For key words that correspond to topics of interest increase the
-    probability to be > 1/N while keeping sum(ARR) = 1.0.
-
-    Returns the modified numpy array
-    '''
-    global _LDA_KEYWORD_PRIORS
-    dictionary = g.dictionary
-    corpus = g.corpus
-    culture_match_ids = list()
-    all_tokens = dictionary.token2id.keys()
-    print("Dictionary is {}".format(g.dictionary))
-    print("Dictionary repr is {}".format(repr(g.dictionary)))
-    print("Dictionary token2id is {}".format(repr(g.dictionary.token2id)))
-    for culture in _LDA_KEYWORD_PRIORS:
-        print("Searching for {}, in {}".format(
-            culture, dictionary.token2id.get(culture, "<blank>")))
-        if culture in dictionary.token2id:
-            print(f"Found culture {culture} in tokens")
-            culture_match_ids.append((culture, dictionary.token2id[culture]))
-    n_tokens = len(all_tokens)
-    n_culture_tokens = len(culture_match_ids)
-    n_normal_tokens = n_tokens - n_culture_tokens
-    print(f"{n_tokens}, {n_culture_tokens}, {n_normal_tokens}")
-    per_token_probability = (1.0 - _PRIOR_PROBABILITY) / n_normal_tokens
-    culture_token_probability = (_PRIOR_PROBABILITY) / n_culture_tokens
-    eta = list(np.full(n_tokens, per_token_probability))
-    for culture in culture_match_ids:
-        eta[culture[1]] = culture_token_probability
+    prior for a single word.
+
+    The tokens of the key words that correspond to topics of interest share
+    prior_probability, the remaining tokens share the rest, so that
+    sum(ARR) = 1.0. If none of the key words are in the dictionary the
+    prior is uniform.
+
+    Uses the configured prior keywords if no keywords are passed in, see
+    cuisines.get_prior_keywords().
+    Results are cached by (dictionary_fingerprint(), keyword set,
+    prior_probability). The returned array is shared and read-only.
+    '''
+    keywords = list(
+        cuisines.get_prior_keywords() if keywords is None else keywords)
+    key = (dictionary_fingerprint(dictionary), frozenset(keywords),
+           prior_probability)
+    with _eta_cache_lock:
+        eta = _eta_cache.get(key)
+        metrics.cache_lookup("eta", eta is not None)
+        if eta is not None:
+            _eta_cache.move_to_end(key)
+            return eta
+
+    n_tokens = len(dictionary.token2id)
+    keyword_ids = np.fromiter((dictionary.token2id.get(x, -1)
+                               for x in keyword_prior_tokens(keywords)),
+                              dtype=np.int64)
+    keyword_ids = keyword_ids[keyword_ids >= 0]
+    n_keyword_tokens = len(keyword_ids)
+    logger.debug("eta: %d tokens, %d keyword tokens", n_tokens,
+                 n_keyword_tokens)
+    if n_keyword_tokens == 0 or n_keyword_tokens == n_tokens:
+        eta = np.full(n_tokens, 1.0 / n_tokens, dtype=_ETA_DTYPE)
+    else:
+        eta = np.full(n_tokens, (1.0 - prior_probability) /
+                      (n_tokens - n_keyword_tokens),
+                      dtype=_ETA_DTYPE)
+        eta[keyword_ids] = prior_probability / n_keyword_tokens
+    eta.setflags(write=False)
+    with _eta_cache_lock:
+        _eta_cache[key] = eta
+        while len(_eta_cache) > _ETA_CACHE_SIZE:
+            _eta_cache.popitem(last=False)
     return eta
 
 
-def compute_lda_model(df: pd.DataFrame, instance_path: str):
-    '''Load the corpus and bag-of-words dictionary from disk. Compute topic model.
+@metrics.timed("model.train")
+def train_lda_model(corpus,
+                    dictionary: Dictionary,
+                    eta,
+                    passes: Optional[int] = None,
+                    num_topics: Optional[int] = None,
+                    workers: Optional[int] = None) -> LdaMulticore:
+    '''Train the LDA topic model over the bag-of-words corpus.
 
-    Returns the top 20 words and _NUM_TOPICS most significant topics discovered
-    by the topic modeling algorithm.
+    corpus can be any re-iterable of BoW documents, e.g. a list or BowStream.
+    passes, num_topics and workers default to _NUM_PASSES, _NUM_TOPICS and
+    _NUM_WORKDERS. If workers <= 1 the model is trained in this process
+    with LdaModel, which LdaMulticore extends, e.g. inside a process pool.
     '''
-    print_time()
-    corpus, dictionary = build_gensim_corpus(df)
+    from gensim.models import LdaModel
+    from gensim.models.ldamulticore import LdaMulticore
+
+    if passes is None:
+        passes = _NUM_PASSES
+    if num_topics is None:
+        num_topics = _NUM_TOPICS
+    if workers is None:
+        workers = _NUM_WORKDERS
     # https://stackoverflow.com/questions/67229373/gensim-lda-error-cannot-compute-lda-over-an-empty-collection-no-terms
-    print_time()
     temp = dictionary[0]  # This is only to "load" the dictionary.
-    print_time()
-    try_save_dictionary(instance_path, dictionary)
-    print_time()
-    try_save_corpus(instance_path, corpus)
-    print_time()
-    g.dictionary = dictionary
-    g.corpus = corpus
-    eta = create_eta()
-    model = LdaMulticore(
-        corpus,
-        workers=_NUM_WORKDERS,
+    kwargs = dict(
         id2word=dictionary.id2token,
         # eta='auto',
         eta=eta,
-        num_topics=_NUM_TOPICS,
-        passes=_NUM_PASSES,
+        num_topics=num_topics,
+        passes=passes,
         iterations=_NUM_ITERATIONS,
         eval_every=_EVAL_EVERY)
-    print_time()
+    if workers <= 1:
+        return LdaModel(corpus, **kwargs)
+    model = LdaMulticore(corpus, workers=workers, **kwargs)
     return model
 
 
-def run_topic_model(df: pd.DataFrame, instance_path: str) -> LdaMulticore:
-    '''Return top _NUM_TOPICS topcs in the corpus using and LDA model.
+@metrics.timed("model.update")
+def update_lda_model(model: LdaMulticore,
+                     dictionary: Dictionary,
+                     corpus,
+                     eta,
+                     passes: Optional[int] = None) -> LdaMulticore:
+    '''Update a trained model online with the documents of corpus.
+
+    model must be loaded with mmap=None, see try_get_saved_model().
+    dictionary is the model's dictionary after extend_dictionary(), the
+    topic-word weights of the added tokens start at their eta prior. eta is
+    the prior over the extended dictionary, see create_eta(), the model
+    gets its own copy. Runs passes
+    (default _NUM_UPDATE_PASSES) of online variational Bayes over corpus,
+    so the cost is proportional to the new documents. What the model
+    learned from earlier documents is kept, including documents that have
+    since changed or been removed, see updates.read_model_drift(). Returns
+    model.
+    '''
+    if passes is None:
+        passes = _NUM_UPDATE_PASSES
+    num_terms = len(dictionary)
+    if num_terms < model.num_terms:
+        raise ValueError(f"Dictionary has {num_terms} terms, the model "
+                         f"{model.num_terms}")
+    state = model.state
+    if num_terms > model.num_terms:
+        state.sstats = np.hstack([
+            state.sstats,
+            np.zeros((model.num_topics, num_terms - model.num_terms),
+                     dtype=state.sstats.dtype)
+        ])
+        model.num_terms = num_terms
+    # create_eta() returns a shared read-only array.
+    model.eta = state.eta = eta.copy()
+    model.id2word = dictionary
+    model.sync_state()
+    model.passes = passes
+    model.update(corpus)
+    return model
 
-    Main method for the generating topics used by the `/topic/corpus`
-    view.
+
+def compute_lda_model_streaming(docs,
+                                instance_path: str,
+                                on_stage: Optional[Callable[[str],
+                                                            None]] = None,
+                                keywords: Optional[Iterable[str]] = None,
+                                prior_probability: float = _PRIOR_PROBABILITY,
+                                vocabulary: Optional[dict] = None):
+    '''Compute the topic model without loading the corpus into memory.
+
+    docs is a re-iterable stream of document text, see db.DocTextStream.
+    The first pass over docs builds the dictionary, the second writes the
+    bag-of-words corpus to disk. Training then streams the memory-mapped
+    corpus. Peak memory is bounded by the stream batch size rather than the
+    corpus size.
+    on_stage is called with the name of each stage as it starts.
+    keywords and prior_probability steer the topics, see create_eta().
+    vocabulary bounds the dictionary, see build_dictionary().
     '''
-    model = None
-    try:
-        dictionary = try_get_saved_dictionary(instance_path)
-        corpus = try_get_saved_corpus(instance_path)
-        g.dictionary = dictionary
-        g.corpus = corpus
-    except IOError as e:
-        pass
+    if on_stage is None:
+        on_stage = lambda stage: None
+    on_stage("dictionary")
+    tokens = TokenStream(docs)
+    dictionary = build_streaming_dictionary(tokens, vocabulary=vocabulary)
+    try_save_dictionary(instance_path, dictionary)
+    on_stage("corpus")
+    try_save_corpus(instance_path, BowStream(tokens, dictionary))
+    corpus = try_get_saved_corpus(instance_path)
+    on_stage("training")
+    eta = create_eta(dictionary, keywords, prior_probability)
+    model = train_lda_model(corpus, dictionary, eta)
+    return model
 
-    try:
-        model = try_get_saved_model(instance_path)
-        print("Model topics {}".format(
-            model.print_topics(num_topics=_NUM_TOPICS, num_words=20)))
-        return model
-    except IOError as e:
-        pass
 
-    model = compute_lda_model(df, instance_path)
-    print("Model topics {}".format(
-        model.print_topics(num_topics=_NUM_TOPICS, num_words=20)))
+def update_lda_model_streaming(docs,
+                               base_path: str,
+                               instance_path: str,
+                               on_stage: Optional[Callable[[str],
+                                                           None]] = None,
+                               keywords: Optional[Iterable[str]] = None,
+                               prior_probability: float = _PRIOR_PROBABILITY,
+                               vocabulary: Optional[dict] = None,
+                               passes: Optional[int] = None):
+    '''Update the model saved in base_path with new documents.
+
+    docs is a re-iterable stream of the text of the new documents only, see
+    db.DocTextStream. The dictionary of base_path is extended with their
+    tokens (see extend_dictionary()) and saved to instance_path with their
+    bag-of-words corpus, which the model is then updated with, see
+    update_lda_model(). keywords, prior_probability and vocabulary should
+    be those the base model was trained with.
+    on_stage is called with the name of each stage as it starts.
+    '''
+    if on_stage is None:
+        on_stage = lambda stage: None
+    on_stage("dictionary")
+    dictionary = try_get_saved_dictionary(base_path)
+    if dictionary is None:
+        raise IOError(f"Could not load the dictionary in {base_path}")
+    tokens = TokenStream(docs)
+    extend_dictionary(dictionary, tokens.iter_batches(), vocabulary)
+    try_save_dictionary(instance_path, dictionary)
+    on_stage("corpus")
+    try_save_corpus(instance_path, BowStream(tokens, dictionary))
+    corpus = try_get_saved_corpus(instance_path)
+    on_stage("training")
+    model = try_get_saved_model(base_path, dictionary, mmap=None)
+    if model is None:
+        raise IOError(f"Could not load the model in {base_path}")
+    eta = create_eta(dictionary, keywords, prior_probability)
+    return update_lda_model(model, dictionary, corpus, eta, passes)
+
+
+def save_model_artifacts(instance_path: str, model: LdaMulticore):
+    '''Save the trained model and its precomputed topic summary.
+    '''
+    topics = summarize_topics(model)
+    logger.debug("Model topics %s", topics)
+    # Save the summary first, the registry watches the model file.
+    try_save_topics(instance_path, topics)
     try_save_model(instance_path, model)
-    return model
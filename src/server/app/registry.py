@@ -0,0 +1,183 @@
+import os
+import logging
+import threading
+import time
+from typing import Optional
+
+from flask import current_app
+from flask.json import jsonify
+
+from . import model_store
+from . import modelling
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the artifact mtimes on disk.
+_RELOAD_CHECK_SECONDS = 5.0
+# Artifacts modified less than _SETTLE_SECONDS ago may still be being
+# written, wait for the next check before loading them.
+_SETTLE_SECONDS = 1.0
+# Key used to store the registry in app.extensions.
+_EXTENSION_KEY = "model_registry"
+
+
+class LoadedModel:
+    '''Snapshot of the topic model artifacts loaded from instance_path.
+
+    Never modified after creation. A reload creates a new LoadedModel and
+    swaps the registry reference, so requests holding the old snapshot keep
+    a consistent model/dictionary pair.
+    '''
+
+    def __init__(self, model, dictionary, corpus, topics, path: str,
+                 version: str, artifact_version: str, modified: float,
+                 loaded_at: float):
+        self.model = model
+        self.dictionary = dictionary
+        self.corpus = corpus
+        self.topics = topics
+        self.path = path
+        # Name of the published version, see model_store.version_name(). The
+        # version reported by every endpoint.
+        self.version = version
+        # Changes whenever the artifacts are rewritten, even in place under
+        # the same version name. Keys the caches derived from the model.
+        self.artifact_version = artifact_version
+        # Modification time of the newest artifact, seconds since the epoch.
+        self.modified = modified
+        self.loaded_at = loaded_at
+
+
+class ModelRegistry:
+    '''Process wide cache of the saved topic model, dictionary, and corpus.
+
+    Artifacts are deserialized once and shared by every request handled by
+    this process. get() periodically compares the artifact mtimes with the
+    loaded version and loads the new files when they change. The artifacts
+    are read from the published version, see model_store.current_model_path().
+    '''
+
+    def __init__(self,
+                 instance_path: str,
+                 check_interval: float = _RELOAD_CHECK_SECONDS):
+        self.instance_path = instance_path
+        self.check_interval = check_interval
+        self._current = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+
+    def _artifact_paths(self, path: str):
+        return [
+            os.path.join(path, modelling._MODEL_NAME),
+            os.path.join(path, modelling._DICTIONARY_NAME),
+        ]
+
+    def _artifact_version(self,
+                          path: str,
+                          settle: bool = True) -> Optional[str]:
+        '''Return a version string built from the artifact mtimes in path.
+
+        Returns None if any artifact is missing, or if settle is True and
+        an artifact was modified in the last _SETTLE_SECONDS.
+        '''
+        try:
+            mtimes = [os.stat(x).st_mtime_ns for x in self._artifact_paths(path)]
+        except OSError:
+            return None
+        if settle and time.time() - max(mtimes) / 1e9 < _SETTLE_SECONDS:
+            return None
+        return "{:x}".format(max(mtimes))
+
+    def reload(self, force: bool = False) -> Optional[LoadedModel]:
+        '''Load the artifacts if they changed since the last load.
+
+        force reloads even if the version is unchanged, and does not wait
+        for recently written files to settle. Use it right after saving.
+        On failure the previously loaded version keeps being served.
+        '''
+        with self._lock:
+            self._last_check = time.monotonic()
+            path = model_store.current_model_path(self.instance_path)
+            # Published versions are complete once the pointer is swapped,
+            # only files written straight into instance_path can be partial.
+            settle = not force and path == self.instance_path
+            artifact_version = self._artifact_version(path, settle=settle)
+            current = self._current
+            if artifact_version is None:
+                return current
+            if (not force and current is not None
+                    and current.artifact_version == artifact_version):
+                return current
+            try:
+                dictionary = modelling.try_get_saved_dictionary(path)
+                model = modelling.try_get_saved_model(path, dictionary)
+            except IOError as e:
+                logger.warning("Model registry failed to load: %s", e)
+                return current
+            try:
+                corpus = modelling.try_get_saved_corpus(path)
+            except IOError:
+                corpus = None
+            if model is None or dictionary is None:
+                return current
+            try:
+                topics = modelling.try_get_saved_topics(path)
+            except IOError:
+                topics = None
+            if not topics:
+                topics = modelling.summarize_topics(model)
+            version = model_store.version_name(self.instance_path, path)
+            # artifact_version is the newest artifact mtime in hex
+            # nanoseconds.
+            self._current = LoadedModel(model, dictionary, corpus, topics,
+                                        path, version, artifact_version,
+                                        int(artifact_version, 16) / 1e9,
+                                        time.time())
+            logger.debug("Model registry loaded version %s (%s)", version,
+                         artifact_version)
+            return self._current
+
+    def get(self) -> Optional[LoadedModel]:
+        '''Return the loaded model, reloading it if the files changed.
+
+        Returns None if no saved model is available yet. Until a model is
+        loaded the artifacts are checked on every call.
+        '''
+        if (self._current is None or
+                time.monotonic() - self._last_check >= self.check_interval):
+            return self.reload()
+        return self._current
+
+    def is_ready(self) -> bool:
+        return self._current is not None
+
+
+def get_registry() -> ModelRegistry:
+    '''Return the ModelRegistry of the current Flask app.
+    '''
+    return current_app.extensions[_EXTENSION_KEY]
+
+
+def ready():
+    '''Readiness probe. 200 once a model is loaded, 503 until then.
+    '''
+    loaded = get_registry().get()
+    if loaded is None:
+        return jsonify({"ready": False}), 503
+    return jsonify({"ready": True, "version": loaded.version})
+
+
+def init_app(app):
+    '''Called from flask_app.py.
+
+    Creates the process wide model registry, and loads the saved model
+    unless MODEL_EAGER_LOAD is False. Adds the `/ready` endpoint.
+    '''
+    registry = ModelRegistry(app.instance_path,
+                             check_interval=app.config.get(
+                                 'MODEL_RELOAD_INTERVAL',
+                                 _RELOAD_CHECK_SECONDS))
+    app.extensions[_EXTENSION_KEY] = registry
+    if app.config.get('MODEL_EAGER_LOAD', True):
+        registry.reload()
+    app.add_url_rule('/ready', 'ready', ready)
@@ -0,0 +1,122 @@
+import os
+import random
+import threading
+from typing import List, Optional, Sequence
+
+from . import metrics
+from . import sql_strings
+
+# Max rounds of rowid rejection sampling before falling back to a full
+# ORDER BY RANDOM() scan. Only reached if most rowids in the id range
+# have been deleted.
+_MAX_SAMPLE_ROUNDS = 8
+# Max number of ids bound to a single `IN (...)` lookup. Older sqlite
+# builds limit a statement to 999 variables.
+_MAX_SQL_VARIABLES = 900
+# Cached arrays of cuisine doc ids, keyed by (database, cuisine).
+_id_cache = {}
+_id_cache_lock = threading.Lock()
+
+
+def _database_version(database: str):
+    '''Cheap change detector for the DB file, including its WAL.
+    '''
+    version = []
+    for path in (database, database + "-wal"):
+        try:
+            stat = os.stat(path)
+            version.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            version.append(None)
+    return tuple(version)
+
+
+def fetch_docs_by_ids(db, ids: Sequence[int]) -> List:
+    '''Fetch the text rows of the given corpus ids by primary key.
+
+    Rows are returned in the order of ids. Ids that do not exist are
+    skipped.
+    '''
+    rows = {}
+    for i in range(0, len(ids), _MAX_SQL_VARIABLES):
+        chunk = list(ids[i:i + _MAX_SQL_VARIABLES])
+        sql = sql_strings._SELECT_TEXT_DATA_BY_IDS.format(",".join(
+            "?" * len(chunk)))
+        rows.update((row["doc_id"], row) for row in db.execute(sql, chunk))
+    return [rows[x] for x in ids if x in rows]
+
+
+@metrics.timed("db.sample_docs")
+def sample_docs(db, k: int, rng: Optional[random.Random] = None) -> List:
+    '''Return k documents drawn uniformly without replacement.
+
+    Picks random rowids in [MIN(id), MAX(id)] of the corpus table and looks
+    them up by primary key, retrying for ids that no longer exist. The cost
+    is O(k) lookups instead of sorting the whole table.
+    '''
+    rng = rng or random
+    lo, hi = db.execute(sql_strings._SELECT_CORPUS_ID_RANGE).fetchone()
+    if lo is None or k <= 0:
+        return []
+    n_ids = hi - lo + 1
+    tried = set()
+    rows = []
+    for _ in range(_MAX_SAMPLE_ROUNDS):
+        need = k - len(rows)
+        untried = n_ids - len(tried)
+        if need <= 0 or untried <= 0:
+            return rows
+        candidates = set()
+        while len(candidates) < min(need, untried):
+            x = rng.randint(lo, hi)
+            if x not in tried:
+                candidates.add(x)
+        tried.update(candidates)
+        candidates = list(candidates)
+        rng.shuffle(candidates)
+        rows.extend(fetch_docs_by_ids(db, candidates))
+    if len(rows) < k:
+        # The id range is too sparse, sample with a full scan instead.
+        return db.execute(sql_strings._SELECT_RANDOM_TEXT_DATA,
+                          [k]).fetchall()
+    return rows
+
+
+def cuisine_doc_ids(db, database: str, cuisine: Optional[str] = None):
+    '''Return the sorted ids of all cuisine documents, or of one cuisine.
+
+    The id list is cached per process and reloaded when the DB changes.
+    '''
+    key = (database, cuisine)
+    version = _database_version(database)
+    with _id_cache_lock:
+        cached = _id_cache.get(key)
+        hit = cached is not None and cached[0] == version
+        metrics.cache_lookup("cuisine_doc_ids", hit)
+        if hit:
+            return cached[1]
+    if cuisine is None:
+        cur = db.execute(sql_strings._SELECT_ALL_CUISINE_DOC_IDS)
+    else:
+        cur = db.execute(sql_strings._SELECT_CUISINE_DOC_IDS, [cuisine])
+    ids = [row[0] for row in cur]
+    with _id_cache_lock:
+        _id_cache[key] = (version, ids)
+    return ids
+
+
+@metrics.timed("db.sample_cuisine_docs")
+def sample_cuisine_docs(db,
+                        database: str,
+                        k: int,
+                        cuisine: Optional[str] = None,
+                        rng: Optional[random.Random] = None) -> List:
+    '''Return k cuisine documents drawn uniformly without replacement.
+
+    Picks k random positions in the cached id array of the cuisine subset
+    and fetches only those rows by primary key.
+    '''
+    rng = rng or random
+    ids = cuisine_doc_ids(db, database, cuisine)
+    picks = rng.sample(ids, min(k, len(ids)))
+    return fetch_docs_by_ids(db, picks)
@@ -1,7 +1,13 @@
-DROP TABLE IF EXISTS corpus;
-DROP TABLE IF EXISTS tags;
+-- Tables referencing corpus and tags are dropped first, the writer
+-- connection enforces foreign keys, see connections._WRITE_PRAGMAS.
 DROP TABLE IF EXISTS doc_tags;
+DROP TABLE IF EXISTS doc_cuisines;
+DROP TABLE IF EXISTS topic_top_docs;
 DROP TABLE IF EXISTS models;
+DROP TABLE IF EXISTS corpus_stats;
+DROP TABLE IF EXISTS corpus_length_hist;
+DROP TABLE IF EXISTS corpus;
+DROP TABLE IF EXISTS tags;
 
 PRAGMA foreign_keys = ON;
 
@@ -9,7 +15,8 @@ CREATE TABLE corpus (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   third_party_id INTEGER UNIQUE NOT NULL, --id from the kaggle database
   document_name TEXT UNIQUE NOT NULL,
-  document_text TEXT NOT NULL
+  document_text TEXT NOT NULL,
+  content_hash TEXT -- see db.content_hashes()
 );
 
 CREATE TABLE tags (
@@ -26,6 +33,19 @@ CREATE TABLE doc_tags (
   FOREIGN KEY (doc_id) REFERENCES corpus (id)
 );
 
+-- Indexes are built after loading, see db.ingest_raw_recipes().
+
+-- Cuisine keyword membership of each document.
+-- Filled by cuisines.refresh_doc_cuisines().
+CREATE TABLE doc_cuisines (
+  doc_id INTEGER NOT NULL,
+  cuisine TEXT NOT NULL,
+  PRIMARY KEY (doc_id, cuisine),
+  FOREIGN KEY (doc_id) REFERENCES corpus (id)
+) WITHOUT ROWID;
+
+-- Index doc_cuisines_cuisine is created by cuisines.refresh_doc_cuisines().
+
 CREATE TABLE models (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   doc_id INTEGER UNIQUE NOT NULL, -- id from corpus table
@@ -45,3 +65,35 @@ CREATE TABLE models (
   -- FOREIGN KEY (author_id) REFERENCES corpus (id)
   -- FOREIGN KEY (doc_id) REFERENCES corpus (id)
 );
+
+-- Highest weighted documents of each topic of a model version.
+-- Filled by doc_topics.compute_doc_topics().
+CREATE TABLE topic_top_docs (
+  version TEXT NOT NULL,
+  topic INTEGER NOT NULL,
+  rank INTEGER NOT NULL,
+  doc_id INTEGER NOT NULL,
+  weight REAL NOT NULL,
+  PRIMARY KEY (version, topic, rank),
+  FOREIGN KEY (doc_id) REFERENCES corpus (id)
+) WITHOUT ROWID;
+
+-- Document count and total document length of the whole corpus, of the
+-- cuisine corpus, and of every cuisine keyword and tag. Maintained by
+-- corpus_stats.refresh_corpus_stats().
+CREATE TABLE corpus_stats (
+  kind TEXT NOT NULL, -- 'corpus', 'cuisines', 'cuisine' or 'tag'
+  name TEXT NOT NULL, -- the cuisine keyword or tag, '' otherwise
+  n_docs INTEGER NOT NULL,
+  total_length INTEGER NOT NULL,
+  PRIMARY KEY (kind, name)
+) WITHOUT ROWID;
+
+-- Document length histograms, see corpus_stats._LENGTH_BUCKETS.
+CREATE TABLE corpus_length_hist (
+  kind TEXT NOT NULL,
+  name TEXT NOT NULL,
+  bucket INTEGER NOT NULL,
+  n_docs INTEGER NOT NULL,
+  PRIMARY KEY (kind, name, bucket)
+) WITHOUT ROWID;
@@ -43,40 +43,214 @@
 # Insert Strings
 #################################################################
 
+# Corpus and tag ids are assigned by db.RawRecipeLoader, so the rows
+# referencing them can be inserted without looking the ids up again.
 _INSERT_RAW_RECIPES_CORPUS = '''
-  INSERT INTO corpus (id, third_party_id, document_name, document_text)
-  VALUES (NULL, ?, ?, ?)
+  INSERT INTO corpus (id, third_party_id, document_name, document_text,
+    content_hash)
+  VALUES (?, ?, ?, ?, ?)
 '''
 
 _INSERT_RAW_RECIPES_TAGS = '''
   INSERT INTO tags (id, tag)
-  VALUES (NULL, ?)
+  VALUES (?, ?)
 '''
 
 _INSERT_RAW_RECIPES_MODELS = '''
   INSERT INTO models (id, doc_id, third_party_id, tags, contributor_id, steps,
     description, ingredients, n_ingredients)
-  VALUES (NULL,
-    (SELECT corpus.id FROM corpus WHERE corpus.third_party_id=?),
-    ?, ?, ?, ?, ?, ?, ?)
+  VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?)
 '''
 
-# Note sqlite has no concat operator
-# JOIN tags ON models.tags LIKE CONCAT(\'%\', CONCAT(tags.tag, \'%\'))
 _INSERT_DOC_TAGS = '''
   INSERT INTO doc_tags (tag, tag_id, doc_id, third_party_id)
-  WITH docs_by_tag AS (
-    SELECT
-      tags.tag,
-      tags.id,
-      models.doc_id,
-      models.third_party_id
-    FROM 
-      models
-    JOIN tags ON models.tags LIKE \'%\' || tags.tag || \'%\'
+  VALUES (?, ?, ?, ?)
+'''
+
+_SELECT_TAG_IDS = '''
+  SELECT tags.id AS tag_id, tags.tag FROM tags
+'''
+
+_SELECT_DOC_IDS = '''
+  SELECT corpus.id AS doc_id, corpus.third_party_id FROM corpus
+'''
+
+# Largest corpus and tag ids ever handed out. corpus and tags are
+# AUTOINCREMENT tables, sqlite_sequence keeps the high-water mark of the
+# explicit ids inserted by db.RawRecipeLoader, so ids of deleted rows are
+# never reused.
+_SELECT_MAX_IDS = '''
+  SELECT
+    (SELECT MAX(IFNULL(MAX(corpus.id), 0),
+                IFNULL((SELECT seq FROM sqlite_sequence
+                        WHERE name = 'corpus'), 0)) FROM corpus),
+    (SELECT MAX(IFNULL(MAX(tags.id), 0),
+                IFNULL((SELECT seq FROM sqlite_sequence
+                        WHERE name = 'tags'), 0)) FROM tags)
+'''
+
+#################################################################
+# Upsert Strings
+#################################################################
+
+# Content hash of every document, see db.upsert_raw_recipes().
+_SELECT_DOC_HASHES = '''
+  SELECT
+    corpus.third_party_id,
+    corpus.id AS doc_id,
+    corpus.content_hash,
+    corpus.document_name
+  FROM corpus
+'''
+
+_SELECT_CORPUS_COLUMN_NAMES = '''
+  SELECT name FROM pragma_table_info('corpus')
+'''
+
+# corpus.content_hash was added after the first DBs were built.
+_ADD_CORPUS_CONTENT_HASH = '''
+  ALTER TABLE corpus ADD COLUMN content_hash TEXT
+'''
+
+# The stored columns hashed by db.content_hashes(), in db._CONTENT_COLUMNS
+# order.
+_SELECT_DOCS_WITHOUT_CONTENT_HASH = '''
+  SELECT
+    corpus.id AS doc_id,
+    corpus.document_name,
+    corpus.document_text,
+    models.tags,
+    models.contributor_id,
+    models.steps,
+    models.ingredients,
+    models.n_ingredients
+  FROM corpus
+  INNER JOIN models ON corpus.id=models.doc_id
+  WHERE corpus.content_hash IS NULL
+'''
+
+_UPDATE_CONTENT_HASH = '''
+  UPDATE corpus SET content_hash = ? WHERE corpus.id = ?
+'''
+
+_CREATE_TEMP_DELETE_DOC_IDS = '''
+  CREATE TEMP TABLE IF NOT EXISTS delete_doc_ids (
+    doc_id INTEGER PRIMARY KEY
+  )
+'''
+
+_DELETE_TEMP_DELETE_DOC_IDS = '''
+  DELETE FROM delete_doc_ids
+'''
+
+_INSERT_TEMP_DELETE_DOC_IDS = '''
+  INSERT OR IGNORE INTO delete_doc_ids (doc_id) VALUES (?)
+'''
+
+# Delete the documents in delete_doc_ids, the rows referencing them first.
+_DELETE_DOCS = [
+    '''
+  DELETE FROM doc_tags
+  WHERE doc_tags.doc_id IN (SELECT doc_id FROM delete_doc_ids)
+''',
+    '''
+  DELETE FROM doc_cuisines
+  WHERE doc_cuisines.doc_id IN (SELECT doc_id FROM delete_doc_ids)
+''',
+    '''
+  DELETE FROM topic_top_docs
+  WHERE topic_top_docs.doc_id IN (SELECT doc_id FROM delete_doc_ids)
+''',
+    '''
+  DELETE FROM models
+  WHERE models.doc_id IN (SELECT doc_id FROM delete_doc_ids)
+''',
+    '''
+  DELETE FROM corpus
+  WHERE corpus.id IN (SELECT doc_id FROM delete_doc_ids)
+''',
+]
+
+# Secondary indexes, built by db.ingest_raw_recipes() after the bulk load
+# rather than updated row by row during it.
+_CREATE_INGEST_INDEXES = [
+    '''
+  CREATE INDEX IF NOT EXISTS doc_tags_tag_id ON doc_tags (tag_id)
+''',
+    '''
+  CREATE INDEX IF NOT EXISTS doc_tags_doc_id ON doc_tags (doc_id)
+''',
+]
+
+# Connection settings used during the bulk load. The WAL journal mode is
+# persistent, the other pragmas only apply to the loading connection and are
+# restored afterwards, inside the caller's transaction. synchronous and
+# temp_store can not be changed there, see connections._WRITE_PRAGMAS.
+_INGEST_PRAGMAS = {
+    "cache_size": "-262144",  # KiB, i.e. 256 MiB.
+}
+
+#################################################################
+# Cuisine Membership Strings
+#################################################################
+
+_CREATE_DOC_CUISINES = '''
+  CREATE TABLE IF NOT EXISTS doc_cuisines (
+    doc_id INTEGER NOT NULL,
+    cuisine TEXT NOT NULL,
+    PRIMARY KEY (doc_id, cuisine),
+    FOREIGN KEY (doc_id) REFERENCES corpus (id)
+  ) WITHOUT ROWID
+'''
+
+_CREATE_DOC_CUISINES_INDEX = '''
+  CREATE INDEX IF NOT EXISTS doc_cuisines_cuisine
+  ON doc_cuisines (cuisine, doc_id)
+'''
+
+_SELECT_CUISINE_KEYWORDS = '''
+  SELECT DISTINCT doc_cuisines.cuisine FROM doc_cuisines
+'''
+
+_DELETE_DOC_CUISINES_BY_CUISINE = '''
+  DELETE FROM doc_cuisines WHERE doc_cuisines.cuisine = ?
+'''
+
+# Params: (cuisine, keyword). The keyword is matched against the tag text.
+_INSERT_DOC_CUISINES = '''
+  INSERT OR IGNORE INTO doc_cuisines (doc_id, cuisine)
+  SELECT DISTINCT doc_tags.doc_id, ?
+  FROM tags
+  INNER JOIN doc_tags ON doc_tags.tag_id=tags.id
+  WHERE tags.tag LIKE \'%\' || ? || \'%\'
+'''
+
+_CREATE_TEMP_REFRESH_DOC_IDS = '''
+  CREATE TEMP TABLE IF NOT EXISTS refresh_doc_ids (
+    doc_id INTEGER PRIMARY KEY
   )
-  SELECT *
-  FROM docs_by_tag
+'''
+
+_DELETE_TEMP_REFRESH_DOC_IDS = '''
+  DELETE FROM refresh_doc_ids
+'''
+
+_INSERT_TEMP_REFRESH_DOC_IDS = '''
+  INSERT OR IGNORE INTO refresh_doc_ids (doc_id) VALUES (?)
+'''
+
+_DELETE_DOC_CUISINES_BY_REFRESH_DOC_IDS = '''
+  DELETE FROM doc_cuisines
+  WHERE doc_cuisines.doc_id IN (SELECT doc_id FROM refresh_doc_ids)
+'''
+
+_INSERT_DOC_CUISINES_FOR_REFRESH_DOC_IDS = '''
+  INSERT OR IGNORE INTO doc_cuisines (doc_id, cuisine)
+  SELECT DISTINCT doc_tags.doc_id, ?
+  FROM tags
+  INNER JOIN doc_tags ON doc_tags.tag_id=tags.id
+  INNER JOIN refresh_doc_ids ON refresh_doc_ids.doc_id=doc_tags.doc_id
+  WHERE tags.tag LIKE \'%\' || ? || \'%\'
 '''
 
 #################################################################
@@ -95,50 +269,11 @@ _SELECT_ALL_TEXT_DATA = '''
   INNER JOIN models ON corpus.id=models.doc_id
 '''
 
-#WITH relevant_docs AS (
-#  WITH relevant_tags AS (
-#    SELECT tags.id FROM tags WHERE (tags.tag LIKE "%asia%") OR (tags.tag LIKE "%thai%")
-#    OR (tags.tag LIKE "%chinese%")  OR (tags.tag LIKE "%korea%")
-#    OR (tags.tag LIKE "%viet%") OR (tags.tag LIKE "%singapore%")
-#    OR (tags.tag LIKE "%italy%") OR (tags.tag LIKE "%italian%")
-#    OR (tags.tag LIKE "%european%") OR (tags.tag LIKE "%french%")
-#    OR (tags.tag LIKE "%france%") OR (tags.tag LIKE "%british%")
-#    OR (tags.tag LIKE "%britain%") OR (tags.tag LIKE "%mediterranean%")
-#    OR (tags.tag LIKE "%africa%") OR (tags.tag LIKE "%kenya%")
-#    OR (tags.tag LIKE "%israel%") OR (tags.tag LIKE "%middle-e%")
-#  )
-#  SELECT doc_tags.doc_id
-#  FROM doc_tags
-#  INNER JOIN relevant_tags ON doc_tags.tag_id=relevant_tags.id
-#)
-#SELECT id, document_name
-#FROM corpus
-#INNER JOIN relevant_docs ON corpus.id=relevant_docs.doc_id
-#LIMIT 1000;
-
+# Documents belonging to any cuisine of interest. doc_cuisines is filled
+# at ingest by cuisines.refresh_doc_cuisines().
 _SELECT_ALL_CUISINE_TEXT_DATA = '''
-  WITH relevant_docs AS (
-    WITH relevant_tags AS (
-      SELECT tags.id FROM tags WHERE (tags.tag LIKE "%asia%") OR (tags.tag LIKE "%thai%")
-      OR (tags.tag LIKE "%chinese%") OR (tags.tag LIKE "%korea%")
-      OR (tags.tag LIKE "%viet%") OR (tags.tag LIKE "%singapore%")
-      OR (tags.tag LIKE "%italy%") OR (tags.tag LIKE "%italian%")
-      OR (tags.tag LIKE "%european%") OR (tags.tag LIKE "%french%")
-      OR (tags.tag LIKE "%mexican%") OR (tags.tag LIKE "%mexic%")
-      OR (tags.tag LIKE "%france%") OR (tags.tag LIKE "%british%")
-      OR (tags.tag LIKE "%britain%") OR (tags.tag LIKE "%mediterranean%")
-      OR (tags.tag LIKE "%africa%") OR (tags.tag LIKE "%kenya%")
-      OR (tags.tag LIKE "%israel%") OR (tags.tag LIKE "%middle-e%")
-      OR (tags.tag LIKE "%india%") OR (tags.tag LIKE "%halal%")
-      OR (tags.tag LIKE "%arab%") OR (tags.tag LIKE "%egyptian%")
-      OR (tags.tag LIKE "%japan%") OR (tags.tag LIKE "%german%")
-      --OR (tags.tag LIKE "%american%")
-    )
-    SELECT doc_tags.doc_id
-    FROM doc_tags
-    INNER JOIN relevant_tags ON doc_tags.tag_id=relevant_tags.id
-  )
   SELECT 
+    corpus.id AS doc_id,
     corpus.document_name,
     models.description,
     models.tags,
@@ -146,48 +281,36 @@ _SELECT_ALL_CUISINE_TEXT_DATA = '''
     models.ingredients,
     models.third_party_id
   FROM corpus
-  INNER JOIN relevant_docs ON corpus.id=relevant_docs.doc_id
   INNER JOIN models ON corpus.id=models.doc_id
+  WHERE corpus.id IN (SELECT doc_cuisines.doc_id FROM doc_cuisines)
 '''
 
-_SELECT_ALL_CUISINE_TEXT_DATA_WITH_LIMIT = '''
-  WITH relevant_docs AS (
-    WITH relevant_tags AS (
-      SELECT tags.id FROM tags WHERE (tags.tag LIKE "%asia%") OR (tags.tag LIKE "%thai%")
-      OR (tags.tag LIKE "%chinese%")  OR (tags.tag LIKE "%korea%")
-      OR (tags.tag LIKE "%viet%") OR (tags.tag LIKE "%singapore%")
-      OR (tags.tag LIKE "%italy%") OR (tags.tag LIKE "%italian%")
-      OR (tags.tag LIKE "%european%") OR (tags.tag LIKE "%french%")
-      OR (tags.tag LIKE "%mexican%") OR (tags.tag LIKE "%mexic%")
-      OR (tags.tag LIKE "%france%") OR (tags.tag LIKE "%british%")
-      OR (tags.tag LIKE "%britain%") OR (tags.tag LIKE "%mediterranean%")
-      OR (tags.tag LIKE "%africa%") OR (tags.tag LIKE "%kenya%")
-      OR (tags.tag LIKE "%israel%") OR (tags.tag LIKE "%middle-e%")
-      OR (tags.tag LIKE "%india%") OR (tags.tag LIKE "%halal%")
-      OR (tags.tag LIKE "%arab%") OR (tags.tag LIKE "%egyptian%")
-      OR (tags.tag LIKE "%japan%") OR (tags.tag LIKE "%german%")
-      --OR (tags.tag LIKE "%american%")
-    )
-    SELECT doc_tags.doc_id
-    FROM doc_tags
-    INNER JOIN relevant_tags ON doc_tags.tag_id=relevant_tags.id
-  )
+# Documents of the cuisines of interest with after < corpus id <= last.
+# Corpus ids only grow, so these are the documents added in that range.
+_SELECT_CUISINE_TEXT_DATA_BY_ID_RANGE = _SELECT_ALL_CUISINE_TEXT_DATA + '''
+    AND corpus.id > ? AND corpus.id <= ?
+'''
+
+# Documents belonging to a single cuisine keyword.
+_SELECT_CUISINE_TEXT_DATA = '''
   SELECT 
+    corpus.id AS doc_id,
     corpus.document_name,
     models.description,
     models.tags,
     models.steps,
     models.ingredients,
     models.third_party_id
-  FROM corpus
-  INNER JOIN relevant_docs ON corpus.id=relevant_docs.doc_id
+  FROM doc_cuisines
+  INNER JOIN corpus ON corpus.id=doc_cuisines.doc_id
   INNER JOIN models ON corpus.id=models.doc_id
-  ORDER BY RANDOM()
-  LIMIT ?;
+  WHERE doc_cuisines.cuisine = ?
 '''
 
+# Full scan fallback of sampling.sample_docs(), sorts the whole table.
 _SELECT_RANDOM_TEXT_DATA = '''
   SELECT 
+    corpus.id AS doc_id,
     corpus.document_name,
     models.description,
     models.tags,
@@ -199,3 +322,323 @@ _SELECT_RANDOM_TEXT_DATA = '''
   ORDER BY RANDOM()
   LIMIT ?;
 '''
+
+# Formatted with one ? placeholder per id.
+_SELECT_TEXT_DATA_BY_IDS = '''
+  SELECT 
+    corpus.id AS doc_id,
+    corpus.document_name,
+    models.description,
+    models.tags,
+    models.steps,
+    models.ingredients,
+    models.third_party_id
+  FROM corpus
+  INNER JOIN models ON corpus.id=models.doc_id
+  WHERE corpus.id IN ({})
+'''
+
+# Keyset pagination, the page after corpus id `?` in id order. Only reads
+# the rows returned, whatever the page offset.
+_SELECT_TEXT_DATA_PAGE = '''
+  SELECT
+    corpus.id AS doc_id,
+    corpus.document_name,
+    models.description,
+    models.tags,
+    models.steps,
+    models.ingredients,
+    models.third_party_id
+  FROM corpus
+  INNER JOIN models ON corpus.id=models.doc_id
+  WHERE corpus.id > ?
+  ORDER BY corpus.id
+  LIMIT ?
+'''
+
+# Same as _SELECT_TEXT_DATA_PAGE restricted to one cuisine keyword, walks
+# the doc_cuisines_cuisine index.
+_SELECT_CUISINE_TEXT_DATA_PAGE = '''
+  SELECT
+    corpus.id AS doc_id,
+    corpus.document_name,
+    models.description,
+    models.tags,
+    models.steps,
+    models.ingredients,
+    models.third_party_id
+  FROM doc_cuisines
+  INNER JOIN corpus ON corpus.id=doc_cuisines.doc_id
+  INNER JOIN models ON corpus.id=models.doc_id
+  WHERE doc_cuisines.cuisine = ? AND doc_cuisines.doc_id > ?
+  ORDER BY doc_cuisines.doc_id
+  LIMIT ?
+'''
+
+_SELECT_CORPUS_ID_RANGE = '''
+  SELECT MIN(corpus.id), MAX(corpus.id) FROM corpus
+'''
+
+_SELECT_ALL_CUISINE_DOC_IDS = '''
+  SELECT DISTINCT doc_cuisines.doc_id
+  FROM doc_cuisines
+  ORDER BY doc_cuisines.doc_id
+'''
+
+_SELECT_CUISINE_DOC_IDS = '''
+  SELECT doc_cuisines.doc_id
+  FROM doc_cuisines
+  WHERE doc_cuisines.cuisine = ?
+  ORDER BY doc_cuisines.doc_id
+'''
+
+#################################################################
+# Document Topic Strings
+#################################################################
+
+_CREATE_TOPIC_TOP_DOCS = '''
+  CREATE TABLE IF NOT EXISTS topic_top_docs (
+    version TEXT NOT NULL,
+    topic INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    weight REAL NOT NULL,
+    PRIMARY KEY (version, topic, rank),
+    FOREIGN KEY (doc_id) REFERENCES corpus (id)
+  ) WITHOUT ROWID
+'''
+
+# Keeps the rows of the version being written and of the published one.
+_DELETE_TOPIC_TOP_DOCS_EXCEPT = '''
+  DELETE FROM topic_top_docs WHERE version NOT IN (?, ?)
+'''
+
+_DELETE_TOPIC_TOP_DOCS_BY_VERSION = '''
+  DELETE FROM topic_top_docs WHERE version = ?
+'''
+
+_INSERT_TOPIC_TOP_DOCS = '''
+  INSERT INTO topic_top_docs (version, topic, rank, doc_id, weight)
+  VALUES (?, ?, ?, ?, ?)
+'''
+
+_SELECT_TOPIC_TOP_DOCS = '''
+  SELECT
+    topic_top_docs.rank,
+    topic_top_docs.doc_id,
+    topic_top_docs.weight,
+    corpus.document_name,
+    models.description,
+    models.tags
+  FROM topic_top_docs
+  INNER JOIN corpus ON corpus.id=topic_top_docs.doc_id
+  INNER JOIN models ON corpus.id=models.doc_id
+  WHERE topic_top_docs.version = ? AND topic_top_docs.topic = ?
+  ORDER BY topic_top_docs.rank
+  LIMIT ?
+'''
+
+#################################################################
+# Corpus Statistics Strings
+#################################################################
+
+_CREATE_CORPUS_STATS = '''
+  CREATE TABLE IF NOT EXISTS corpus_stats (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    n_docs INTEGER NOT NULL,
+    total_length INTEGER NOT NULL,
+    PRIMARY KEY (kind, name)
+  ) WITHOUT ROWID
+'''
+
+_CREATE_CORPUS_LENGTH_HIST = '''
+  CREATE TABLE IF NOT EXISTS corpus_length_hist (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    n_docs INTEGER NOT NULL,
+    PRIMARY KEY (kind, name, bucket)
+  ) WITHOUT ROWID
+'''
+
+# Length of every document, as measured on modelling.concat_doc_text().
+# Built once per refresh so the aggregates below only join on doc_id.
+_CREATE_TEMP_DOC_LENGTHS = '''
+  CREATE TEMP TABLE IF NOT EXISTS doc_lengths (
+    doc_id INTEGER PRIMARY KEY,
+    length INTEGER NOT NULL,
+    bucket INTEGER NOT NULL
+  )
+'''
+
+_DELETE_TEMP_DOC_LENGTHS = '''
+  DELETE FROM doc_lengths
+'''
+
+# length_bucket() is registered by corpus_stats.refresh_corpus_stats().
+_INSERT_TEMP_DOC_LENGTHS = '''
+  INSERT INTO doc_lengths (doc_id, length, bucket)
+  SELECT lengths.doc_id, lengths.length, length_bucket(lengths.length)
+  FROM (
+    SELECT
+      corpus.id AS doc_id,
+      IFNULL(LENGTH(corpus.document_name), 0)
+      + IFNULL(LENGTH(models.description), 0)
+      + IFNULL(LENGTH(models.steps), 0)
+      + IFNULL(LENGTH(models.tags), 0) AS length
+    FROM corpus
+    INNER JOIN models ON corpus.id=models.doc_id
+    {where}
+  ) AS lengths
+'''
+
+_CREATE_TEMP_STATS_DOC_IDS = '''
+  CREATE TEMP TABLE IF NOT EXISTS stats_doc_ids (
+    doc_id INTEGER PRIMARY KEY
+  )
+'''
+
+_DELETE_TEMP_STATS_DOC_IDS = '''
+  DELETE FROM stats_doc_ids
+'''
+
+_INSERT_TEMP_STATS_DOC_IDS = '''
+  INSERT OR IGNORE INTO stats_doc_ids (doc_id) VALUES (?)
+'''
+
+_WHERE_STATS_DOC_IDS = '''
+    WHERE corpus.id IN (SELECT doc_id FROM stats_doc_ids)
+'''
+
+_DELETE_CORPUS_STATS_BY_KIND = '''
+  DELETE FROM corpus_stats WHERE kind = ?
+'''
+
+_DELETE_CORPUS_LENGTH_HIST_BY_KIND = '''
+  DELETE FROM corpus_length_hist WHERE kind = ?
+'''
+
+# Aggregates of the documents in doc_lengths. Params: (kind, ). Formatted
+# into _INSERT_CORPUS_STATS and _ADD_CORPUS_STATS, or the length_hist
+# ones.
+_INSERT_CORPUS_STATS = '''
+  INSERT INTO corpus_stats (kind, name, n_docs, total_length)
+  {select}
+'''
+
+_INSERT_CORPUS_LENGTH_HIST = '''
+  INSERT INTO corpus_length_hist (kind, name, bucket, n_docs)
+  {select}
+'''
+
+# Params: (sign, sign, kind). Adds sign times the aggregates to the stored
+# ones, see corpus_stats.update_corpus_stats().
+_ADD_CORPUS_STATS = '''
+  INSERT INTO corpus_stats (kind, name, n_docs, total_length)
+  SELECT aggregate.kind, aggregate.name, ? * aggregate.n_docs,
+    ? * aggregate.total_length
+  FROM ({select}) AS aggregate
+  WHERE true
+  ON CONFLICT (kind, name) DO UPDATE SET
+    n_docs = corpus_stats.n_docs + excluded.n_docs,
+    total_length = corpus_stats.total_length + excluded.total_length
+'''
+
+_ADD_CORPUS_LENGTH_HIST = '''
+  INSERT INTO corpus_length_hist (kind, name, bucket, n_docs)
+  SELECT aggregate.kind, aggregate.name, aggregate.bucket,
+    ? * aggregate.n_docs
+  FROM ({select}) AS aggregate
+  WHERE true
+  ON CONFLICT (kind, name, bucket) DO UPDATE SET
+    n_docs = corpus_length_hist.n_docs + excluded.n_docs
+'''
+
+# The corpus and cuisines totals are kept when empty, read_corpus_stats()
+# tells computed statistics from missing ones by them.
+_DELETE_EMPTY_CORPUS_STATS = '''
+  DELETE FROM corpus_stats WHERE n_docs = 0 AND name != ''
+'''
+
+_DELETE_EMPTY_CORPUS_LENGTH_HIST = '''
+  DELETE FROM corpus_length_hist WHERE n_docs = 0
+'''
+
+# Every document.
+_CORPUS_STATS_ALL = '''
+  SELECT ? AS kind, '' AS name, COUNT(*) AS n_docs,
+    IFNULL(SUM(doc_lengths.length), 0) AS total_length
+  FROM doc_lengths
+'''
+
+_CORPUS_LENGTH_HIST_ALL = '''
+  SELECT ? AS kind, '' AS name, doc_lengths.bucket, COUNT(*) AS n_docs
+  FROM doc_lengths
+  GROUP BY doc_lengths.bucket
+'''
+
+# Documents of any cuisine keyword.
+_CORPUS_STATS_CUISINES = '''
+  SELECT ? AS kind, '' AS name, COUNT(*) AS n_docs,
+    IFNULL(SUM(doc_lengths.length), 0) AS total_length
+  FROM doc_lengths
+  WHERE doc_lengths.doc_id IN (SELECT doc_cuisines.doc_id FROM doc_cuisines)
+'''
+
+_CORPUS_LENGTH_HIST_CUISINES = '''
+  SELECT ? AS kind, '' AS name, doc_lengths.bucket, COUNT(*) AS n_docs
+  FROM doc_lengths
+  WHERE doc_lengths.doc_id IN (SELECT doc_cuisines.doc_id FROM doc_cuisines)
+  GROUP BY doc_lengths.bucket
+'''
+
+# One row per cuisine keyword.
+_CORPUS_STATS_BY_CUISINE = '''
+  SELECT ? AS kind, doc_cuisines.cuisine AS name, COUNT(*) AS n_docs,
+    SUM(doc_lengths.length) AS total_length
+  FROM doc_cuisines
+  INNER JOIN doc_lengths ON doc_lengths.doc_id=doc_cuisines.doc_id
+  GROUP BY doc_cuisines.cuisine
+'''
+
+_CORPUS_LENGTH_HIST_BY_CUISINE = '''
+  SELECT ? AS kind, doc_cuisines.cuisine AS name, doc_lengths.bucket,
+    COUNT(*) AS n_docs
+  FROM doc_cuisines
+  INNER JOIN doc_lengths ON doc_lengths.doc_id=doc_cuisines.doc_id
+  GROUP BY doc_cuisines.cuisine, doc_lengths.bucket
+'''
+
+# One row per tag.
+_CORPUS_STATS_BY_TAG = '''
+  SELECT ? AS kind, doc_tags.tag AS name,
+    COUNT(DISTINCT doc_tags.doc_id) AS n_docs,
+    SUM(doc_lengths.length) AS total_length
+  FROM doc_tags
+  INNER JOIN doc_lengths ON doc_lengths.doc_id=doc_tags.doc_id
+  WHERE doc_tags.tag IS NOT NULL
+  GROUP BY doc_tags.tag
+'''
+
+_SELECT_CORPUS_STATS = '''
+  SELECT corpus_stats.n_docs, corpus_stats.total_length
+  FROM corpus_stats
+  WHERE corpus_stats.kind = ? AND corpus_stats.name = ?
+'''
+
+_SELECT_CORPUS_LENGTH_HIST = '''
+  SELECT corpus_length_hist.bucket, corpus_length_hist.n_docs
+  FROM corpus_length_hist
+  WHERE corpus_length_hist.kind = ? AND corpus_length_hist.name = ?
+  ORDER BY corpus_length_hist.bucket
+'''
+
+# Params: (kind, limit). The names of a kind with the most documents.
+_SELECT_CORPUS_STATS_TOP = '''
+  SELECT corpus_stats.name, corpus_stats.n_docs
+  FROM corpus_stats
+  WHERE corpus_stats.kind = ?
+  ORDER BY corpus_stats.n_docs DESC, corpus_stats.name
+  LIMIT ?
+'''
@@ -0,0 +1,402 @@
+import os
+import csv
+import json
+import time
+import resource
+import itertools
+import traceback
+import multiprocessing
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import bow_corpus
+from . import cuisines
+from . import db
+from . import modelling
+from .bow_corpus import MmapBowCorpus
+
+# Sweeps are written to instance_path/_SWEEPS_DIR/<sweep>. Each sweep
+# directory holds the shared corpus, the unfiltered dictionary, the
+# held-out split, and the results table.
+_SWEEPS_DIR = "sweeps"
+_CORPUS_NAME = "corpus.bow"
+_DICTIONARY_NAME = "dictionary.corpus"
+_SPLIT_NAME = "split.npz"
+_RESULTS_NAME = "results.csv"
+_SUMMARY_NAME = "sweep.json"
+# Fraction of the documents held out of training to measure perplexity.
+_HOLDOUT_FRACTION = 0.1
+# Topic coherence measure. u_mass only needs the bag-of-words corpus, the
+# sliding window measures (c_v, c_npmi) need the token lists of every doc.
+_COHERENCE = "u_mass"
+# Number of configurations trained at the same time. Each run trains in a
+# single process, see modelling.train_lda_model().
+_NUM_SWEEP_WORKERS = modelling._NUM_WORKDERS
+# Number of documents remapped at a time when iterating a sweep corpus.
+_READ_BATCH_SIZE = 1000
+# Hyperparameters of a configuration, in results table order.
+_PARAM_COLUMNS = ("num_topics", "passes", "prior_probability", "no_below",
+                  "no_above", "keep_n")
+_RESULT_COLUMNS = _PARAM_COLUMNS + (
+    "num_terms", "perplexity", "coherence", "train_seconds", "wall_seconds",
+    "peak_rss_mb", "meets_bar", "error")
+
+
+class SweepCorpus:
+    '''Re-iterable subset of a MmapBowCorpus under a filtered dictionary.
+
+    Yields the documents doc_ids of corpus, in that order, with every token
+    id mapped through remap. Tokens mapped to -1 are dropped. All workers of
+    a sweep read the same memory-mapped corpus, only remap differs.
+    '''
+
+    def __init__(self, corpus: MmapBowCorpus, doc_ids: np.ndarray,
+                 remap: np.ndarray):
+        self.corpus = corpus
+        self.doc_ids = doc_ids
+        self.remap = remap
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        indptr = self.corpus.indptr
+        for first in range(0, len(self.doc_ids), _READ_BATCH_SIZE):
+            for i in self.doc_ids[first:first + _READ_BATCH_SIZE].tolist():
+                start, end = int(indptr[i]), int(indptr[i + 1])
+                ids = self.remap[self.corpus.indices[start:end]]
+                keep = ids >= 0
+                yield list(
+                    zip(ids[keep].tolist(),
+                        self.corpus.counts[start:end][keep].tolist()))
+
+
+def sweeps_path(instance_path: str) -> str:
+    return os.path.join(instance_path, _SWEEPS_DIR)
+
+
+def build_grid(**values: Sequence) -> List[dict]:
+    '''Return one configuration dict per combination of values.
+
+    Keys are the _PARAM_COLUMNS, e.g. build_grid(num_topics=[10, 30], ...).
+    '''
+    return [
+        dict(zip(_PARAM_COLUMNS, x))
+        for x in itertools.product(*(values[x] for x in _PARAM_COLUMNS))
+    ]
+
+
+def prepare_sweep(docs, path: str, holdout: float = _HOLDOUT_FRACTION,
+                  seed: int = 0) -> Tuple[str, str, str]:
+    '''Tokenize docs once into the corpus shared by every run of a sweep.
+
+    Writes the unfiltered dictionary, the memory-mapped bag-of-words corpus,
+    and a seeded split of the document indices into train and held-out
+    docs under path. The held-out docs only contribute to the document
+    frequencies the filter thresholds are applied to.
+    Returns the (corpus, dictionary, split) paths.
+    '''
+    tokens = modelling.TokenStream(docs)
+    dictionary = modelling.build_streaming_dictionary(tokens, filtered=False)
+    dictionary_path = os.path.join(path, _DICTIONARY_NAME)
+    dictionary.save(dictionary_path)
+    corpus_path = os.path.join(path, _CORPUS_NAME)
+    bow_corpus.save_bow_corpus(
+        corpus_path, modelling.BowStream(tokens, dictionary))
+
+    n_docs = len(MmapBowCorpus(corpus_path))
+    order = np.random.default_rng(seed).permutation(n_docs)
+    n_test = min(n_docs - 1, max(1, int(round(n_docs * holdout))))
+    split_path = os.path.join(path, _SPLIT_NAME)
+    np.savez(split_path,
+             train=np.sort(order[n_test:]),
+             test=np.sort(order[:n_test]))
+    return corpus_path, dictionary_path, split_path
+
+
+def _peak_rss_mb() -> float:
+    '''Return the peak resident memory of this process, in MB.
+    '''
+    # ru_maxrss survives exec(), so a spawned process would report the peak
+    # of its parent. VmHWM is reset by exec().
+    try:
+        with open("/proc/self/status", 'r') as input:
+            for line in input:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_config(corpus_path: str, dictionary_path: str, split_path: str,
+               config: dict, keywords: Iterable[str]) -> dict:
+    '''Train and score a single configuration of a sweep.
+
+    Filters the shared dictionary with the config thresholds, trains on the
+    training docs, and scores the model with the perplexity of the held-out
+    docs and the coherence of its topics over the training docs.
+    Returns config updated with the scores, timings and peak memory.
+    '''
+    from gensim.corpora import Dictionary
+    from gensim.models.coherencemodel import CoherenceModel
+
+    start = time.perf_counter()
+    base = Dictionary.load(dictionary_path)
+    dictionary = modelling.filter_dictionary(Dictionary.load(dictionary_path),
+                                             config["no_below"],
+                                             config["no_above"],
+                                             config["keep_n"])
+    remap = np.full(len(base), -1, dtype=np.int64)
+    for token, i in dictionary.token2id.items():
+        remap[base.token2id[token]] = i
+    del base
+    corpus = MmapBowCorpus(corpus_path)
+    split = np.load(split_path)
+    train = SweepCorpus(corpus, split["train"], remap)
+    test = SweepCorpus(corpus, split["test"], remap)
+
+    eta = modelling.create_eta(dictionary, keywords,
+                               config["prior_probability"])
+    train_start = time.perf_counter()
+    model = modelling.train_lda_model(train,
+                                      dictionary,
+                                      eta,
+                                      passes=config["passes"],
+                                      num_topics=config["num_topics"],
+                                      workers=1)
+    train_seconds = time.perf_counter() - train_start
+    # log_perplexity() returns the per word likelihood bound.
+    bound = model.log_perplexity(list(test))
+    coherence = CoherenceModel(model=model,
+                               corpus=train,
+                               dictionary=dictionary,
+                               coherence=_COHERENCE,
+                               topn=modelling._NUM_TOPIC_WORDS).get_coherence()
+    return dict(config,
+                num_terms=len(dictionary),
+                perplexity=float(np.exp2(-bound)),
+                coherence=float(coherence),
+                train_seconds=train_seconds,
+                wall_seconds=time.perf_counter() - start,
+                peak_rss_mb=_peak_rss_mb(),
+                error=None)
+
+
+def _run_task(task) -> dict:
+    '''Process pool task. Never raises, failed runs report their error.
+    '''
+    config = task[3]
+    try:
+        return run_config(*task)
+    except Exception as e:
+        traceback.print_exc()
+        return dict(config, peak_rss_mb=_peak_rss_mb(), error=repr(e))
+
+
+def meets_bar(result: dict,
+              max_perplexity: Optional[float] = None,
+              min_coherence: Optional[float] = None) -> bool:
+    if result.get("error") is not None:
+        return False
+    if max_perplexity is not None and result["perplexity"] > max_perplexity:
+        return False
+    if min_coherence is not None and result["coherence"] < min_coherence:
+        return False
+    return True
+
+
+def run_sweep(corpus_path: str,
+              dictionary_path: str,
+              split_path: str,
+              grid: List[dict],
+              keywords: Iterable[str],
+              workers: int = _NUM_SWEEP_WORKERS,
+              on_result=None) -> List[dict]:
+    '''Train and score every configuration of grid, workers at a time.
+
+    Every run gets a fresh spawned process, so its peak memory is its own
+    and not that of an earlier run or of the parent. on_result is called
+    with each result as it completes. Results are returned in grid order.
+    '''
+    keywords = list(keywords)
+    tasks = [(corpus_path, dictionary_path, split_path, x, keywords)
+             for x in grid]
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with ctx.Pool(processes=max(1, min(workers, len(tasks))),
+                  maxtasksperchild=1) as pool:
+        for result in pool.imap(_run_task, tasks):
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    return results
+
+
+def write_results(path: str, results: List[dict]):
+    '''Write the results table as .csv, one row per configuration.
+    '''
+    with open(path, 'w', newline='') as out:
+        writer = csv.DictWriter(out,
+                                fieldnames=_RESULT_COLUMNS,
+                                extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def cheapest(results: List[dict]) -> Optional[dict]:
+    '''Return the result meeting the quality bar with the lowest wall time.
+    '''
+    passed = [x for x in results if x.get("meets_bar")]
+    return min(passed, key=lambda x: x["wall_seconds"]) if passed else None
+
+
+def _format_result(result: dict) -> str:
+    params = " ".join(f"{x}={result[x]}" for x in _PARAM_COLUMNS)
+    if result.get("error") is not None:
+        return f"{params} failed: {result['error']}"
+    return ("{} terms={} perplexity={:.1f} coherence={:.3f} train={:.1f}s "
+            "wall={:.1f}s rss={:.0f}MB".format(
+                params, result["num_terms"], result["perplexity"],
+                result["coherence"], result["train_seconds"],
+                result["wall_seconds"], result["peak_rss_mb"]))
+
+
+@click.command('sweep')
+@click.option('--num-topics',
+              multiple=True,
+              type=int,
+              default=[modelling._NUM_TOPICS],
+              show_default=True)
+@click.option('--passes',
+              multiple=True,
+              type=int,
+              default=[modelling._NUM_PASSES],
+              show_default=True)
+@click.option('--prior-probability',
+              multiple=True,
+              type=float,
+              default=[modelling._PRIOR_PROBABILITY],
+              show_default=True)
+@click.option('--no-below',
+              multiple=True,
+              type=int,
+              default=[modelling._FILTER_NO_BELOW],
+              show_default=True)
+@click.option('--no-above',
+              multiple=True,
+              type=float,
+              default=[modelling._FILTER_NO_ABOVE],
+              show_default=True)
+@click.option('--keep-n',
+              multiple=True,
+              type=int,
+              default=[modelling._FILTER_KEEP_N],
+              show_default=True)
+@click.option('--fraction',
+              default=modelling._DF_ROW_FRACTION,
+              show_default=True,
+              help='Fraction of the cuisine corpus used.')
+@click.option('--holdout',
+              default=_HOLDOUT_FRACTION,
+              show_default=True,
+              help='Fraction of the docs held out to measure perplexity.')
+@click.option('--workers',
+              default=_NUM_SWEEP_WORKERS,
+              show_default=True,
+              help='Configurations trained at the same time.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--max-perplexity',
+              type=float,
+              default=None,
+              help='Quality bar, max held-out perplexity.')
+@click.option('--min-coherence',
+              type=float,
+              default=None,
+              help='Quality bar, min topic coherence.')
+@with_appcontext
+def sweep_command(num_topics, passes, prior_probability, no_below, no_above,
+                  keep_n, fraction, holdout, workers, seed, max_perplexity,
+                  min_coherence):
+    """Train and score a grid of topic model configurations.
+
+    Every option given more than once adds values to the grid, e.g.
+    `flask sweep --num-topics 10 --num-topics 30 --passes 2 --passes 10`
+    trains 4 models. The cuisine corpus is tokenized once into a
+    memory-mapped corpus shared by every run. Each model is scored with the
+    perplexity of the held-out docs and the coherence of its topics. The
+    results table is written to instance/sweeps/<sweep>/results.csv, and
+    the configuration with the lowest wall time meeting --max-perplexity
+    and --min-coherence is reported.
+    """
+    if not 0.0 < fraction <= 1.0:
+        raise click.BadParameter("must be in (0, 1]", param_hint='fraction')
+    if not 0.0 < holdout < 1.0:
+        raise click.BadParameter("must be in (0, 1)", param_hint='holdout')
+    grid = build_grid(num_topics=num_topics,
+                      passes=passes,
+                      prior_probability=prior_probability,
+                      no_below=no_below,
+                      no_above=no_above,
+                      keep_n=keep_n)
+    path = os.path.join(sweeps_path(current_app.instance_path),
+                        time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(path)
+
+    click.echo(f'Tokenizing the corpus into {path}.')
+    start = time.perf_counter()
+    docs = db.DocTextStream(current_app.config['DATABASE'],
+                            fraction=fraction,
+                            seed=seed)
+    paths = prepare_sweep(docs, path, holdout, seed)
+    click.echo('Prepared {} docs in {:.1f}s, training {} configurations.'.
+               format(len(MmapBowCorpus(paths[0])),
+                      time.perf_counter() - start, len(grid)))
+
+    def on_result(result):
+        click.echo(_format_result(result))
+
+    results = run_sweep(*paths,
+                        grid,
+                        cuisines.get_prior_keywords(),
+                        workers=workers,
+                        on_result=on_result)
+    for result in results:
+        result["meets_bar"] = meets_bar(result, max_perplexity,
+                                        min_coherence)
+    write_results(os.path.join(path, _RESULTS_NAME), results)
+    with open(os.path.join(path, _SUMMARY_NAME), 'w') as out:
+        json.dump(
+            {
+                "fraction": fraction,
+                "holdout": holdout,
+                "seed": seed,
+                "coherence": _COHERENCE,
+                "max_perplexity": max_perplexity,
+                "min_coherence": min_coherence,
+                "seconds": time.perf_counter() - start,
+                "results": results,
+            },
+            out,
+            indent=1)
+    click.echo('Wrote the results table to {}.'.format(
+        os.path.join(path, _RESULTS_NAME)))
+    best = cheapest(results)
+    if best is None:
+        click.echo('No configuration meets the quality bar.')
+    else:
+        click.echo('Cheapest configuration meeting the bar: ' +
+                   _format_result(best))
+
+
+def init_app(app):
+    '''Called from flask_app.py.
+
+    Adds the command line flag `flask sweep` to the Flask app.
+    '''
+    app.cli.add_command(sweep_command)
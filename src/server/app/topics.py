@@ -1,89 +1,185 @@
-import functools
-import itertools
+import json
+import hashlib
+import threading
+from typing import Tuple
 
-from flask import (Blueprint, flash, g, redirect, render_template, request,
-                   session, url_for)
+from flask import (Blueprint, Response, flash, g, make_response, redirect,
+                   render_template, request, session, stream_with_context,
+                   url_for)
 from flask import current_app as app
 from flask.json import jsonify
+from . import corpus_stats
 from . import db
+from . import doc_topics
+from . import jobs
+from . import metrics
+from . import model_store
 from . import modelling
+from . import registry
+from . import sampling
 
 bp = Blueprint('topics', __name__, url_prefix='/')
 
+# Max number of random documents returned by background_fetch_corpus_data.
+_MAX_RANDOM_DOCS = 100
+# Default and max page size of /topic/corpus/docs.
+_DEFAULT_PAGE_SIZE = 100
+_MAX_PAGE_SIZE = 10000
+# Number of encoded documents written to the response at a time.
+_WRITE_BATCH_ROWS = 200
+# Number of cuisines and tags listed on the corpus page.
+_MAX_STATS_ROWS = 50
+# Document fields returned by background_fetch_corpus_data.
+_DOC_FIELDS = ("document_name", "description", "steps", "ingredients",
+               "tags")
 
-def read_text(limit=-1):
-  '''Retreive corpus doc text from SQL tables.
-
-  Limit controls the number of returned documents.
-  If limit == -1 all rows are returned.
-  '''
-  df = db.read_all_cuisine_doc_text_to_dataframe(limit)
-  return df
-
-
-def yield_first_n(iterable):
-    return [x for x in itertools.islice(iterable, 20)]
+# Rendered topic_main pages, keyed by (model version, script root). See
+# _render_topic_main().
+_topic_main_cache = {}
+_topic_main_cache_lock = threading.Lock()
 
 
 @bp.route('/topic/topic_main', methods=('GET', 'POST'))
 def topics_all():
     '''Render a page listing all topics found in the corpus.
 
-    Shows the top 30 topics in the corpus, and the 20 most 
-    highly weighted words for each topic. Topics are generated
-    by modelling.run_topic_model().
+    Shows the top 30 topics in the corpus, and the 20 most
+    highly weighted words for each topic.
+
+    The page is rendered from the topic summary precomputed when the model
+    was trained, see registry.LoadedModel. If no saved model exists a
+    background training job is started, see jobs.ensure_training_job().
+    The rendered page is cached per model version and served with an ETag
+    and Last-Modified, so clients can revalidate it with a 304.
     '''
     if request.method == 'POST':
         error = "Post not implemented for /topic_main"
         flash(error)
 
-    df = read_text()
-    df["all_text"] = (df["document_name"] + df["description"] + df["steps"] +
-                      df["tags"])
-    #df["ingredients"])
-    print("topic_main df {}".format(df))
-    topic_model = modelling.run_topic_model(df, app.instance_path)
-    print("Successfully ran topic model!")
-    print("topic_model {}".format(topic_model))
-    if g.dictionary:
-        print("Dictionary keys l:{} {}\n Dictionary values l:{} {}\n".format(
-            len(g.dictionary.keys()), yield_first_n(g.dictionary.keys()),
-            len(g.dictionary.values()), yield_first_n(g.dictionary.values())))
-        print("Dictionary token2id l:{} {}".format(
-            len(g.dictionary.token2id), yield_first_n(g.dictionary.token2id)))
-        print("Dictionary token2id keys {}".format(
-            yield_first_n(g.dictionary.token2id.keys())))
-
-    return render_template('topic/topic_main.html',
-                           df=df,
-                           topic_model=topic_model,
-                           topics=topic_model.print_topics(
-                               num_topics=modelling._NUM_TOPICS, num_words=20))
+    loaded = registry.get_registry().get()
+    if loaded is None:
+        # No model has been trained yet. Training takes minutes, run it in
+        # a background job and let the page poll for completion.
+        job = jobs.ensure_training_job(app.config['DATABASE'],
+                                       app.instance_path,
+                                       modelling._DF_ROW_FRACTION)
+        return render_template('topic/topic_main.html',
+                               num_topics=0,
+                               topics=[],
+                               job=job)
+    if request.method != 'GET' or session.get('_flashes'):
+        # Flashed messages are rendered into the page, do not cache it.
+        return render_template('topic/topic_main.html',
+                               num_topics=loaded.model.num_topics,
+                               topics=loaded.topics,
+                               job=None)
+
+    html, etag = _render_topic_main(loaded)
+    response = make_response(html)
+    response.set_etag(etag)
+    response.last_modified = loaded.modified
+    # Caches may store the page but must revalidate it, a new model can be
+    # published at any time.
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _render_topic_main(loaded: registry.LoadedModel) -> Tuple[str, str]:
+    '''Return the (html, etag) of the topic_main page of a loaded model.
+
+    The page only changes with the model, so it is rendered once per model
+    version and served from _topic_main_cache afterwards. Entries of older
+    versions are dropped when a new version is rendered.
+    '''
+    key = (loaded.artifact_version, request.script_root)
+    with _topic_main_cache_lock:
+        cached = _topic_main_cache.get(key)
+    metrics.cache_lookup("topic_main_page", cached is not None)
+    if cached is not None:
+        return cached
+    html = render_template('topic/topic_main.html',
+                           num_topics=loaded.model.num_topics,
+                           topics=loaded.topics,
+                           job=None)
+    cached = html, hashlib.sha1(html.encode("utf-8")).hexdigest()
+    with _topic_main_cache_lock:
+        for old_key in [x for x in _topic_main_cache if x[0] != key[0]]:
+            del _topic_main_cache[old_key]
+        _topic_main_cache[key] = cached
+    return cached
+
+
+@bp.route('/topic/<int:topic_id>/docs', methods=('GET', ))
+def topic_top_docs(topic_id):
+    '''Return the recipes with the highest weight for a topic as JSON.
+
+    The optional `n` query argument limits the number of recipes, at most
+    doc_topics._TOP_DOCS_PER_TOPIC. Reads the ranking precomputed for the
+    served model, see doc_topics.compute_doc_topics().
+    '''
+    n = request.args.get("n", default=10, type=int)
+    if n is None or not 0 < n <= doc_topics._TOP_DOCS_PER_TOPIC:
+        return jsonify({
+            "error":
+            f"n must be in [1, {doc_topics._TOP_DOCS_PER_TOPIC}]"
+        }), 400
+    loaded = registry.get_registry().get()
+    if loaded is None:
+        return jsonify({"error": "no topic model has been trained"}), 503
+    if not 0 <= topic_id < loaded.model.num_topics:
+        return jsonify({"error": f"unknown topic {topic_id}"}), 404
+    docs = doc_topics.read_top_docs(db.get_db(), loaded.version, topic_id, n)
+    if not docs:
+        return jsonify({
+            "error":
+            f"document topics have not been computed for {loaded.version}"
+        }), 404
+    return jsonify({
+        "version": loaded.version,
+        "topic": topic_id,
+        "docs": docs
+    })
+
+
+def _vocab_size():
+    '''Return the vocabulary size of the published model, after
+    filter_extremes(), without loading the model.
+
+    Returns None if no model was trained or it predates the recorded size.
+    '''
+    path = model_store.current_model_path(app.instance_path)
+    vocab_size = model_store.read_version_meta(path).get("num_terms")
+    reg = registry.get_registry()
+    if vocab_size is None and reg.is_ready():
+        vocab_size = len(reg.get().dictionary)
+    return vocab_size
 
 
 @bp.route('/topic/corpus', methods=('GET', 'POST'))
 def corpus_main():
     '''Render a page displaying a sample of 20 random documents from
     the corpus.
+
+    The optional `cuisine` query argument restricts the statistics to one
+    cuisine keyword. Statistics are read from the tables maintained at
+    ingest, see corpus_stats.refresh_corpus_stats().
     '''
     if request.method == 'POST':
         error = "Post not implemented for /corpus"
         flash(error)
 
-    df = read_text(limit=1000)
-    df["all_text"] = (df["document_name"] + df["description"] + df["steps"] +
-                      df["tags"])
-    # df["ingredients"])
-    # topic_model = modelling.run_topic_model(df, app.instance_path)
-    # print("Successfully ran topic model!")
-    # print("topic_model {}".format(topic_model))
-    data = {
-        "n_docs": df.shape[0],
-        "avg_doc_length": "{:.2f}".format(df["all_text"].str.len().mean()),
-        # "num_topics": topic_model.get_topics().shape[0],
-    }
-
-    print("returning from corpus")
+    conn = db.get_db()
+    data = corpus_stats.read_corpus_stats(conn, request.args.get("cuisine"))
+    if data is None:
+        flash("Corpus statistics are missing, run `flask refresh-stats`.")
+        data = {"n_docs": 0, "avg_doc_length": 0.0}
+    else:
+        data["cuisines"] = corpus_stats.read_top_counts(
+            conn, corpus_stats._CUISINE, _MAX_STATS_ROWS)
+        data["tags"] = corpus_stats.read_top_counts(conn, corpus_stats._TAG,
+                                                    _MAX_STATS_ROWS)
+    data["avg_doc_length"] = "{:.2f}".format(data["avg_doc_length"])
+    data["vocab_size"] = _vocab_size()
     return render_template('topic/corpus.html', data=data)
 
 
@@ -93,12 +189,68 @@ def background_fetch_corpus_data():
 
     The `/topic/corpus` page is re-rendered with the new documents.
     The documents are returned as a serialized JSON payload.
+    The optional `n_docs` query argument sets the number of documents, at
+    most _MAX_RANDOM_DOCS.
+    '''
+    n_docs = request.args.get("n_docs", default=20, type=int)
+    if n_docs is None or not 0 < n_docs <= _MAX_RANDOM_DOCS:
+        return jsonify({"error":
+                        f"n_docs must be in [1, {_MAX_RANDOM_DOCS}]"}), 400
+    rows = sampling.sample_docs(db.get_db(), n_docs)
+    return jsonify([{x: row[x] for x in _DOC_FIELDS} for row in rows])
+
+
+@bp.route('/topic/corpus/docs', methods=('GET', ))
+def corpus_docs():
+    '''Stream one page of corpus documents, in doc_id order.
+
+    Query arguments:
+        `after` only return documents with a greater doc_id, default 0.
+        `limit` the page size, at most _MAX_PAGE_SIZE.
+        `cuisine` only return documents of this cuisine keyword.
+        `format` `json` (default) or `ndjson`.
+    The JSON object holds the `docs` and `next_after`, the `after` value of
+    the next page or null on the last page. NDJSON returns one document per
+    line, pass the doc_id of the last line as `after` to continue.
+    Rows are encoded straight from the sqlite cursor as they are sent, so
+    any page size is served in constant memory.
     '''
-    n_docs = request.args.get("n_docs", default=20)
-    print(f"requesting {n_docs} docs")
-    df = db.read_random_doc_text_to_dataframe(nrows=n_docs)
-    text_df = df[[
-        "document_name", "description", "steps", "ingredients", "tags"
-    ]]
-    print("background_fetch_corpus_data text df {}".format(text_df))
-    return jsonify(text_df.to_dict('records'))
+    after = request.args.get("after", default=0, type=int)
+    limit = request.args.get("limit", default=_DEFAULT_PAGE_SIZE, type=int)
+    fmt = request.args.get("format", default="json")
+    if after is None or after < 0:
+        return jsonify({"error": "after must be a doc_id >= 0"}), 400
+    if limit is None or not 0 < limit <= _MAX_PAGE_SIZE:
+        return jsonify({"error":
+                        f"limit must be in [1, {_MAX_PAGE_SIZE}]"}), 400
+    if fmt not in ("json", "ndjson"):
+        return jsonify({"error": "format must be json or ndjson"}), 400
+    rows = db.iter_doc_page(after, limit, request.args.get("cuisine"))
+
+    def generate_ndjson():
+        lines = []
+        for row in rows:
+            lines.append(json.dumps(dict(row)) + "\n")
+            if len(lines) == _WRITE_BATCH_ROWS:
+                yield "".join(lines)
+                lines.clear()
+        yield "".join(lines)
+
+    def generate_json():
+        yield '{"docs": ['
+        last, count, lines = None, 0, []
+        for row in rows:
+            lines.append(("," if count else "") + json.dumps(dict(row)))
+            last, count = row["doc_id"], count + 1
+            if len(lines) == _WRITE_BATCH_ROWS:
+                yield "".join(lines)
+                lines.clear()
+        yield "".join(lines)
+        yield '], "next_after": {}}}'.format(
+            json.dumps(last if count == limit else None))
+
+    if fmt == "ndjson":
+        return Response(stream_with_context(generate_ndjson()),
+                        mimetype="application/x-ndjson")
+    return Response(stream_with_context(generate_json()),
+                    mimetype="application/json")
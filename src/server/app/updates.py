@@ -0,0 +1,255 @@
+import time
+from typing import Callable, Optional
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import with_appcontext
+
+from . import cuisines
+from . import db
+from . import doc_topics
+from . import jobs
+from . import model_store
+from . import modelling
+from . import sql_strings
+
+# Largest fraction of the documents a model learned from that may have
+# changed or been deleted since, before `flask update-model` retrains from
+# scratch instead of updating it. Online updates can not unlearn them.
+_MAX_STALE_FRACTION = 0.1
+
+
+def _base_last_doc_id(base_path: str, meta: dict) -> int:
+    '''Return the largest corpus id the model in base_path has seen.
+
+    Versions trained before it was recorded fall back to their document
+    topics, which cover every document they were trained on.
+    '''
+    if meta.get("last_doc_id") is not None:
+        return meta["last_doc_id"]
+    try:
+        ids, _ = doc_topics.load_doc_topics(base_path)
+    except IOError:
+        raise IOError(f"The model in {base_path} does not record the "
+                      "documents it was trained on, retrain it first")
+    return int(ids.max()) if len(ids) else 0
+
+
+def read_model_drift(database: str, base_path: str) -> dict:
+    '''Return how far the corpus has moved from the model in base_path.
+
+    A changed recipe is stored under a new corpus id, see
+    db.upsert_raw_recipes(), so updating the model learns it again while
+    its old version stays in the topics, and deleted recipes stay in them
+    too. "stale_docs" counts those documents, the ones of the version's
+    document topics no longer in the cuisine corpus plus those of the
+    versions it was updated from. "num_docs" is the size of the cuisine
+    corpus, "stale_fraction" their ratio.
+    '''
+    meta = model_store.read_version_meta(base_path)
+    try:
+        ids, _ = doc_topics.load_doc_topics(base_path)
+    except IOError:
+        raise IOError(f"The model in {base_path} does not record the "
+                      "documents it was trained on, retrain it first")
+    current = db.read_cuisine_doc_ids(database)
+    stale_docs = (meta.get("stale_docs") or 0) + int(
+        np.count_nonzero(~np.isin(ids, current)))
+    return {
+        "stale_docs": stale_docs,
+        "num_docs": len(current),
+        "stale_fraction": stale_docs / max(len(current), 1),
+    }
+
+
+def update_published_model(
+        database: str,
+        instance_path: str,
+        passes: Optional[int] = None,
+        on_stage: Optional[Callable[[str], None]] = None) -> Optional[dict]:
+    '''Update the published model with the documents added since it was
+    trained, and publish the result as a new version.
+
+    The added documents are the cuisine documents with a corpus id above
+    the last_doc_id of the published version, e.g. new or changed recipes
+    ingested with db.upsert_raw_recipes(). The model is updated online,
+    see modelling.update_lda_model_streaming(), and the topics of the other
+    documents are carried over, see doc_topics.compute_doc_topics(). The
+    keywords, prior and vocabulary bounds of the published version are
+    kept. Returns the "version", the number of "update_docs" added and the
+    read_model_drift() of the new version, or None if no documents were
+    added.
+    '''
+    base_path = model_store.current_model_path(instance_path)
+    meta = model_store.read_version_meta(base_path)
+    after = _base_last_doc_id(base_path, meta)
+    last_doc_id = db.read_last_doc_id(database)
+    docs = db.DocTextStream(
+        database,
+        sql=sql_strings._SELECT_CUISINE_TEXT_DATA_BY_ID_RANGE,
+        params=(after, last_doc_id))
+    n_docs = len(docs)
+    if n_docs == 0:
+        return None
+
+    start = time.perf_counter()
+    drift = read_model_drift(database, base_path)
+    keywords = meta.get("keywords", cuisines.get_prior_keywords())
+    prior_probability = meta.get("prior_probability",
+                                 modelling._PRIOR_PROBABILITY)
+    vocabulary = meta.get("vocabulary", modelling.get_vocabulary())
+    version, path = model_store.create_version_path(instance_path)
+    model = modelling.update_lda_model_streaming(
+        docs,
+        base_path,
+        path,
+        on_stage=on_stage,
+        keywords=keywords,
+        prior_probability=prior_probability,
+        vocabulary=vocabulary,
+        passes=passes)
+    if on_stage is not None:
+        on_stage("saving")
+    modelling.save_model_artifacts(path, model)
+    if on_stage is not None:
+        on_stage("doc_topics")
+    num_docs = doc_topics.compute_doc_topics(database,
+                                             instance_path,
+                                             path,
+                                             docs=docs,
+                                             reuse_path=base_path)
+    model_store.write_version_meta(
+        path, {
+            "created": time.time(),
+            "base_version": model_store.version_name(instance_path,
+                                                     base_path),
+            "train_seconds": time.perf_counter() - start,
+            "num_topics": model.num_topics,
+            "num_docs": num_docs,
+            "update_docs": n_docs,
+            "stale_docs": drift["stale_docs"],
+            "last_doc_id": last_doc_id,
+            "num_terms": len(model.id2word),
+            "perplexity": None,
+            "keywords": keywords,
+            "prior_probability": prior_probability,
+            "vocabulary": vocabulary,
+        })
+    model_store.publish_version(instance_path, version)
+    drift.update(num_docs=num_docs,
+                 stale_fraction=drift["stale_docs"] / max(num_docs, 1))
+    return dict(drift, version=version, update_docs=n_docs)
+
+
+def _retrain(database: str, instance_path: str):
+    status = jobs.submit_training_job(database, instance_path)
+    if status is None:
+        click.echo('A training job is already running.')
+        return
+    click.echo('Started training job {}.'.format(status["job_id"]))
+    stage = None
+    while status["state"] in jobs._ACTIVE_STATES:
+        time.sleep(1.0)
+        status = jobs.read_job_status(instance_path, status["job_id"])
+        if status["stage"] != stage:
+            stage = status["stage"]
+            click.echo(f'Training: {stage}.')
+    if status["state"] == "done":
+        click.echo('Published version {}.'.format(status["version"]))
+    else:
+        click.echo('Training failed: {}'.format(status["error"]))
+
+
+@click.command('update-model')
+@click.option('--csv',
+              'csv_path',
+              type=click.Path(exists=True, dir_okay=False),
+              default=None,
+              help='RAW_recipes.csv formatted file of new or changed '
+              'recipes to ingest first.')
+@click.option('--chunk-rows',
+              default=db._INGEST_CHUNK_ROWS,
+              show_default=True,
+              help='Number of .csv rows read and inserted at a time.')
+@click.option('--passes',
+              default=modelling._NUM_UPDATE_PASSES,
+              show_default=True,
+              help='Online passes over the added documents.')
+@click.option('--max-stale',
+              default=_MAX_STALE_FRACTION,
+              show_default=True,
+              help='Retrain from scratch once this fraction of the docs '
+              'the model learned from changed or were deleted.')
+@with_appcontext
+def update_model_command(csv_path, chunk_rows, passes, max_stale):
+    """Update the published model with new and changed recipes.
+
+    With --csv the recipes of the file are ingested first, keyed by their
+    id: new recipes are inserted, changed ones replaced, unchanged ones
+    skipped. The published model is then updated with the documents added
+    since it was trained, instead of retraining it from scratch, and the
+    result is published as a new version.
+
+    Updates can not unlearn changed or deleted recipes. Once more than
+    --max-stale of the documents the model learned from are such, a
+    training job retrains it from scratch instead, as when no model with
+    document topics is published yet.
+
+    This function can be run from the command line via
+    `flask update-model`.
+    """
+    from . import csv_ingest
+
+    database = current_app.config['DATABASE']
+    instance_path = current_app.instance_path
+    if csv_path is not None:
+        start = time.perf_counter()
+        with db.write_db() as conn:
+            counts = db.upsert_raw_recipes(
+                conn, csv_ingest.IterRawData(csv_path, chunksize=chunk_rows))
+            if counts["updated"]:
+                doc_topics.rerank_top_docs(conn, instance_path)
+        click.echo('Inserted {} and updated {} docs in {:.1f}s.'.format(
+            counts["inserted"], counts["updated"],
+            time.perf_counter() - start))
+
+    try:
+        drift = read_model_drift(
+            database, model_store.current_model_path(instance_path))
+    except IOError as e:
+        click.echo(f'{e}, training from scratch.')
+        _retrain(database, instance_path)
+        return
+    if drift["stale_fraction"] > max_stale:
+        click.echo('{stale_docs} of {num_docs} docs changed or were deleted '
+                   'since the model learned them, retraining from '
+                   'scratch.'.format(**drift))
+        _retrain(database, instance_path)
+        return
+
+    start = time.perf_counter()
+    result = update_published_model(
+        database,
+        instance_path,
+        passes=passes,
+        on_stage=lambda stage: click.echo(f'Updating the model: {stage}.'))
+    if result is None:
+        click.echo('No documents were added since the model was trained.')
+        return
+    click.echo('Updated the model with {} docs in {:.1f}s, published '
+               'version {}.'.format(result["update_docs"],
+                                    time.perf_counter() - start,
+                                    result["version"]))
+    click.echo('The model still weighs {stale_docs} changed or deleted docs '
+               'of {num_docs} ({stale_fraction:.1%}), it is retrained from '
+               'scratch above {max_stale:.1%}.'.format(max_stale=max_stale,
+                                                       **result))
+
+
+def init_app(app):
+    '''Called from flask_app.py.
+
+    Adds the command line flag `flask update-model` to the Flask app.
+    '''
+    app.cli.add_command(update_model_command)
@@ -0,0 +1,5 @@
+'''Performance benchmarks for the topic modeling server.
+
+Each module can be run from the `src/server` directory, e.g.
+`python -m bench.preprocess`.
+'''
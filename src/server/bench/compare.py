@@ -0,0 +1,54 @@
+'''Compare two result files written by bench.suite.
+
+Prints the median of every (size, stage) measured in both runs and the
+relative change. Exits with status 1 if any stage got slower by more than
+--threshold, so it can gate a CI job.
+
+Usage (from src/server):
+    python -m bench.compare base.json new.json --threshold 0.1
+'''
+import argparse
+import json
+import sys
+
+
+def load_medians(path: str) -> dict:
+    '''Return {(size, stage): median seconds} of a result file.
+    '''
+    with open(path, 'r') as input:
+        results = json.load(input)["results"]
+    return {(x["size"], x["stage"]): x["median"] for x in results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold',
+                        type=float,
+                        default=0.1,
+                        help='Relative slowdown reported as a regression.')
+    args = parser.parse_args()
+
+    base = load_medians(args.base)
+    new = load_medians(args.new)
+    regressions = 0
+    for key in sorted(base.keys() & new.keys()):
+        size, stage = key
+        change = new[key] / base[key] - 1.0 if base[key] > 0 else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = " REGRESSION"
+            regressions += 1
+        print(f"{size:>8} {stage:<56} {base[key] * 1e3:10.2f}ms -> "
+              f"{new[key] * 1e3:10.2f}ms {change:+8.1%}{flag}")
+    for key in sorted(base.keys() ^ new.keys()):
+        print("{:>8} {:<56} only in {}".format(
+            key[0], key[1], args.base if key in base else args.new))
+    if regressions:
+        print(f"{regressions} stages slower by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
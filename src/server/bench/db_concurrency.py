@@ -0,0 +1,168 @@
+'''Benchmark DB read throughput by reader thread count, during an ingest.
+
+Builds a synthetic DB (see bench.synthetic) with --docs documents. For
+every --threads count, reader threads run the queries of the corpus
+endpoints in a loop for --seconds: a random sample of 20 docs, a page of
+100 docs, and the corpus statistics. Readers get their connection like a
+request:
+    connect  opens a new connection per request and closes it after, as
+             db.get_db() did before the connection pool.
+    pool     borrows a read-only connection from connections.ConnectionPool.
+With --ingest, a separate process keeps ingesting batches of new documents
+into the same DB, each in one write transaction, like `flask init-db`.
+Prints the requests per second and the p99 request latency of each run.
+
+Usage (from src/server):
+    python -m bench.db_concurrency --docs 20000 --threads 1 2 4 8 --ingest
+'''
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from app import connections
+from app import corpus_stats
+from app import db
+from app import sampling
+from app import sql_strings
+from bench import synthetic
+
+_MODES = ("connect", "pool")
+_DEFAULT_THREADS = [1, 2, 4, 8]
+_SAMPLE_DOCS = 20
+_PAGE_DOCS = 100
+# Documents inserted per ingest transaction by the --ingest process.
+_INGEST_BATCH_DOCS = 2000
+
+
+def _connect_legacy(database: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(database, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _request(conn: sqlite3.Connection, rng: random.Random, max_id: int):
+    sampling.sample_docs(conn, _SAMPLE_DOCS, rng)
+    conn.execute(sql_strings._SELECT_TEXT_DATA_PAGE,
+                 (rng.randrange(max_id), _PAGE_DOCS)).fetchall()
+    corpus_stats.read_corpus_stats(conn)
+
+
+def _reader(mode: str, database: str, pool, max_id: int, stop, latencies,
+            seed: int):
+    rng = random.Random(seed)
+    samples = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        conn = pool.acquire() if mode == "pool" else _connect_legacy(database)
+        try:
+            _request(conn, rng, max_id)
+        finally:
+            if mode == "pool":
+                pool.release(conn)
+            else:
+                conn.close()
+        samples.append(time.perf_counter() - start)
+    latencies.extend(samples)
+
+
+def _ingest_loop(database: str, seed: int, stop):
+    '''--ingest process. Ingests new batches of documents until stop.
+    '''
+    conn = connections.connect(database)
+    round = 0
+    while not stop.is_set():
+        round += 1
+        df = synthetic.generate_raw_recipes(_INGEST_BATCH_DOCS, seed + round)
+        # Keep names and ids unique across rounds.
+        df["name"] = df["name"] + f" r{round}"
+        df["id"] = df["id"] + round * 10**7
+        db.ingest_raw_recipes(conn, [df])
+        conn.commit()
+    conn.close()
+
+
+def run(mode: str, database: str, n_threads: int, seconds: float,
+        max_id: int) -> dict:
+    pool = connections.ConnectionPool(database) if mode == "pool" else None
+    stop = threading.Event()
+    latencies = []
+    threads = [
+        threading.Thread(target=_reader,
+                         args=(mode, database, pool, max_id, stop, latencies,
+                               i)) for i in range(n_threads)
+    ]
+    for x in threads:
+        x.start()
+    time.sleep(seconds)
+    stop.set()
+    for x in threads:
+        x.join()
+    if pool is not None:
+        pool.close()
+    return {
+        "mode": mode,
+        "threads": n_threads,
+        "requests_per_second": len(latencies) / seconds,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--threads',
+                        type=int,
+                        nargs='+',
+                        default=_DEFAULT_THREADS)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--ingest',
+                        action='store_true',
+                        help='Ingest documents while the readers run.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as root:
+        database = os.path.join(root, "app.sqlite")
+        conn = connections.connect(database)
+        with open(os.path.join(os.path.dirname(db.__file__), "schema.sql"),
+                  'r') as f:
+            conn.executescript(f.read())
+        db.ingest_raw_recipes(
+            conn, [synthetic.generate_raw_recipes(args.docs, args.seed)])
+        conn.commit()
+        conn.close()
+
+        ctx = multiprocessing.get_context("spawn")
+        stop = ctx.Event()
+        ingest = None
+        if args.ingest:
+            ingest = ctx.Process(target=_ingest_loop,
+                                 args=(database, args.seed, stop))
+            ingest.start()
+            # Let the ingest process start writing.
+            time.sleep(2.0)
+        try:
+            print(f"{'mode':<8}{'threads':>8}{'req/s':>10}{'p99 ms':>10}")
+            for mode in _MODES:
+                for n_threads in args.threads:
+                    result = run(mode, database, n_threads, args.seconds,
+                                 args.docs)
+                    print("{:<8}{:>8}{:>10.1f}{:>10.2f}".format(
+                        mode, n_threads, result["requests_per_second"],
+                        result["p99_ms"]))
+        finally:
+            stop.set()
+            if ingest is not None:
+                ingest.join()
+
+
+if __name__ == '__main__':
+    main()
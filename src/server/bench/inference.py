@@ -0,0 +1,90 @@
+'''Benchmark the latency of POST /topic/infer.
+
+Serves the saved model of the app instance through the Flask test client and
+reports p50/p99 request latency for:
+    single     one text per request, one request at a time.
+    batched    --batch texts per request, one request at a time.
+    concurrent one text per request from --threads threads at once, the
+               requests are micro-batched by inference.InferenceBatcher.
+Texts are random documents from the SQL database.
+
+Usage (from src/server):
+    python -m bench.inference --requests 200 --batch 32 --threads 8
+'''
+import argparse
+import threading
+import time
+
+import numpy as np
+
+from app import db
+from app import registry
+from app.flask_app import create_app
+
+
+def time_requests(client, payloads):
+    '''POST every payload to /topic/infer, return the latencies in seconds.
+    '''
+    latencies = []
+    for payload in payloads:
+        start = time.perf_counter()
+        response = client.post('/topic/infer', json=payload)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise AssertionError(f"/topic/infer returned {response.status}")
+    return latencies
+
+
+def report(name, latencies, docs_per_request, elapsed):
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+    throughput = len(latencies) * docs_per_request / elapsed
+    print(f"{name:<10} p50 {p50:7.2f}ms p99 {p99:7.2f}ms "
+          f"{throughput:8.1f} docs/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=32)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if registry.get_registry().get() is None:
+            raise SystemExit("No saved model, train one first.")
+        df = db.read_random_doc_text_to_dataframe(nrows=args.requests)
+    texts = (df["document_name"] + df["description"] + df["steps"] +
+             df["tags"]).tolist()
+    client = app.test_client()
+    # Warm up the word cache and the batcher thread.
+    time_requests(client, [{"texts": texts}])
+
+    start = time.perf_counter()
+    latencies = time_requests(client, [{"text": x} for x in texts])
+    report("single", latencies, 1, time.perf_counter() - start)
+
+    payloads = [{
+        "texts": [texts[(i + j) % len(texts)] for j in range(args.batch)]
+    } for i in range(args.requests // args.batch + 1)]
+    start = time.perf_counter()
+    latencies = time_requests(client, payloads)
+    report("batched", latencies, args.batch, time.perf_counter() - start)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda part: results.extend(
+            time_requests(app.test_client(), [{"text": x} for x in part])),
+                         args=(texts[i::args.threads], ))
+        for i in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report("concurrent", results, 1, time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+'''Benchmark serial vs. multi-process document preprocessing.
+
+Reads the full cuisine corpus from the SQL database, then times
+modelling.preprocess_documents() once in a single process and once for each
+requested worker count. The parallel output is checked against the serial
+output token for token.
+
+Usage (from src/server):
+    python -m bench.preprocess --workers 2 3 6 --chunksize 1000
+'''
+import argparse
+import time
+
+from app import db
+from app import modelling
+from app.flask_app import create_app
+
+
+def time_preprocess(docs, workers, chunksize):
+    '''Return (seconds, tokens) for one preprocess_documents() run.
+    '''
+    start = time.perf_counter()
+    tokens = modelling.preprocess_documents(docs,
+                                            workers=workers,
+                                            chunksize=chunksize)
+    return time.perf_counter() - start, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers',
+                        type=int,
+                        nargs='+',
+                        default=[modelling._NUM_PREPROCESS_WORKERS])
+    parser.add_argument('--chunksize',
+                        type=int,
+                        default=modelling._PREPROCESS_CHUNKSIZE)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        df = db.read_all_cuisine_doc_text_to_dataframe()
+    docs = modelling.concat_doc_text(df).tolist()
+    print(f"Preprocessing {len(docs)} documents")
+
+    serial_time, serial_tokens = time_preprocess(docs, 1, args.chunksize)
+    print(f"workers=1 (serial) {serial_time:.2f}s")
+    for workers in args.workers:
+        elapsed, tokens = time_preprocess(docs, workers, args.chunksize)
+        if tokens != serial_tokens:
+            raise AssertionError(
+                f"workers={workers} output differs from the serial path")
+        print(f"workers={workers} {elapsed:.2f}s "
+              f"speedup x{serial_time / elapsed:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+'''Benchmark the cold start time of the Flask app.
+
+Every sample runs in a fresh interpreter, as a gunicorn worker or a `flask`
+CLI command would. Times importing app.flask_app, calling create_app(), and
+running `flask routes`. Also lists the heavy dependencies that were imported
+during startup, none should be until a request or command needs them.
+
+Usage (from src/server):
+    python -m bench.startup --repeat 5
+    python -m bench.startup --eager-load  # include loading the saved model
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that should only be imported on the code paths that need them.
+_HEAVY_MODULES = ("pandas", "gensim", "nltk", "scipy", "transformers",
+                  "torch", "tensorflow")
+
+_CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+from app.flask_app import create_app
+imported = time.perf_counter()
+create_app({config!r})
+created = time.perf_counter()
+print(json.dumps({{
+    "import": imported - start,
+    "create_app": created - imported,
+    "heavy": [x for x in {heavy!r} if x in sys.modules],
+}}))
+'''
+
+
+def time_create_app(eager_load: bool) -> dict:
+    '''Return the timings of one import + create_app() in a new interpreter.
+    '''
+    code = _CHILD.format(config={'MODEL_EAGER_LOAD': eager_load},
+                         heavy=_HEAVY_MODULES)
+    out = subprocess.run([sys.executable, "-c", code],
+                         check=True,
+                         capture_output=True,
+                         text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def time_cli() -> float:
+    '''Return the wall time of `flask routes` in a new interpreter.
+    '''
+    env = dict(os.environ, FLASK_APP="app/flask_app.py")
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m", "flask", "routes"],
+                   check=True,
+                   capture_output=True,
+                   env=env)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--eager-load',
+                        action='store_true',
+                        help='Load the saved model in create_app().')
+    args = parser.parse_args()
+
+    samples = [time_create_app(args.eager_load) for _ in range(args.repeat)]
+    cli = [time_cli() for _ in range(args.repeat)]
+    for key in ("import", "create_app"):
+        values = [x[key] for x in samples]
+        print(f"{key} median {statistics.median(values):.3f}s "
+              f"min {min(values):.3f}s")
+    print(f"flask routes median {statistics.median(cli):.3f}s "
+          f"min {min(cli):.3f}s")
+    heavy = sorted(set(x for s in samples for x in s["heavy"]))
+    print("heavy modules imported: {}".format(", ".join(heavy) or "none"))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''Benchmark the whole pipeline on synthetic corpora of several sizes.
+
+For every --sizes corpus size a synthetic RAW_recipes.csv is generated (see
+bench.synthetic) into a temporary instance folder, and each stage below is
+timed --repeat times:
+    csv_read             csv_ingest.IterRawData() over the whole file.
+    insert_data_into_db  db.ingest_raw_recipes() into freshly created tables.
+    query_cuisine_all    db.read_all_cuisine_doc_text_to_dataframe().
+    query_cuisine_one    the same, for a single cuisine keyword.
+    query_random         db.read_random_doc_text_to_dataframe().
+    query_page           one page of db.iter_doc_page().
+    build_gensim_corpus  modelling.build_gensim_corpus() of the cuisine corpus.
+    create_eta           modelling.create_eta() with an empty cache.
+    train                modelling.train_lda_model() for --passes passes.
+    save                 modelling.save_model_artifacts().
+    model_load           a forced registry.ModelRegistry.reload().
+    doc_topics           doc_topics.compute_doc_topics().
+Then every endpoint is requested --requests times through the Flask test
+client, stage names are `<METHOD> <url>`.
+
+Results are written as JSON to --output, one record per (size, stage) with
+the raw samples and their median, p99 and min in seconds, plus the commit
+and environment they were measured on. Compare two runs with
+bench.compare.
+
+Usage (from src/server):
+    python -m bench.suite --sizes 1000 10000 --repeat 3 --output base.json
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+from app import csv_ingest
+from app import db
+from app import doc_topics
+from app import modelling
+from app import registry
+from app.flask_app import create_app
+from bench import synthetic
+
+# Corpus sizes, in documents, benchmarked by default.
+_DEFAULT_SIZES = [1000, 5000, 20000]
+# Rows read from the .csv at a time, same as `flask init-db`.
+_CSV_CHUNK_ROWS = db._INGEST_CHUNK_ROWS
+# Cuisine keyword used by the single cuisine query.
+_QUERY_CUISINE = "italian"
+_QUERY_RANDOM_DOCS = 20
+_QUERY_PAGE_DOCS = 1000
+# Number of texts sent per /topic/infer request.
+_INFER_TEXTS = 8
+
+
+def _endpoints(texts):
+    '''Return the (method, url, json body) of every benchmarked request.
+    '''
+    return [
+        ("GET", "/ready", None),
+        ("GET", "/topic/topic_main", None),
+        ("GET", "/topic/corpus", None),
+        ("GET", "/topic/background_fetch_corpus_data?n_docs=20", None),
+        ("GET", f"/topic/corpus/docs?limit={_QUERY_PAGE_DOCS}", None),
+        ("GET", "/topic/0/docs?n=20", None),
+        ("POST", "/topic/infer", {
+            "texts": texts[:_INFER_TEXTS]
+        }),
+        ("GET", "/topic/jobs", None),
+        ("GET", "/topic/models", None),
+    ]
+
+
+def git_commit() -> dict:
+    '''Return the commit of the working tree, and whether it has changes.
+    '''
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"],
+                                cwd=root,
+                                check=True,
+                                capture_output=True,
+                                text=True).stdout.strip()
+        dirty = bool(
+            subprocess.run(["git", "status", "--porcelain", "--", ".."],
+                           cwd=root,
+                           check=True,
+                           capture_output=True,
+                           text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": dirty}
+
+
+def environment() -> dict:
+    import gensim
+    import pandas
+
+    return dict(git_commit(),
+                python=platform.python_version(),
+                platform=platform.platform(),
+                cpus=os.cpu_count(),
+                numpy=np.__version__,
+                pandas=pandas.__version__,
+                gensim=gensim.__version__)
+
+
+class Recorder:
+    '''Collects the timing samples of each (size, stage).
+    '''
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = []
+
+    def add(self, size: int, stage: str, samples):
+        samples = [float(x) for x in samples]
+        record = {
+            "size": size,
+            "stage": stage,
+            "n": len(samples),
+            "median": float(np.median(samples)),
+            "p99": float(np.percentile(samples, 99)),
+            "min": min(samples),
+            "samples": samples,
+        }
+        self.results.append(record)
+        print(f"{size:>8} {stage:<56} median {record['median'] * 1e3:10.2f}ms "
+              f"min {record['min'] * 1e3:10.2f}ms")
+
+    def time(self, size: int, stage: str, fn, setup=None, repeat=None):
+        '''Time fn() repeat times, calling setup() untimed before each run.
+
+        Returns the result of the last run.
+        '''
+        samples = []
+        value = None
+        for _ in range(self.repeat if repeat is None else repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            value = fn()
+            samples.append(time.perf_counter() - start)
+        self.add(size, stage, samples)
+        return value
+
+
+def read_csv(path: str) -> list:
+    return list(csv_ingest.IterRawData(path, chunksize=_CSV_CHUNK_ROWS))
+
+
+def bench_size(recorder: Recorder, size: int, args):
+    '''Run every stage on a fresh synthetic corpus of size documents.
+    '''
+    with tempfile.TemporaryDirectory(prefix="bench-") as instance_path:
+        csv_path = synthetic.write_raw_recipes_csv(
+            os.path.join(instance_path, "RAW_recipes.csv"), size, args.seed)
+        app = create_app({'MODEL_EAGER_LOAD': False}, instance_path)
+        database = app.config['DATABASE']
+
+        chunks = recorder.time(size, "csv_read", lambda: read_csv(csv_path))
+        with app.app_context():
+
+            def ingest():
+                with db.write_db() as conn:
+                    db.ingest_raw_recipes(conn, chunks)
+
+            recorder.time(size,
+                          "insert_data_into_db",
+                          ingest,
+                          setup=db.init_db)
+
+            df = recorder.time(size, "query_cuisine_all",
+                               db.read_all_cuisine_doc_text_to_dataframe)
+            recorder.time(
+                size, "query_cuisine_one",
+                lambda: db.read_all_cuisine_doc_text_to_dataframe(
+                    cuisine=_QUERY_CUISINE))
+            recorder.time(
+                size, "query_random", lambda: db.
+                read_random_doc_text_to_dataframe(_QUERY_RANDOM_DOCS))
+            recorder.time(
+                size, "query_page",
+                lambda: list(db.iter_doc_page(0, _QUERY_PAGE_DOCS)))
+
+            df["all_text"] = modelling.concat_doc_text(df)
+            corpus, dictionary = recorder.time(
+                size, "build_gensim_corpus",
+                lambda: modelling.build_gensim_corpus(df))
+            eta = recorder.time(
+                size,
+                "create_eta",
+                lambda: modelling.create_eta(dictionary),
+                setup=modelling._eta_cache.clear)
+            model = recorder.time(
+                size,
+                "train",
+                lambda: modelling.train_lda_model(
+                    corpus, dictionary, eta, passes=args.passes),
+                repeat=args.train_repeat)
+            modelling.try_save_dictionary(instance_path, dictionary)
+            modelling.try_save_corpus(instance_path, corpus)
+            recorder.time(
+                size, "save",
+                lambda: modelling.save_model_artifacts(instance_path, model))
+            recorder.time(
+                size, "model_load",
+                lambda: registry.get_registry().reload(force=True))
+            recorder.time(
+                size,
+                "doc_topics",
+                lambda: doc_topics.compute_doc_topics(
+                    database, instance_path, instance_path),
+                repeat=args.train_repeat)
+
+        client = app.test_client()
+        for method, url, body in _endpoints(df["all_text"].tolist()):
+
+            def request():
+                response = client.open(url, method=method, json=body)
+                # Consume streamed bodies as well.
+                response.get_data()
+                if response.status_code != 200:
+                    raise AssertionError(
+                        f"{method} {url} returned {response.status}")
+
+            request()  # Warm up caches, as a running server would have.
+            recorder.time(size,
+                          f"{method} {url}",
+                          request,
+                          repeat=args.requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=_DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--train-repeat',
+                        type=int,
+                        default=1,
+                        help='Runs of the train and doc_topics stages.')
+    parser.add_argument('--requests',
+                        type=int,
+                        default=50,
+                        help='Requests per endpoint.')
+    parser.add_argument('--passes', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output',
+                        default=None,
+                        help='Defaults to bench-<commit>.json.')
+    args = parser.parse_args()
+
+    env = environment()
+    recorder = Recorder(args.repeat)
+    for size in args.sizes:
+        bench_size(recorder, size, args)
+    output = args.output or "bench-{}.json".format(
+        (env["commit"] or "unknown")[:10])
+    with open(output, 'w') as out:
+        json.dump(
+            {
+                "created": time.time(),
+                "args": vars(args),
+                "environment": env,
+                "results": recorder.results,
+            },
+            out,
+            indent=1)
+    print(f"Wrote {len(recorder.results)} results to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+'''Deterministic synthetic recipe corpus shaped like food.com RAW_recipes.
+
+Generates rows with the columns, value formats and rough size distribution
+of data/archive/RAW_recipes.csv, so the benchmarks run without downloading
+the dataset. Words are drawn from a fixed vocabulary with Zipf frequencies,
+tags include the cuisine keywords of app.cuisines, and a few rows lack a
+description or repeat a name so the cleaning code paths are exercised.
+The same (n_docs, seed) always produces the same rows.
+
+Usage (from src/server):
+    python -m bench.synthetic --docs 10000 --output /tmp/RAW_recipes.csv
+'''
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from app import cuisines
+
+# Column order of RAW_recipes.csv.
+_COLUMNS = [
+    "name", "id", "minutes", "contributor_id", "submitted", "tags",
+    "nutrition", "n_steps", "steps", "description", "ingredients",
+    "n_ingredients"
+]
+_INGREDIENTS = [
+    "salt", "butter", "sugar", "onion", "water", "eggs", "olive oil",
+    "flour", "milk", "garlic cloves", "pepper", "brown sugar", "garlic",
+    "all-purpose flour", "baking powder", "egg", "salt and pepper",
+    "parmesan cheese", "lemon juice", "baking soda", "vegetable oil",
+    "vanilla", "black pepper", "cinnamon", "tomatoes", "sour cream",
+    "garlic powder", "vanilla extract", "oil", "honey", "onions",
+    "cream cheese", "garlic clove", "celery", "unsalted butter", "cilantro",
+    "soy sauce", "fish sauce", "coconut milk", "lime juice", "ginger",
+    "basil", "oregano", "cumin", "chili powder", "rice", "pasta",
+    "chicken breasts", "ground beef", "shrimp", "tofu", "mozzarella cheese",
+    "cheddar cheese", "heavy cream", "chicken broth", "carrots", "potatoes",
+    "green onions", "red bell pepper", "mushrooms", "spinach", "zucchini",
+    "avocado", "black beans", "corn tortillas", "curry powder", "turmeric",
+    "paprika", "sesame oil", "rice vinegar", "miso paste", "lemongrass"
+]
+_GENERIC_TAGS = [
+    "60-minutes-or-less", "time-to-make", "course", "main-ingredient",
+    "preparation", "occasion", "main-dish", "easy", "dietary", "vegetables",
+    "meat", "low-in-something", "desserts", "30-minutes-or-less",
+    "4-hours-or-less", "healthy", "low-sodium", "poultry", "chicken",
+    "low-carb", "side-dishes", "beginner-cook", "inexpensive", "dinner-party",
+    "taste-mood", "one-dish-meal", "vegetarian", "low-fat", "breakfast",
+    "15-minutes-or-less", "lunch", "appetizers", "comfort-food", "holiday"
+]
+_DISHES = [
+    "soup", "stew", "salad", "curry", "casserole", "pie", "cake", "bread",
+    "stir fry", "noodles", "tacos", "pasta", "risotto", "dumplings",
+    "cookies", "muffins", "roast", "skewers", "bowl", "sandwich"
+]
+_ADJECTIVES = [
+    "easy", "spicy", "creamy", "quick", "grandma's", "healthy", "crispy",
+    "slow cooker", "baked", "grilled", "sweet", "savory", "best ever",
+    "simple", "homemade", "tangy", "smoky", "zesty", "hearty", "light"
+]
+_VERBS = [
+    "preheat", "combine", "stir", "add", "mix", "bake", "cook", "pour",
+    "place", "heat", "serve", "whisk", "simmer", "chop", "slice", "season",
+    "drain", "fold", "knead", "grill", "toss", "cover", "remove", "boil"
+]
+# Syllables of the generated filler words. Real recipe text has a long tail
+# of rare words, which drives the dictionary and topic-word matrix size.
+_SYLLABLES = [
+    "ba", "ca", "da", "fe", "gi", "ho", "ju", "ka", "lo", "mi", "ne", "po",
+    "qui", "ra", "si", "to", "ve", "wa", "xi", "yo", "zu", "an", "el", "or"
+]
+_NUM_FILLER_WORDS = 20000
+# Zipf exponent of the word frequencies.
+_ZIPF_EXPONENT = 1.1
+# Fraction of rows without a description, and of rows reusing the name of
+# an earlier row. Both are dropped by db.clean_raw_recipes().
+_MISSING_DESCRIPTION_FRACTION = 0.02
+_DUPLICATE_NAME_FRACTION = 0.01
+
+
+def _vocabulary():
+    '''Return the filler vocabulary, most frequent word first.
+    '''
+    words = [
+        x for x in _INGREDIENTS + _VERBS + _DISHES if " " not in x
+    ] + [
+        "".join(x)
+        for x in itertools.islice(itertools.product(_SYLLABLES, repeat=3),
+                                  _NUM_FILLER_WORDS)
+    ]
+    return np.array(list(dict.fromkeys(words)), dtype=object)
+
+
+def _zipf_probabilities(n: int) -> np.ndarray:
+    weights = 1.0 / np.arange(1, n + 1)**_ZIPF_EXPONENT
+    return weights / weights.sum()
+
+
+def _list_repr(items) -> str:
+    '''Format a list the way RAW_recipes.csv stores list columns.
+    '''
+    return "[" + ", ".join("'{}'".format(x) for x in items) + "]"
+
+
+def _weighted_orders(rng, n_rows: int, p: np.ndarray) -> np.ndarray:
+    '''Return one weighted random permutation of range(len(p)) per row.
+
+    The first k items of a row are a weighted sample without replacement
+    (Gumbel top-k), drawn for every row at once.
+    '''
+    keys = np.log(p) + rng.gumbel(size=(n_rows, len(p)))
+    return np.argsort(-keys, axis=1)
+
+
+def generate_raw_recipes(n_docs: int, seed: int = 0) -> pd.DataFrame:
+    '''Return n_docs synthetic RAW_recipes rows.
+
+    The output only depends on n_docs and seed.
+    '''
+    rng = np.random.default_rng(seed)
+    vocab = _vocabulary()
+    cuisine_tags = np.array(list(dict.fromkeys(cuisines._CUISINE_KEYWORDS)) +
+                            [
+                                "asian", "north-american", "american",
+                                "southwestern-united-states"
+                            ],
+                            dtype=object)
+    ingredients = np.array(_INGREDIENTS, dtype=object)
+    generic_tags = np.array(_GENERIC_TAGS, dtype=object)
+
+    n_steps = rng.integers(2, 18, n_docs)
+    n_ingredients = rng.integers(3, 16, n_docs)
+    n_tags = rng.integers(6, 25, n_docs)
+    n_cuisine_tags = rng.choice([0, 1, 2], n_docs, p=[0.5, 0.35, 0.15])
+    description_words = rng.integers(8, 60, n_docs)
+    step_words = rng.integers(4, 16, int(n_steps.sum()))
+    # Draw every word at once, then hand out consecutive slices.
+    words = vocab[rng.choice(len(vocab),
+                             int(description_words.sum() + step_words.sum()),
+                             p=_zipf_probabilities(len(vocab)))]
+    verbs = rng.choice(np.array(_VERBS, dtype=object), int(n_steps.sum()))
+    # Index into the recipe's own ingredients of the one used by each step.
+    step_ingredient = rng.random(int(n_steps.sum()))
+    ingredient_orders = _weighted_orders(
+        rng, n_docs, _zipf_probabilities(len(_INGREDIENTS)))
+    tag_orders = _weighted_orders(rng, n_docs,
+                                  _zipf_probabilities(len(_GENERIC_TAGS)))
+    cuisine_orders = _weighted_orders(
+        rng, n_docs, np.full(len(cuisine_tags), 1.0 / len(cuisine_tags)))
+    adjectives = rng.choice(np.array(_ADJECTIVES, dtype=object), n_docs)
+    dishes = rng.choice(np.array(_DISHES, dtype=object), n_docs)
+    minutes = rng.integers(5, 240, n_docs)
+    contributors = rng.integers(1, 30000, n_docs)
+    dates = np.stack([
+        rng.integers(0, 19, n_docs),
+        rng.integers(1, 13, n_docs),
+        rng.integers(1, 29, n_docs)
+    ],
+                     axis=1)
+    nutrition = np.round(rng.random((n_docs, 7)) * 100, 1)
+    missing_description = rng.random(n_docs) < _MISSING_DESCRIPTION_FRACTION
+    duplicate_name = rng.random(n_docs) < _DUPLICATE_NAME_FRACTION
+    duplicate_of = (rng.random(n_docs) * np.arange(n_docs)).astype(np.int64)
+
+    names = []
+    columns = {x: [] for x in _COLUMNS}
+    word_pos = 0
+    step_pos = 0
+    for i in range(n_docs):
+        doc_ingredients = ingredients[ingredient_orders[i, :n_ingredients[i]]]
+        tags = list(generic_tags[tag_orders[i, :n_tags[i]]]) + list(
+            cuisine_tags[cuisine_orders[i, :n_cuisine_tags[i]]])
+        steps = []
+        for _ in range(n_steps[i]):
+            n_words = step_words[step_pos]
+            used = doc_ingredients[int(step_ingredient[step_pos] *
+                                       len(doc_ingredients))]
+            steps.append("{} the {} {}".format(
+                verbs[step_pos], used,
+                " ".join(words[word_pos:word_pos + n_words])))
+            word_pos += n_words
+            step_pos += 1
+        description = " ".join(words[word_pos:word_pos +
+                                     description_words[i]])
+        word_pos += description_words[i]
+        if duplicate_name[i] and i > 0:
+            names.append(names[duplicate_of[i]])
+        else:
+            names.append("{} {} {} {}".format(adjectives[i],
+                                              doc_ingredients[0], dishes[i],
+                                              i))
+        columns["tags"].append(_list_repr(tags))
+        columns["nutrition"].append(str(nutrition[i].tolist()))
+        columns["steps"].append(_list_repr(steps))
+        columns["description"].append(
+            None if missing_description[i] else description)
+        columns["ingredients"].append(_list_repr(doc_ingredients))
+    columns.update({
+        "name": names,
+        "id": np.arange(10000, 10000 + n_docs),
+        "minutes": minutes,
+        "contributor_id": contributors,
+        "submitted": ["20{:02d}-{:02d}-{:02d}".format(*x) for x in dates],
+        "n_steps": n_steps,
+        "n_ingredients": n_ingredients,
+    })
+    return pd.DataFrame(columns, columns=_COLUMNS)
+
+
+def write_raw_recipes_csv(path: str, n_docs: int, seed: int = 0) -> str:
+    '''Write n_docs synthetic rows to path as a RAW_recipes.csv file.
+    '''
+    generate_raw_recipes(n_docs, seed).to_csv(path, index=False)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--docs', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='RAW_recipes.csv')
+    args = parser.parse_args()
+    write_raw_recipes_csv(args.output, args.docs, args.seed)
+    print(f"Wrote {args.docs} recipes to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+'''Measure the effect of the vocabulary bounds on training and model size.
+
+Tokenizes a synthetic corpus (see bench.synthetic) once, then for every
+vocabulary setting builds the dictionary with modelling.build_dictionary(),
+trains a model, and saves it with modelling.try_save_model():
+    unbounded  no_below=0, no keep_n cap, as dictionaries were built before
+               the bounds were added.
+    default    the modelling module defaults.
+    keep_n=N   the defaults with keep_n N, for every --keep-n.
+    hash=N     a HashingDictionary of N buckets, for every --hash-buckets.
+Prints per setting the number of terms, the dictionary build and training
+seconds, and the size of the saved model and dictionary in MB.
+
+Usage (from src/server):
+    python -m bench.vocabulary --docs 20000 --keep-n 5000 --hash-buckets 8192
+'''
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from app import cuisines
+from app import modelling
+from bench import synthetic
+
+# Number of documents per batch handed to build_dictionary().
+_BATCH_DOCS = 1000
+
+
+def _dir_size_mb(path: str) -> float:
+    return sum(
+        os.path.getsize(os.path.join(path, x))
+        for x in os.listdir(path)) / float(1 << 20)
+
+
+def settings(keep_n, hash_buckets) -> list:
+    '''Return the (name, vocabulary) pairs to measure.
+    '''
+    result = [
+        ("unbounded", {
+            "no_below": 0,
+            "keep_n": modelling._MAX_VOCABULARY_SIZE
+        }),
+        ("default", {}),
+    ]
+    result += [(f"keep_n={x}", {"keep_n": x}) for x in keep_n]
+    result += [(f"hash={x}", {"hash_buckets": x}) for x in hash_buckets]
+    return result
+
+
+def measure(docs, vocabulary: dict, num_topics: int, passes: int,
+            workers: int) -> dict:
+    batches = [
+        docs[i:i + _BATCH_DOCS] for i in range(0, len(docs), _BATCH_DOCS)
+    ]
+    start = time.perf_counter()
+    dictionary = modelling.build_dictionary(batches, vocabulary)
+    corpus = [dictionary.doc2bow(x) for x in docs]
+    dictionary_seconds = time.perf_counter() - start
+    eta = modelling.create_eta(dictionary, cuisines.get_prior_keywords())
+    start = time.perf_counter()
+    model = modelling.train_lda_model(corpus,
+                                      dictionary,
+                                      eta,
+                                      passes=passes,
+                                      num_topics=num_topics,
+                                      workers=workers)
+    train_seconds = time.perf_counter() - start
+    with tempfile.TemporaryDirectory(prefix="bench-") as path:
+        modelling.try_save_model(path, model)
+        model_mb = _dir_size_mb(path)
+    with tempfile.TemporaryDirectory(prefix="bench-") as path:
+        modelling.try_save_dictionary(path, dictionary)
+        dictionary_mb = _dir_size_mb(path)
+    return {
+        "num_terms": len(dictionary),
+        "dictionary_seconds": dictionary_seconds,
+        "train_seconds": train_seconds,
+        "model_mb": model_mb,
+        "dictionary_mb": dictionary_mb,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--num-topics',
+                        type=int,
+                        default=modelling._NUM_TOPICS)
+    parser.add_argument('--passes', type=int, default=1)
+    parser.add_argument('--workers',
+                        type=int,
+                        default=1,
+                        help='Training processes, 1 trains with LdaModel.')
+    parser.add_argument('--keep-n', type=int, nargs='*', default=[])
+    parser.add_argument('--hash-buckets', type=int, nargs='*', default=[])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Optional JSON file.')
+    args = parser.parse_args()
+
+    df = synthetic.generate_raw_recipes(args.docs, args.seed)
+    texts = (df["name"] + df["description"].fillna("") + df["steps"] +
+             df["tags"]).tolist()
+    docs = modelling.preprocess_documents(texts)
+
+    results = []
+    print(f"{'vocabulary':<14}{'terms':>9}{'dict s':>9}{'train s':>9}"
+          f"{'model MB':>10}{'dict MB':>9}")
+    for name, vocabulary in settings(args.keep_n, args.hash_buckets):
+        record = measure(docs, vocabulary, args.num_topics, args.passes,
+                         args.workers)
+        record.update(vocabulary=name)
+        results.append(record)
+        print("{:<14}{:>9}{:>9.1f}{:>9.1f}{:>10.1f}{:>9.2f}".format(
+            name, record["num_terms"], record["dictionary_seconds"],
+            record["train_seconds"], record["model_mb"],
+            record["dictionary_mb"]))
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump({"args": vars(args), "results": results}, out, indent=1)
+
+
+if __name__ == '__main__':
+    main()
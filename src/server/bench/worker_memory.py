@@ -0,0 +1,178 @@
+'''Measure the memory of server worker processes serving the same model.
+
+Trains a model on a synthetic corpus (see bench.synthetic) and saves it in
+two layouts:
+    copy  gensim defaults, as models were saved before: id2word is pickled
+          next to the model and every array is read into each process.
+    mmap  modelling.try_save_model(), loaded by the registry: id2word is
+          the dictionary and the topic-word arrays are memory-mapped
+          read-only, so workers share their physical pages.
+For each --workers count, that many processes are started the way WSGI
+workers are without --preload. Each loads the dictionary and the model,
+infers sample texts to touch the model pages, and reports its memory while
+every worker is still alive:
+    rss      resident memory. Shared pages count in full in every worker.
+    pss      proportional set size. Shared pages are split between the
+             processes mapping them, the sum over workers is their total.
+    private  pages mapped by this worker only (USS).
+    model    pss growth from loading and using the model.
+Values are the mean per worker in MB. Linux only, reads
+/proc/self/smaps_rollup.
+
+Usage (from src/server):
+    python -m bench.worker_memory --docs 20000 --workers 1 4 8
+'''
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app import cuisines
+from app import modelling
+from bench import synthetic
+
+_MODES = ("copy", "mmap")
+_DEFAULT_WORKERS = [1, 4, 8]
+# Number of synthetic texts inferred by each worker.
+_INFER_TEXTS = 200
+
+
+def memory_mb() -> dict:
+    '''Return the rss, pss and private memory of this process in MB.
+    '''
+    fields = {}
+    with open("/proc/self/smaps_rollup", 'r') as input:
+        for line in input:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024.0
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def _load(mode: str, path: str):
+    from gensim.models.ldamulticore import LdaMulticore
+
+    dictionary = modelling.try_get_saved_dictionary(path)
+    if mode == "copy":
+        model = LdaMulticore.load(os.path.join(path, modelling._MODEL_NAME))
+    else:
+        model = modelling.try_get_saved_model(path, dictionary)
+    return model, dictionary
+
+
+def _worker(mode: str, path: str, texts, results, done):
+    '''Worker process. Reports its memory, then waits for done.
+    '''
+    from app import inference
+
+    # Import everything a loaded worker has imported before measuring.
+    import gensim.models.ldamulticore  # noqa: F401
+    modelling.preprocess_document("warm up")
+    before = memory_mb()
+    model, dictionary = _load(mode, path)
+    encoder = inference.BowEncoder(dictionary)
+    model.inference([encoder.doc2bow(x) for x in texts])
+    model.print_topics(num_topics=model.num_topics)
+    after = memory_mb()
+    results.put(dict(after, model=after["pss"] - before["pss"]))
+    done.wait()
+
+
+def measure(mode: str, path: str, n_workers: int, texts) -> dict:
+    '''Return the mean memory per worker of n_workers live workers.
+    '''
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    done = ctx.Event()
+    workers = [
+        ctx.Process(target=_worker, args=(mode, path, texts, results, done))
+        for _ in range(n_workers)
+    ]
+    for x in workers:
+        x.start()
+    samples = [results.get() for _ in workers]
+    done.set()
+    for x in workers:
+        x.join()
+    return {
+        key: float(np.mean([x[key] for x in samples]))
+        for key in samples[0]
+    }
+
+
+def train_model(texts, num_topics: int, passes: int):
+    '''Train a model with the production pipeline on texts.
+    '''
+    from gensim.corpora import Dictionary
+
+    docs = modelling.preprocess_documents(texts)
+    dictionary = modelling.filter_dictionary(Dictionary(docs))
+    corpus = [dictionary.doc2bow(x) for x in docs]
+    eta = modelling.create_eta(dictionary, cuisines.get_prior_keywords())
+    model = modelling.train_lda_model(corpus,
+                                      dictionary,
+                                      eta,
+                                      passes=passes,
+                                      num_topics=num_topics)
+    return model, dictionary
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--num-topics',
+                        type=int,
+                        default=modelling._NUM_TOPICS)
+    parser.add_argument('--passes', type=int, default=1)
+    parser.add_argument('--workers',
+                        type=int,
+                        nargs='+',
+                        default=_DEFAULT_WORKERS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='Optional JSON file.')
+    args = parser.parse_args()
+
+    df = synthetic.generate_raw_recipes(args.docs, args.seed)
+    texts = (df["name"] + df["description"].fillna("") + df["steps"] +
+             df["tags"]).tolist()
+    start = time.perf_counter()
+    model, dictionary = train_model(texts, args.num_topics, args.passes)
+    print(f"Trained {model.num_topics} topics x {len(dictionary)} terms "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-") as root:
+        paths = {x: os.path.join(root, x) for x in _MODES}
+        for path in paths.values():
+            os.makedirs(path)
+            modelling.try_save_dictionary(path, dictionary)
+        model.save(os.path.join(paths["copy"], modelling._MODEL_NAME))
+        modelling.try_save_model(paths["mmap"], model)
+
+        print(f"{'mode':<6}{'workers':>8}{'rss':>10}{'pss':>10}"
+              f"{'private':>10}{'model':>10}")
+        for mode in _MODES:
+            for n_workers in args.workers:
+                record = measure(mode, paths[mode], n_workers,
+                                 texts[:_INFER_TEXTS])
+                record.update(mode=mode, workers=n_workers)
+                results.append(record)
+                print("{:<6}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                    mode, n_workers, record["rss"], record["pss"],
+                    record["private"], record["model"]))
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump({"args": vars(args), "results": results}, out, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import random
+
+import pandas as pd
+import pytest
+
+from app import db
+from app.flask_app import create_app
+
+_TAGS = ["thai", "italian", "mexican", "french", "japanese", "easy", "dinner"]
+_WORDS = ("chicken rice pasta tomato basil garlic onion pepper curry noodle "
+          "beef pork sugar flour butter egg milk cheese lime").split()
+
+
+def _raw_recipes(n, seed=0, first_id=1000):
+    '''Return n RAW_recipes rows with random words and tags.
+    '''
+    rng = random.Random(seed)
+    rows = []
+    for i in range(first_id, first_id + n):
+        rows.append(
+            dict(name=f"recipe {i} " + " ".join(rng.sample(_WORDS, 2)),
+                 id=i,
+                 minutes=10,
+                 contributor_id=rng.randint(1, 50),
+                 submitted="2010-01-01",
+                 tags=str(rng.sample(_TAGS, 3)),
+                 nutrition="[1.0]",
+                 n_steps=3,
+                 steps=str([
+                     " ".join(rng.choice(_WORDS) for _ in range(8))
+                     for _ in range(3)
+                 ]),
+                 description=" ".join(rng.choice(_WORDS) for _ in range(15)),
+                 ingredients=str(rng.sample(_WORDS, 4)),
+                 n_ingredients=4))
+    return pd.DataFrame(rows)
+
+
+@pytest.fixture
+def app(tmp_path):
+    '''App with an empty DB, and its instance folder in tmp_path.
+    '''
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': str(tmp_path / 'app.sqlite'),
+    },
+                     instance_path=str(tmp_path))
+    with app.app_context():
+        db.init_db()
+    yield app
+
+
+@pytest.fixture
+def raw_recipes():
+    '''Factory of RAW_recipes dataframes, see _raw_recipes().
+    '''
+    return _raw_recipes
+
+
+@pytest.fixture
+def ingested_app(app):
+    '''App with 60 random recipes ingested.
+    '''
+    with app.app_context():
+        with db.write_db() as conn:
+            db.ingest_raw_recipes(conn, [_raw_recipes(60)])
+    yield app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def runner(app):
+    return app.test_cli_runner()
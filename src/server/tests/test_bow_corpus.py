@@ -0,0 +1,40 @@
+import pickle
+
+import pytest
+
+from app import bow_corpus
+from app.bow_corpus import MmapBowCorpus
+
+_CORPUS = [
+    [(0, 1), (3, 2)],
+    [],
+    [(1, 5)],
+    [(0, 1), (2, 1), (4, 7)],
+]
+
+
+def test_round_trip(tmp_path, monkeypatch):
+    # Several write and read batches per corpus.
+    monkeypatch.setattr(bow_corpus, "_WRITE_BATCH_SIZE", 3)
+    monkeypatch.setattr(bow_corpus, "_READ_BATCH_SIZE", 2)
+    path = str(tmp_path / "corpus")
+    corpus = _CORPUS * 3
+    bow_corpus.save_bow_corpus(path, iter(corpus))
+    assert bow_corpus.bow_corpus_exists(path)
+
+    loaded = MmapBowCorpus(path)
+    assert len(loaded) == len(corpus)
+    assert list(loaded) == corpus
+    assert [loaded[i] for i in range(len(corpus))] == corpus
+    assert loaded[-1] == corpus[-1]
+    with pytest.raises(IndexError):
+        loaded[len(corpus)]
+    assert list(pickle.loads(pickle.dumps(loaded))) == corpus
+
+
+def test_empty_corpus(tmp_path):
+    path = str(tmp_path / "corpus")
+    assert not bow_corpus.bow_corpus_exists(path)
+    bow_corpus.save_bow_corpus(path, [])
+    assert len(MmapBowCorpus(path)) == 0
+    assert list(MmapBowCorpus(path)) == []
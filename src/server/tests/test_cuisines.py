@@ -0,0 +1,62 @@
+from app import cuisines
+from app import db
+from app import modelling
+
+# Tag fragments of the cuisine corpus query the keywords replaced.
+_BASELINE_KEYWORDS = [
+    "asia", "thai", "chinese", "korea", "viet", "singapore", "italy",
+    "italian", "european", "french", "mexican", "mexic", "france", "british",
+    "britain", "mediterranean", "africa", "kenya", "israel", "middle-e",
+    "india", "halal", "arab", "egyptian", "japan", "german"
+]
+
+
+def test_keywords():
+    assert sorted(cuisines.get_keywords()) == sorted(_BASELINE_KEYWORDS)
+
+
+def test_prior_tokens():
+    assert modelling.keyword_prior_tokens(cuisines.get_prior_keywords()) == [
+        'asian', 'thai', 'chines', 'korea', 'korean', 'viet', 'vietnam',
+        'vietnames', 'singapor', 'singaporean', 'itali', 'italian',
+        'european', 'french', 'mexican', 'mexico', 'franc', 'british',
+        'britain', 'mediterranean', 'africa', 'african', 'kenya', 'kenyan',
+        'israel', 'isra', 'india', 'indian', 'halal', 'arab', 'arabian',
+        'egypt', 'egyptian', 'japan', 'japanes', 'german'
+    ]
+
+
+def test_prior_keywords_are_whole_words():
+    # Each word is one token, tag fragments like "middle-e" are not.
+    for keyword in cuisines.get_prior_keywords():
+        assert len(modelling.preprocess_document(keyword)) == 1, keyword
+
+
+def test_keywords_config(app):
+    app.config['CUISINE_KEYWORDS'] = {'thai': ['thai'], 'mexic': ['mexico']}
+    with app.app_context():
+        assert cuisines.get_keywords() == ['thai', 'mexic']
+        assert cuisines.get_prior_keywords() == ['thai', 'mexico']
+    app.config['CUISINE_KEYWORDS'] = ['thai', 'italian']
+    with app.app_context():
+        assert cuisines.get_prior_keywords() == ['thai', 'italian']
+
+
+def test_doc_cuisines_match_tags(ingested_app):
+    # A doc belongs to a keyword if one of its tags contains it.
+    with ingested_app.app_context():
+        conn = db.get_db()
+        for keyword in cuisines.get_keywords():
+            expected = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT doc_id FROM doc_tags WHERE tag LIKE ?",
+                    (f"%{keyword}%", ))
+            }
+            found = {
+                row[0]
+                for row in conn.execute(
+                    "SELECT doc_id FROM doc_cuisines WHERE cuisine = ?",
+                    (keyword, ))
+            }
+            assert found == expected, keyword
@@ -0,0 +1,95 @@
+from app import corpus_stats
+from app import db
+
+
+def _doc_names(conn):
+    return {
+        row[0]: row[1]
+        for row in conn.execute(
+            "SELECT third_party_id, document_name FROM corpus")
+    }
+
+
+def _doc_ids(conn):
+    return {
+        row[0]: row[1]
+        for row in conn.execute("SELECT third_party_id, id FROM corpus")
+    }
+
+
+def test_upsert_counts(ingested_app, raw_recipes):
+    df = raw_recipes(60)
+    df.loc[df["id"] == 1001, "description"] = "changed description"
+    df = df[df["id"] != 1002]
+    delta = raw_recipes(5, seed=1, first_id=2000)
+    with ingested_app.app_context():
+        with db.write_db() as conn:
+            counts = db.upsert_raw_recipes(conn, [df, delta],
+                                           delete_missing=True)
+        assert counts == dict(inserted=5,
+                              updated=1,
+                              deleted=1,
+                              unchanged=58,
+                              skipped=0)
+        conn = db.get_db()
+        names = _doc_names(conn)
+        assert len(names) == 64
+        assert 1002 not in names
+        row = conn.execute(
+            "SELECT id, document_text FROM corpus"
+            " WHERE third_party_id = 1001").fetchone()
+        # Updated docs get a new corpus id, above the ingested ones.
+        assert row["id"] > 60
+        assert row["document_text"] == "changed description"
+
+
+def test_upsert_unchanged(ingested_app, raw_recipes):
+    with ingested_app.app_context():
+        last_doc_id = db.read_last_doc_id(ingested_app.config['DATABASE'])
+        with db.write_db() as conn:
+            counts = db.upsert_raw_recipes(conn, [raw_recipes(60)])
+        assert counts["unchanged"] == 60
+        assert counts["inserted"] == counts["updated"] == 0
+        assert db.read_last_doc_id(
+            ingested_app.config['DATABASE']) == last_doc_id
+
+
+def test_upsert_keeps_missing(ingested_app, raw_recipes):
+    with ingested_app.app_context():
+        with db.write_db() as conn:
+            counts = db.upsert_raw_recipes(conn, [raw_recipes(10)])
+        assert counts["deleted"] == 0
+        assert len(_doc_names(db.get_db())) == 60
+
+
+def test_deleted_ids_are_not_reused(ingested_app, raw_recipes):
+    with ingested_app.app_context():
+        with db.write_db() as conn:
+            db.delete_docs(conn, [60])
+        assert db.read_last_doc_id(ingested_app.config['DATABASE']) == 60
+        with db.write_db() as conn:
+            counts = db.upsert_raw_recipes(
+                conn, [raw_recipes(1, seed=1, first_id=5000)])
+        assert counts["inserted"] == 1
+        assert _doc_ids(db.get_db())[5000] == 61
+
+
+def _stats(conn):
+    return [
+        sorted(tuple(x) for x in conn.execute(f"SELECT * FROM {table}"))
+        for table in ("corpus_stats", "corpus_length_hist")
+    ]
+
+
+def test_upsert_updates_stats(ingested_app, raw_recipes):
+    df = raw_recipes(60)
+    df.loc[df["id"] < 1005, "description"] = "changed " * 100
+    df = df[df["id"] != 1010]
+    with ingested_app.app_context():
+        with db.write_db() as conn:
+            db.upsert_raw_recipes(
+                conn, [df, raw_recipes(5, seed=1, first_id=2000)],
+                delete_missing=True)
+            updated = _stats(conn)
+            corpus_stats.refresh_corpus_stats(conn)
+            assert updated == _stats(conn)
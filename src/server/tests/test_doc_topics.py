@@ -0,0 +1,96 @@
+import numpy as np
+from gensim.corpora import Dictionary
+
+from app import db
+from app import doc_topics
+from app import model_store
+from app import modelling
+from app import sql_strings
+
+
+def _top_docs(n=3):
+    top_docs = doc_topics.TopDocs(num_topics=2, n=n)
+    top_docs.update([1, 2, 3],
+                    np.array([[0.5, 0.5], [0.25, 0.75], [0.5, 0.375]]))
+    top_docs.update([4, 5], np.array([[0.75, 0.25], [0.125, 0.875]]))
+    return top_docs
+
+
+def test_top_docs_ranked():
+    assert list(_top_docs().ranked()) == [
+        (0, 0, 4, 0.75),
+        (0, 1, 1, 0.5),
+        (0, 2, 3, 0.5),
+        (1, 0, 5, 0.875),
+        (1, 1, 2, 0.75),
+        (1, 2, 1, 0.5),
+    ]
+
+
+def test_top_docs_fewer_docs_than_n():
+    ranked = list(_top_docs(n=10).ranked())
+    assert len(ranked) == 10
+    assert [x[2] for x in ranked if x[0] == 0] == [4, 1, 3, 2, 5]
+
+
+def test_read_top_docs_after_delete(ingested_app):
+    with ingested_app.app_context():
+        with db.write_db() as conn:
+            doc_topics._write_top_docs(conn, "v1", _top_docs())
+            db.delete_docs(conn, [1])
+        docs = doc_topics.read_top_docs(db.get_db(), "v1", 0, 3)
+        assert [(x["rank"], x["doc_id"]) for x in docs] == [(0, 4), (1, 3)]
+
+
+def _save_model(path, database):
+    docs = modelling.preprocess_documents(list(db.DocTextStream(database)),
+                                          workers=1)
+    dictionary = Dictionary(docs)
+    model = modelling.train_lda_model([dictionary.doc2bow(x) for x in docs],
+                                      dictionary,
+                                      modelling.create_eta(dictionary),
+                                      passes=1,
+                                      num_topics=2,
+                                      workers=1)
+    modelling.try_save_dictionary(path, dictionary)
+    modelling.save_model_artifacts(path, model)
+
+
+def test_compute_doc_topics_reuse(ingested_app, raw_recipes):
+    database = ingested_app.config['DATABASE']
+    instance_path = ingested_app.instance_path
+    with ingested_app.app_context():
+        version, base_path = model_store.create_version_path(instance_path)
+        _save_model(base_path, database)
+        doc_topics.compute_doc_topics(database,
+                                      instance_path,
+                                      base_path,
+                                      workers=1)
+        model_store.publish_version(instance_path, version)
+        base_ids, base = doc_topics.load_doc_topics(base_path)
+
+        with db.write_db() as conn:
+            db.delete_docs(conn, [60])
+            db.upsert_raw_recipes(conn,
+                                  [raw_recipes(3, seed=1, first_id=5000)])
+        _, path = model_store.create_version_path(instance_path)
+        _save_model(path, database)
+        # Docs 50 to 59 were seen by the base version, they are inferred
+        # again rather than copied.
+        docs = db.DocTextStream(
+            database,
+            sql=sql_strings._SELECT_CUISINE_TEXT_DATA_BY_ID_RANGE,
+            params=(49, 63))
+        n_docs = doc_topics.compute_doc_topics(database,
+                                               instance_path,
+                                               path,
+                                               docs=docs,
+                                               workers=1,
+                                               reuse_path=base_path)
+        ids, matrix = doc_topics.load_doc_topics(path)
+        current = db.read_cuisine_doc_ids(database)
+        assert n_docs == len(ids) == len(current)
+        assert sorted(ids) == list(current)
+        assert 60 not in ids
+        reused = np.isin(base_ids, ids[ids < 50])
+        np.testing.assert_array_equal(matrix[ids < 50], base[reused])
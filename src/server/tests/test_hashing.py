@@ -0,0 +1,49 @@
+import pytest
+
+from app.hashing import HashingDictionary, token_bucket
+
+_DOCS = [["curry", "rice", "basil"], ["curry", "rice"], ["curry", "pasta"],
+         ["curry", "lime"]]
+
+
+def _dictionary(num_buckets=1000):
+    dictionary = HashingDictionary(num_buckets)
+    dictionary.add_documents(_DOCS)
+    return dictionary
+
+
+def test_doc2bow():
+    dictionary = _dictionary()
+    bow = dictionary.doc2bow(["rice", "curry", "rice"])
+    assert bow == sorted([(token_bucket("rice", 1000), 2),
+                          (token_bucket("curry", 1000), 1)])
+    assert dictionary.doc2bow(["unseen"]) == [(token_bucket("unseen",
+                                                            1000), 1)]
+    assert dictionary.num_docs == 4
+    assert dictionary.dfs[token_bucket("curry", 1000)] == 4
+    assert dictionary[token_bucket("rice", 1000)] == "rice"
+
+
+def test_filter_extremes():
+    dictionary = _dictionary()
+    dictionary.filter_extremes(no_below=2, no_above=0.9)
+    # curry is in every doc, basil, pasta and lime in one.
+    assert dictionary.doc2bow(["curry", "rice", "basil",
+                               "lime"]) == [(token_bucket("rice", 1000), 1)]
+    assert "curry" not in dictionary.token2id
+    assert dictionary.token2id["rice"] == token_bucket("rice", 1000)
+    # Ids are kept, the vocabulary size does not change.
+    assert len(dictionary) == 1000
+
+
+def test_shared_bucket_label():
+    # With one bucket every token shares id 0, the majority token labels it.
+    dictionary = HashingDictionary(1)
+    dictionary.add_documents([["rice", "curry"], ["lime", "curry", "curry"]])
+    assert dictionary.doc2bow(["curry", "rice"]) == [(0, 2)]
+    assert dictionary[0] == "curry"
+
+
+def test_num_buckets():
+    with pytest.raises(ValueError):
+        HashingDictionary(0)
@@ -0,0 +1,97 @@
+import os
+import logging
+import threading
+import time
+
+from gensim.corpora import Dictionary
+
+from app import jobs
+from app import modelling
+
+
+class _FakeProcess:
+
+    def __init__(self, target, args, name):
+        self.name = name
+
+    def start(self):
+        pass
+
+
+class _FakeContext:
+    Process = _FakeProcess
+
+
+def _no_spawn(monkeypatch):
+    # Jobs stay queued, their process is never started.
+    monkeypatch.setattr(jobs.multiprocessing, "get_context",
+                        lambda method: _FakeContext())
+
+
+def test_concurrent_submit_starts_one_job(app, monkeypatch):
+    _no_spawn(monkeypatch)
+    results = []
+    barrier = threading.Barrier(8)
+
+    def submit():
+        barrier.wait()
+        results.append(
+            jobs.submit_training_job(app.config['DATABASE'],
+                                     app.instance_path))
+
+    threads = [threading.Thread(target=submit) for _ in range(8)]
+    for x in threads:
+        x.start()
+    for x in threads:
+        x.join()
+    assert len([x for x in results if x is not None]) == 1
+    assert len(jobs.list_jobs(app.instance_path)) == 1
+
+
+def test_ensure_does_not_retry_recent_failure(app, client, monkeypatch):
+    _no_spawn(monkeypatch)
+    failed = {
+        "job_id": "20260101-000000-abcdef",
+        "state": "failed",
+        "pid": None,
+        "submitted": time.time() - 10,
+        "finished": time.time() - 5,
+        "error": "OperationalError('no such table: corpus')",
+    }
+    os.makedirs(jobs.jobs_path(app.instance_path))
+    jobs.write_job_status(app.instance_path, failed)
+    for _ in range(3):
+        response = client.get('/topic/topic_main')
+        assert response.status_code == 200
+        assert failed["job_id"].encode() in response.data
+    assert len(jobs.list_jobs(app.instance_path)) == 1
+
+    failed["finished"] -= jobs._RETRY_FAILED_SECONDS
+    jobs.write_job_status(app.instance_path, failed)
+    status = jobs.ensure_training_job(app.config['DATABASE'],
+                                      app.instance_path)
+    assert status["state"] == "queued"
+    assert len(jobs.list_jobs(app.instance_path)) == 2
+
+
+def test_progress_of_single_worker_training(tmp_path, caplog):
+    # With one worker the model is trained by LdaModel, whose progress
+    # message has fewer args than LdaMulticore's.
+    caplog.set_level(logging.INFO, logger="gensim.models")
+    docs = [["curry", "rice", "basil"], ["pasta", "tomato", "basil"]] * 10
+    dictionary = Dictionary(docs)
+    status = {"job_id": "20260101-000000-abcdef"}
+    os.makedirs(jobs.jobs_path(str(tmp_path)))
+    handler = jobs._ProgressHandler(str(tmp_path), status)
+    logging.getLogger("gensim.models").addHandler(handler)
+    try:
+        modelling.train_lda_model([dictionary.doc2bow(x) for x in docs],
+                                  dictionary,
+                                  modelling.create_eta(dictionary),
+                                  passes=2,
+                                  num_topics=2,
+                                  workers=1)
+    finally:
+        logging.getLogger("gensim.models").removeHandler(handler)
+    assert status["pass"] == 2
+    assert status["docs_done"] == status["docs_total"] == 20
@@ -0,0 +1,61 @@
+from gensim.corpora import Dictionary
+
+from app import modelling
+
+_DOCS = [
+    "Thai green curry with coconut milk and basil.",
+    "Bake the bread at 200 degrees for 45 minutes!",
+    "<p>Quick Italian pasta</p> with tomatoes, garlic & olive oil",
+    "",
+    "Stir-fried noodles; serve hot with chopped spring onions.",
+] * 5
+
+
+def test_preprocess_document():
+    assert modelling.preprocess_document("Stirring the 3 Onions!") == [
+        "stir", "onion"
+    ]
+
+
+def test_parallel_preprocessing_matches_serial():
+    serial = modelling.preprocess_documents(_DOCS, workers=1)
+    assert serial == [modelling.preprocess_document(x) for x in _DOCS]
+    assert modelling.preprocess_documents(_DOCS, workers=2,
+                                          chunksize=3) == serial
+
+
+def test_extend_dictionary_keeps_ids():
+    docs = [["curry", "rice", "basil"], ["curry", "rice"], ["pasta", "basil"]]
+    dictionary = Dictionary(docs)
+    token2id = dict(dictionary.token2id)
+    new_docs = [["curry", "noodle", "lime"], ["noodle", "lime"],
+                ["noodle", "tofu"]]
+    added = modelling.extend_dictionary(dictionary, [new_docs],
+                                        dict(no_below=2, no_above=1.0))
+    # tofu is only in one new doc.
+    assert added == 2
+    assert {x: dictionary.token2id[x] for x in token2id} == token2id
+    assert sorted(dictionary.token2id) == sorted(
+        list(token2id) + ["noodle", "lime"])
+    assert dictionary.token2id["noodle"] >= len(token2id)
+    assert dictionary.token2id["lime"] >= len(token2id)
+
+
+def test_extend_dictionary_keep_n():
+    dictionary = Dictionary([["curry", "rice"]])
+    added = modelling.extend_dictionary(
+        dictionary, [[["noodle", "lime"], ["noodle", "lime"], ["noodle"]]],
+        dict(no_below=1, no_above=1.0, keep_n=3))
+    # Most frequent new tokens first, up to keep_n tokens in all.
+    assert added == 1
+    assert "noodle" in dictionary.token2id
+    assert "lime" not in dictionary.token2id
+
+
+def test_create_eta_keyword_iterator():
+    dictionary = Dictionary([["thai", "curry"], ["italian", "pasta"]])
+    eta = modelling.create_eta(dictionary, iter(["thai", "italian"]), 0.5)
+    assert eta[dictionary.token2id["thai"]] == 0.25
+    assert eta[dictionary.token2id["curry"]] == 0.25
+    eta = modelling.create_eta(dictionary, iter(["thai"]), 0.5)
+    assert eta[dictionary.token2id["thai"]] == 0.5
@@ -0,0 +1,77 @@
+import json
+
+from gensim.corpora import Dictionary
+
+from app import modelling
+from app import registry
+
+
+def test_corpus_docs_pages(ingested_app):
+    client = ingested_app.test_client()
+    doc_ids, after = [], 0
+    while after is not None:
+        data = client.get(f"/topic/corpus/docs?after={after}&limit=25").json
+        assert len(data["docs"]) <= 25
+        doc_ids.extend(x["doc_id"] for x in data["docs"])
+        after = data["next_after"]
+    assert doc_ids == list(range(1, 61))
+
+
+def test_corpus_docs_last_full_page(ingested_app):
+    # A full last page still has a next_after, the next one is empty.
+    client = ingested_app.test_client()
+    data = client.get("/topic/corpus/docs?after=40&limit=20").json
+    assert data["next_after"] == 60
+    data = client.get("/topic/corpus/docs?after=60&limit=20").json
+    assert data == {"docs": [], "next_after": None}
+
+
+def test_corpus_docs_ndjson(ingested_app):
+    response = ingested_app.test_client().get(
+        "/topic/corpus/docs?after=10&limit=5&format=ndjson")
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(x)["doc_id"] for x in lines] == [11, 12, 13, 14, 15]
+
+
+def test_corpus_docs_bad_args(client):
+    assert client.get("/topic/corpus/docs?after=-1").status_code == 400
+    assert client.get("/topic/corpus/docs?limit=0").status_code == 400
+    assert client.get("/topic/corpus/docs?format=csv").status_code == 400
+
+
+def _train_model(app):
+    '''Train a small model on made up docs and publish it in the instance
+    folder.
+    '''
+    docs = [["curry", "rice", "basil", "lime"], ["pasta", "tomato", "basil"],
+            ["curry", "noodle", "lime"], ["pasta", "cheese", "tomato"]] * 5
+    dictionary = Dictionary(docs)
+    corpus = [dictionary.doc2bow(x) for x in docs]
+    model = modelling.train_lda_model(corpus,
+                                      dictionary,
+                                      modelling.create_eta(dictionary),
+                                      passes=1,
+                                      num_topics=2,
+                                      workers=1)
+    modelling.try_save_dictionary(app.instance_path, dictionary)
+    modelling.save_model_artifacts(app.instance_path, model)
+    registry.get_registry().reload(force=True)
+
+
+def test_topic_main_not_modified(app):
+    client = app.test_client()
+    with app.app_context():
+        _train_model(app)
+    response = client.get("/topic/topic_main")
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+    assert response.last_modified
+
+    response = client.get("/topic/topic_main",
+                          headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+    assert response.get_data() == b""
+
+    response = client.get("/topic/topic_main",
+                          headers={"If-None-Match": '"another-version"'})
+    assert response.status_code == 200
@@ -0,0 +1,11 @@
+from app import updates
+
+
+def test_update_model_without_model_retrains(runner, monkeypatch):
+    retrained = []
+    monkeypatch.setattr(updates, "_retrain",
+                        lambda *args: retrained.append(args))
+    result = runner.invoke(args=["update-model"])
+    assert result.exception is None
+    assert "retrain it first, training from scratch." in result.output
+    assert len(retrained) == 1